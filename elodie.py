@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 
 from __future__ import print_function
+import itertools
+import json
 import os
+import random
 import re
 import sys
+import time
 from datetime import datetime
 
 import click
-from send2trash import send2trash
 
 # Verify that external dependencies are present first, so the user gets a
 # more user-friendly error instead of an ImportError traceback.
@@ -21,57 +24,45 @@ from elodie import log
 from elodie.compatability import _decode
 from elodie.config import load_config
 from elodie.filesystem import FileSystem
-from elodie.localstorage import Db
+from elodie.importer import ImportJournal, Importer
+from elodie.localstorage import (checksum_algorithms, close_session,
+                                 get_checksum_algorithm, get_session,
+                                 size_and_mtime, SqliteDb)
 from elodie.media.base import Base, get_all_subclasses
 from elodie.media.media import Media
 from elodie.media.text import Text
 from elodie.media.audio import Audio
 from elodie.media.photo import Photo
 from elodie.media.video import Video
+from elodie.pipeline import Pipeline, Stage
 from elodie.plugins.plugins import Plugins
 from elodie.result import Result
+from elodie.scrub import Scrub
 from elodie.external.pyexiftool import ExifTool
 from elodie.dependencies import get_exiftool
 from elodie import constants
 
 FILESYSTEM = FileSystem()
 
-def import_file(_file, destination, album_from_folder, trash, allow_duplicates):
-    
-    _file = _decode(_file)
-    destination = _decode(destination)
+#: Seconds between writing the hash db to disk while generate-db runs.
+GENERATE_DB_CHECKPOINT_SECONDS = 60
 
+def import_file(_file, destination, album_from_folder, trash, allow_duplicates):
     """Set file metadata and move it to destination.
     """
-    if not os.path.exists(_file):
-        log.warn('Could not find %s' % _file)
-        log.all('{"source":"%s", "error_msg":"Could not find %s"}' %
-                  (_file, _file))
-        return
-    # Check if the source, _file, is a child folder within destination
-    elif destination.startswith(os.path.abspath(os.path.dirname(_file))+os.sep):
-        log.all('{"source": "%s", "destination": "%s", "error_msg": "Source cannot be in destination"}' % (
-            _file, destination))
-        return
-
-
-    media = Media.get_class_by_file(_file, get_all_subclasses())
-    if not media:
-        log.warn('Not a supported file (%s)' % _file)
-        log.all('{"source":"%s", "error_msg":"Not a supported file"}' % _file)
-        return
-
-    if album_from_folder:
-        media.set_album_from_folder()
-
-    dest_path = FILESYSTEM.process_file(_file, destination,
-        media, allowDuplicate=allow_duplicates, move=False)
-    if dest_path:
-        log.all('%s -> %s' % (_file, dest_path))
-    if trash:
-        send2trash(_file)
-
-    return dest_path or None
+    importer = Importer(FILESYSTEM, destination, album_from_folder, trash,
+                        allow_duplicates)
+    return importer.import_file(_file)
+
+def set_checksum_cache(no_checksum_cache, rehash):
+    """Turn off the session's checksum cache or make it hash every file.
+    """
+    db = get_session()
+    if no_checksum_cache:
+        db.checksum_cache.close()
+        db.checksum_cache = None
+    else:
+        db.checksum_cache.rehash = rehash
 
 @click.command('batch')
 @click.option('--debug', default=False, is_flag=True,
@@ -101,48 +92,91 @@ def _batch(debug):
               help='Override the value in constants.py with True.')
 @click.option('--exclude-regex', default=set(), multiple=True,
               help='Regular expression for directories or files to exclude.')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of files to import at the same time.')
+@click.option('--stats', default=False, is_flag=True,
+              help='Show how busy each stage of the import was.')
+@click.option('--link', default='copy',
+              type=click.Choice(['hard', 'reflink', 'copy']),
+              help=('Hard link or reflink files into the destination instead '
+                    'of copying them when it is on the same filesystem.'))
+@click.option('--no-checksum-cache', default=False, is_flag=True,
+              help="Don't use or update the cache of checksums from earlier runs.")
+@click.option('--rehash', default=False, is_flag=True,
+              help='Hash every file again instead of trusting the checksum cache.')
+@click.option('--resume', default=False, is_flag=True,
+              help=('Skip files the last import into this destination '
+                    'finished and retry the ones which failed.'))
+@click.option('--from-list', type=click.File('rb'),
+              help=('Import the files listed in this file, or - to read the '
+                    'list from stdin. Paths are separated by new lines.'))
+@click.option('--null', '-0', default=False, is_flag=True,
+              help=('Paths in --from-list are separated by NUL characters, '
+                    'like the output of find -print0.'))
+@click.option('--order', type=click.Choice(['path', 'inode', 'extent']),
+              help=('Order to read files in. Inode and extent order are '
+                    'closer to where files are on disk.'))
 @click.argument('paths', nargs=-1, type=click.Path())
-def _import(destination, source, file, album_from_folder, trash, allow_duplicates, debug, exclude_regex, paths):
+def _import(destination, source, file, album_from_folder, trash, allow_duplicates, debug, exclude_regex, jobs, stats, link, no_checksum_cache, rehash, resume, from_list, null, order, paths):
     """Import files or directories by reading their EXIF and organizing them accordingly.
     """
     constants.debug = debug
+    set_checksum_cache(no_checksum_cache, rehash)
     has_errors = False
     result = Result()
 
     destination = _decode(destination)
     destination = os.path.abspath(os.path.expanduser(destination))
 
-    files = set()
-    paths = set(paths)
+    paths = list(paths)
     if source:
         source = _decode(source)
-        paths.add(source)
+        paths.append(source)
     if file:
-        paths.add(file)
+        paths.append(file)
 
     # if no exclude list was passed in we check if there's a config
+    config = load_config()
     if len(exclude_regex) == 0:
-        config = load_config()
         if 'Exclusions' in config:
             exclude_regex = [value for key, value in config.items('Exclusions')]
 
-    exclude_regex_list = set(exclude_regex)
+    import_config = {}
+    if 'Import' in config:
+        import_config = config['Import']
+    if order is None:
+        order = import_config.get('order', 'path')
 
-    for path in paths:
-        path = os.path.expanduser(path)
-        if os.path.isdir(path):
-            files.update(FILESYSTEM.get_all_files(path, None, exclude_regex_list))
-        else:
-            if not FILESYSTEM.should_exclude(path, exclude_regex_list, True):
-                files.add(path)
+    exclude_regex_list = set(exclude_regex)
 
-    for current_file in files:
-        dest_path = import_file(current_file, destination, album_from_folder,
-                    trash, allow_duplicates)
+    journal = ImportJournal(destination, resume)
+    if resume and not journal.resumed:
+        log.warn('No import into %s to resume' % destination)
+    importer = Importer(FILESYSTEM, destination, album_from_folder, trash,
+                        allow_duplicates, jobs, link, journal)
+    # Files are imported while we're still looking for more, in a stable
+    #  order so that --jobs gives the same result as importing them one at
+    #  a time.
+    seen = {}
+    files = FILESYSTEM.discover_files(paths, exclude_regex_list, seen=seen)
+    if from_list:
+        # Listed files are filtered like the ones we find in directories.
+        files = itertools.chain(files, FILESYSTEM.discover_files(
+            FILESYSTEM.read_path_list(from_list, b'\0' if null else b'\n'),
+            exclude_regex_list, True,
+            seen))
+    # Reading files in the order they're laid out on disk saves seeking.
+    files = FILESYSTEM.order_files(
+        files, order, int(import_config.get('order_window', 10000)))
+    for current_file, dest_path in importer.import_files(files):
         result.append((current_file, dest_path))
         has_errors = has_errors is True or not dest_path
 
+    journal.close()
+    close_session()
     result.write()
+    if stats:
+        importer.pipeline.write_stats()
 
     if has_errors:
         sys.exit(1)
@@ -153,54 +187,348 @@ def _import(destination, source, file, album_from_folder, trash, allow_duplicate
               required=True, help='Source of your photo library.')
 @click.option('--debug', default=False, is_flag=True,
               help='Override the value in constants.py with True.')
-def _generate_db(source, debug):
+@click.option('--no-checksum-cache', default=False, is_flag=True,
+              help="Don't use or update the cache of checksums from earlier runs.")
+@click.option('--rehash', default=False, is_flag=True,
+              help='Hash every file again instead of trusting the checksum cache.')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of files to hash at the same time.')
+@click.option('--incremental', default=False, is_flag=True,
+              help=('Keep the hash database and only hash files which are '
+                    'new or changed.'))
+@click.option('--restart', default=False, is_flag=True,
+              help='Start over instead of resuming an interrupted run.')
+def _generate_db(source, debug, no_checksum_cache, rehash, jobs, incremental,
+                 restart):
     """Regenerate the hash.json database which contains all of the sha256 signatures of media files. The hash.json file is located at ~/.elodie/.
     """
     constants.debug = debug
+    set_checksum_cache(no_checksum_cache, rehash)
     result = Result()
     source = os.path.abspath(os.path.expanduser(source))
 
     if not os.path.isdir(source):
         log.error('Source is not a valid directory %s' % source)
         sys.exit(1)
-        
-    db = Db()
-    db.backup_hash_db()
-    db.reset_hash_db()
 
-    for current_file in FILESYSTEM.get_all_files(source):
+    db = get_session()
+    checkpoint = {'source': source}
+    # Files already in the hash db and their checksums. A file whose size
+    #  and modification time are the same as in the stat db isn't read.
+    existing = {}
+    # Files which an interrupted run already added and we skip.
+    done = set()
+    if incremental:
+        for checksum, file_path in db.all():
+            if file_path.startswith(source + os.sep):
+                existing[file_path] = checksum
+    elif not restart and load_generate_db_checkpoint() == checkpoint:
+        log.all(('Resuming the interrupted generate-db of %s. Run with '
+                 '--restart to start over.') % source)
+        done = set(file_path for checksum, file_path in db.all())
+    else:
+        db.backup_hash_db()
+        db.reset_hash_db()
+        db.flush()
+        write_generate_db_checkpoint(checkpoint)
+
+    def hash_file(current_file):
+        try:
+            stat = os.stat(current_file)
+            previous = existing.get(current_file)
+            if(previous is not None and not rehash and
+                    db.get_stat(previous) == size_and_mtime(stat)):
+                return (previous, None, size_and_mtime(stat))
+
+            checksum = db.checksum(current_file, stat=stat)
+            sample = None
+            if previous != checksum:
+                sample = db.checksum_sample(current_file, stat.st_size)
+        except (IOError, OSError) as e:
+            log.warn('Could not hash %s: %s' % (current_file, e))
+            return None
+        return (checksum, sample, size_and_mtime(stat))
+
+    files = (
+        current_file for current_file in FILESYSTEM.get_all_files(source)
+        if current_file not in done
+    )
+    pipeline = Pipeline([Stage('checksum', hash_file, jobs)], jobs * 4)
+    checkpointed = time.time()
+    for current_file, hashed in pipeline.run(files):
+        if hashed is None:
+            result.append((current_file, False))
+            log.progress('x')
+            continue
+
+        checksum, sample, stat = hashed
+        previous = existing.pop(current_file, None)
+        if previous != checksum:
+            remove_hash_of(db, previous, current_file)
+            db.add_hash(checksum, current_file)
+            if sample is not None:
+                db.add_sample(sample, checksum)
+        if db.get_hash(checksum) == current_file:
+            db.add_stat(checksum, stat)
         result.append((current_file, True))
-        db.add_hash(db.checksum(current_file), current_file)
         log.progress()
-    
-    db.update_hash_db()
+
+        # Write what we have so far so an interrupted run can resume.
+        if time.time() - checkpointed > GENERATE_DB_CHECKPOINT_SECONDS:
+            db.flush()
+            checkpointed = time.time()
+
+    # Files which were deleted or are excluded now.
+    for current_file, checksum in existing.items():
+        remove_hash_of(db, checksum, current_file)
+
+    close_session()
+    if load_generate_db_checkpoint() == checkpoint:
+        os.remove(constants.generate_db_checkpoint)
     log.progress('', True)
     result.write()
 
-@click.command('verify')
+def load_generate_db_checkpoint():
+    """Load the checkpoint of an interrupted generate-db run.
+
+    :returns: dict or None
+    """
+    try:
+        with open(constants.generate_db_checkpoint, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def write_generate_db_checkpoint(checkpoint):
+    with open(constants.generate_db_checkpoint, 'w') as f:
+        json.dump(checkpoint, f)
+
+def remove_hash_of(db, checksum, file_path):
+    """Remove a checksum from the hash db if it still belongs to file_path.
+    """
+    if checksum is not None and db.get_hash(checksum) == file_path:
+        db.remove_hash(checksum)
+
+@click.command('export-db')
+@click.option('--debug', default=False, is_flag=True,
+              help='Override the value in constants.py with True.')
+def _export_db(debug):
+    """Export the SQLite database to the hash.json and location.json files located at ~/.elodie/.
+    """
+    constants.debug = debug
+    db = get_session()
+    if not isinstance(db, SqliteDb):
+        log.error('The SQLite backend is not enabled in config.ini')
+        sys.exit(1)
+
+    db.export_to_json()
+    close_session()
+
+
+@click.command('migrate-hashes')
+@click.option('--algorithm', type=click.Choice(sorted(checksum_algorithms)),
+              help=('Checksum algorithm to use. Defaults to the one in '
+                    'config.ini.'))
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of files to hash at the same time.')
 @click.option('--debug', default=False, is_flag=True,
               help='Override the value in constants.py with True.')
-def _verify(debug):
+def _migrate_hashes(algorithm, jobs, debug):
+    """Re-key the hash database with a different checksum algorithm. Files which can't be found keep their old checksum.
+    """
     constants.debug = debug
     result = Result()
-    db = Db()
-    for checksum, file_path in db.all():
+    db = get_session()
+    if algorithm is None:
+        algorithm = db.checksum_algorithm
+    elif algorithm != db.checksum_algorithm:
+        log.warn(('Set algorithm=%s in the [Checksum] section of config.ini '
+                  'so imports use the migrated hash db') % algorithm)
+
+    def rehash(entry):
+        checksum, file_path = entry
+        if get_checksum_algorithm(checksum) == algorithm:
+            return checksum
         if not os.path.isfile(file_path):
+            return None
+        return db.checksum(file_path, algorithm=algorithm)
+
+    entries = list(db.all())
+    samples = list(db.all_samples())
+    stats = list(db.all_stats())
+    migrated = {}
+    pipeline = Pipeline([Stage('checksum', rehash, jobs)], jobs * 4)
+    for (checksum, file_path), new_checksum in pipeline.run(entries):
+        if new_checksum is None:
+            migrated[checksum] = checksum
             result.append((file_path, False))
-            log.progress('x')
-            continue
-
-        actual_checksum = db.checksum(file_path)
-        if checksum == actual_checksum:
-            result.append((file_path, True))
-            log.progress()
+            log.warn('Could not find %s' % file_path)
         else:
+            migrated[checksum] = new_checksum
+            result.append((file_path, True))
+        log.progress()
+
+    db.backup_hash_db()
+    db.reset_hash_db()
+    for checksum, file_path in entries:
+        db.add_hash(migrated[checksum], file_path)
+    for sample, checksum in samples:
+        db.add_sample(sample, migrated.get(checksum, checksum))
+    for checksum, stat in stats:
+        db.add_stat(migrated.get(checksum, checksum), stat)
+
+    close_session()
+    log.progress('', True)
+    result.write()
+
+
+@click.command('verify')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of files to verify at the same time.')
+@click.option('--order', default='inode', type=click.Choice(['inode', 'path']),
+              help=('Order to read files in. Inode order is usually closest '
+                    'to where files are on disk.'))
+@click.option('--quick', default=False, is_flag=True,
+              help=("Only check that files exist and their size and "
+                    "modification time haven't changed."))
+@click.option('--sample', type=float,
+              help=('Hash this percentage of files, picked at random, and '
+                    'quickly check the rest.'))
+@click.option('--debug', default=False, is_flag=True,
+              help='Override the value in constants.py with True.')
+def _verify(jobs, order, quick, sample, debug):
+    constants.debug = debug
+    if sample is not None and not 0 <= sample <= 100:
+        raise click.BadParameter('must be between 0 and 100',
+                                 param_hint='--sample')
+    result = Result()
+    set_checksum_cache(False, False)
+    db = get_session()
+
+    entries = []
+    for checksum, file_path in db.all():
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None
+        if stat is None or not os.path.isfile(file_path):
             result.append((file_path, False))
             log.progress('x')
+            continue
 
+        # Verifying is about finding files which changed without their size
+        #  or modification time changing so we read them unless asked not
+        #  to.
+        full = not quick
+        if sample is not None:
+            full = random.random() * 100 < sample
+        entries.append((checksum, file_path, stat, full))
+
+    # Reading files in the order they're laid out on disk saves seeking.
+    if order == 'inode':
+        entries.sort(key=lambda entry: (entry[2].st_dev, entry[2].st_ino))
+    else:
+        entries.sort(key=lambda entry: entry[1])
+
+    pipeline = Pipeline(
+        [Stage('verify', lambda entry: verify_file(db, *entry), jobs)],
+        jobs * 4
+    )
+    for (checksum, file_path, stat, full), verified in pipeline.run(entries):
+        result.append((file_path, verified is True))
+        log.progress('.' if verified is True else 'x')
+
+    close_session()
     log.progress('', True)
     result.write()
 
+def verify_file(db, checksum, file_path, stat, full=True):
+    """Check that a file still has the checksum it has in the hash db.
+
+    :param Db db: Session the checksum came from.
+    :param str checksum: Checksum from the hash db.
+    :param str file_path: Path from the hash db.
+    :param stat: Result of os.stat() for the file.
+    :param bool full: Read the file. Otherwise only its size and
+        modification time are compared with the stat db. Files which aren't
+        in the stat db are looked up in the checksum cache and read if they
+        aren't there either.
+    :returns: bool
+    """
+    # Each checksum is checked with the algorithm it was made with.
+    algorithm = get_checksum_algorithm(checksum)
+    if not full:
+        stored = db.get_stat(checksum)
+        if stored is not None:
+            return stored == size_and_mtime(stat)
+        if db.checksum_cache is not None:
+            cached = db.checksum_cache.get(stat)
+            if cached is not None and get_checksum_algorithm(cached) == algorithm:
+                return cached == checksum
+
+    try:
+        verified = db.checksum(file_path, algorithm=algorithm, rehash=True,
+                               stat=stat) == checksum
+    except (IOError, OSError) as e:
+        log.warn('Could not read %s: %s' % (file_path, e))
+        return False
+
+    # The next quick verify can trust a file we just read.
+    if verified:
+        db.add_stat(checksum, size_and_mtime(stat))
+    return verified
+
+
+@click.command('scrub')
+@click.option('--cycle-days', type=click.IntRange(min=1),
+              help='Number of days to read the whole library in.')
+@click.option('--bandwidth', type=float,
+              help='Read at most this many MB a second.')
+@click.option('--time-budget', type=float,
+              help="Don't start reading another file after this many minutes.")
+@click.option('--debug', default=False, is_flag=True,
+              help='Override the value in constants.py with True.')
+def _scrub(cycle_days, bandwidth, time_budget, debug):
+    """Verify the next slice of the library so all of it is read once every cycle. Corrupt and missing files are printed as JSON lines.
+    """
+    constants.debug = debug
+    config = load_config()
+    scrub_config = {}
+    if 'Scrub' in config:
+        scrub_config = config['Scrub']
+    if cycle_days is None:
+        cycle_days = int(scrub_config.get('cycle_days', 30))
+    if bandwidth is None and 'bandwidth' in scrub_config:
+        bandwidth = float(scrub_config['bandwidth'])
+    if time_budget is None and 'time_budget' in scrub_config:
+        time_budget = float(scrub_config['time_budget'])
+
+    result = Result()
+    db = get_session()
+    scrub = Scrub(
+        db,
+        cycle_days,
+        bandwidth * 1000000 if bandwidth else None,
+        time_budget * 60 if time_budget else None
+    )
+    for file_path, checksum, status in scrub.run():
+        result.append((file_path, status == 'ok'))
+        if status != 'ok':
+            log.all(json.dumps({
+                'path': file_path,
+                'checksum': checksum,
+                'status': status
+            }))
+
+    if scrub.skipped > 0:
+        log.warn('Ran out of time with %d files of this slice left' %
+                 scrub.skipped)
+    close_session()
+    result.write()
+
+    if result.error > 0:
+        sys.exit(1)
+
 
 def update_location(media, file_path, location_name):
     """Update location exif metadata of media.
@@ -236,6 +564,65 @@ def update_time(media, file_path, time_string):
     return True
 
 
+def update_media(media, album, location, time, title):
+    """Write the updates from the update command to a media file.
+
+    The updates are written to the file together once they're all set.
+
+    :returns: None if nothing was updated or a tuple of the media object,
+        which has the updated metadata, and the base name it should have,
+        or None to keep the base name from its metadata.
+    """
+    current_file = media.get_file_path()
+    updated = False
+    media.begin_write()
+    if location:
+        update_location(media, current_file, location)
+        updated = True
+    if time:
+        update_time(media, current_file, time)
+        updated = True
+    if album:
+        media.set_album(album)
+        updated = True
+
+    # Updating a title can be problematic when doing it 2+ times on a file.
+    # You would end up with img_001.jpg -> img_001-first-title.jpg ->
+    # img_001-first-title-second-title.jpg.
+    # To resolve that we have to track the prior title (if there was one.
+    # Then we massage the updated_media's metadata['base_name'] to remove
+    # the old title.
+    # Since FileSystem.get_file_name() relies on base_name it will properly
+    #  rename the file by updating the title instead of appending it.
+    new_base_name = None
+    if title:
+        # We call get_metadata() to cache it before making any changes
+        metadata = media.get_metadata()
+        title_update_status = media.set_title(title)
+        original_title = metadata['title']
+        if title_update_status and original_title:
+            # @TODO: We should move this to a shared method since
+            # FileSystem.get_file_name() does it too.
+            original_title = re.sub(r'\W+', '-', original_title.lower())
+            original_base_name = metadata['base_name']
+            if len(original_title) > 0:
+                new_base_name = original_base_name.replace(
+                    '-%s' % original_title, '')
+        updated = True
+
+    status = media.commit_write()
+    if not updated:
+        return None
+
+    if status is False:
+        log.error('Failed to update %s' % current_file)
+        log.all('{"source":"%s", "error_msg":"Failed to update"}' %
+                  current_file)
+        return None
+
+    return (media, new_base_name)
+
+
 @click.command('update')
 @click.option('--album', help='Update the image album.')
 @click.option('--location', help=('Update the image location. Location '
@@ -246,12 +633,17 @@ def update_time(media, file_path, time_string):
 @click.option('--title', help='Update the image title.')
 @click.option('--debug', default=False, is_flag=True,
               help='Override the value in constants.py with True.')
+@click.option('--no-checksum-cache', default=False, is_flag=True,
+              help="Don't use or update the cache of checksums from earlier runs.")
+@click.option('--rehash', default=False, is_flag=True,
+              help='Hash every file again instead of trusting the checksum cache.')
 @click.argument('paths', nargs=-1,
                 required=True)
-def _update(album, location, time, title, paths, debug):
+def _update(album, location, time, title, paths, debug, no_checksum_cache, rehash):
     """Update a file's EXIF. Automatically modifies the file's location and file name accordingly.
     """
     constants.debug = debug
+    set_checksum_cache(no_checksum_cache, rehash)
     has_errors = False
     result = Result()
 
@@ -263,6 +655,7 @@ def _update(album, location, time, title, paths, debug):
         else:
             files.add(path)
 
+    media_list = []
     for current_file in files:
         if not os.path.exists(current_file):
             has_errors = True
@@ -274,64 +667,51 @@ def _update(album, location, time, title, paths, debug):
 
         current_file = os.path.expanduser(current_file)
 
-        # The destination folder structure could contain any number of levels
-        #  So we calculate that and traverse up the tree.
-        # '/path/to/file/photo.jpg' -> '/path/to/file' ->
-        #  ['path','to','file'] -> ['path','to'] -> '/path/to'
-        current_directory = os.path.dirname(current_file)
-        destination_depth = -1 * len(FILESYSTEM.get_folder_path_definition())
-        destination = os.sep.join(
-                          os.path.normpath(
-                              current_directory
-                          ).split(os.sep)[:destination_depth]
-                      )
-
         media = Media.get_class_by_file(current_file, get_all_subclasses())
         if not media:
             continue
 
-        updated = False
-        if location:
-            update_location(media, current_file, location)
-            updated = True
-        if time:
-            update_time(media, current_file, time)
-            updated = True
-        if album:
-            media.set_album(album)
-            updated = True
-
-        # Updating a title can be problematic when doing it 2+ times on a file.
-        # You would end up with img_001.jpg -> img_001-first-title.jpg ->
-        # img_001-first-title-second-title.jpg.
-        # To resolve that we have to track the prior title (if there was one.
-        # Then we massage the updated_media's metadata['base_name'] to remove
-        # the old title.
-        # Since FileSystem.get_file_name() relies on base_name it will properly
-        #  rename the file by updating the title instead of appending it.
-        remove_old_title_from_name = False
+        media_list.append(media)
+
+    # Files are updated in batches so we can read their metadata with one
+    #  exiftool command per batch instead of one per file.
+    for batch in Media.get_exiftool_batches(media_list):
         if title:
-            # We call get_metadata() to cache it before making any changes
-            metadata = media.get_metadata()
-            title_update_status = media.set_title(title)
-            original_title = metadata['title']
-            if title_update_status and original_title:
-                # @TODO: We should move this to a shared method since
-                # FileSystem.get_file_name() does it too.
-                original_title = re.sub(r'\W+', '-', original_title.lower())
-                original_base_name = metadata['base_name']
-                remove_old_title_from_name = True
-            updated = True
-
-        if updated:
-            updated_media = Media.get_class_by_file(current_file,
-                                                    get_all_subclasses())
-            # See comments above on why we have to do this when titles
-            # get updated.
-            if remove_old_title_from_name and len(original_title) > 0:
+            Media.load_exiftool_attributes(batch)
+
+        updates = []
+        for media in batch:
+            updates.append(update_media(media, album, location, time, title))
+
+        Media.load_exiftool_attributes(
+            [update[0] for update in updates if update is not None])
+
+        for media, update in zip(batch, updates):
+            current_file = media.get_file_path()
+            if update is None:
+                has_errors = False
+                result.append((current_file, False))
+                continue
+
+            updated_media, new_base_name = update
+
+            # The destination folder structure could contain any number of levels
+            #  So we calculate that and traverse up the tree.
+            # '/path/to/file/photo.jpg' -> '/path/to/file' ->
+            #  ['path','to','file'] -> ['path','to'] -> '/path/to'
+            current_directory = os.path.dirname(current_file)
+            destination_depth = -1 * len(FILESYSTEM.get_folder_path_definition())
+            destination = os.sep.join(
+                              os.path.normpath(
+                                  current_directory
+                              ).split(os.sep)[:destination_depth]
+                          )
+
+            # See comments in update_media() on why we have to do this when
+            # titles get updated.
+            if new_base_name is not None:
                 updated_media.get_metadata()
-                updated_media.set_metadata_basename(
-                    original_base_name.replace('-%s' % original_title, ''))
+                updated_media.set_metadata_basename(new_base_name)
 
             dest_path = FILESYSTEM.process_file(current_file, destination,
                 updated_media, move=True, allowDuplicate=True)
@@ -346,10 +726,8 @@ def _update(album, location, time, title, paths, debug):
             result.append((current_file, dest_path))
             # Trip has_errors to False if it's already False or dest_path is.
             has_errors = has_errors is True or not dest_path
-        else:
-            has_errors = False
-            result.append((current_file, False))
 
+    close_session()
     result.write()
     
     if has_errors:
@@ -365,6 +743,9 @@ main.add_command(_import)
 main.add_command(_update)
 main.add_command(_generate_db)
 main.add_command(_verify)
+main.add_command(_migrate_hashes)
+main.add_command(_scrub)
+main.add_command(_export_db)
 main.add_command(_batch)
 
 
@@ -374,5 +755,15 @@ if __name__ == '__main__':
        u'-config',
         u'"{}"'.format(constants.exiftool_config)
     ]
-    with ExifTool(executable_=get_exiftool(), addedargs=exiftool_addedargs) as et:
+    # Start a pool of exiftool processes so threads don't wait on each other.
+    config = load_config()
+    exiftool_processes = None
+    exiftool_fast = 0
+    if 'ExifTool' in config:
+        if 'processes' in config['ExifTool']:
+            exiftool_processes = int(config['ExifTool']['processes'])
+        if 'fast' in config['ExifTool']:
+            exiftool_fast = int(config['ExifTool']['fast'])
+    with ExifTool(executable_=get_exiftool(), addedargs=exiftool_addedargs,
+                  processes=exiftool_processes, fast=exiftool_fast) as et:
         main()
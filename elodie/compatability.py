@@ -1,7 +1,14 @@
+import errno
 import os
 import shutil
+import struct
 import sys
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from elodie import constants
 
 
@@ -30,44 +37,129 @@ def _bytes(string):
     else:
         return bytes(string)
 
-def _copyfile(src, dst):
-    # shutil.copy seems slow, changing to streaming according to
-    # http://stackoverflow.com/questions/22078621/python-how-to-copy-files-fast  # noqa
-    # Python 3 hangs using open/write method so we proceed with shutil.copy
-    #  and only perform the optimized write for Python 2.
-    if (constants.python_version == 3):
-        # Do not use copy2(), it will have an issue when copying to a
-        #  network/mounted drive.
-        # Using copy and manual set_date_from_filename gets the job done.
-        # The calling function is responsible for setting the time.
-        shutil.copy(src, dst)
-        return
+#: Size of the buffer used when a file has to be copied by reading and
+#:  writing it.
+copy_buffer_size = 8 * 1024 * 1024
 
-    try:
-        O_BINARY = os.O_BINARY
-    except:
-        O_BINARY = 0
+# ioctl to clone a file on Linux filesystems with copy-on-write like btrfs
+#  and XFS. From linux/fs.h.
+FICLONE = 0x40049409
 
-    READ_FLAGS = os.O_RDONLY | O_BINARY
-    WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY
-    TEN_MEGABYTES = 10485760
-    BUFFER_SIZE = min(TEN_MEGABYTES, os.path.getsize(src))
+# ioctl to find where a file's data is on disk on Linux. From linux/fs.h
+#  and linux/fiemap.h, which also describe the structs: a struct fiemap
+#  followed by as many struct fiemap_extent as we ask for.
+FS_IOC_FIEMAP = 0xC020660B
+_fiemap_format = '=QQLLLL'
+_fiemap_extent_format = '=QQQQQLLLL'
+# Flags of extents whose physical offset doesn't mean anything yet, e.g.
+#  because they haven't been written to disk.
+_fiemap_extent_unplaced = 0x2 | 0x4 | 0x200
 
-    try:
-        fin = os.open(src, READ_FLAGS)
-        stat = os.fstat(fin)
-        fout = os.open(dst, WRITE_FLAGS, stat.st_mode)
-        for x in iter(lambda: os.read(fin, BUFFER_SIZE), ""):
-            os.write(fout, x)
-    finally:
+# Errors which mean a way of copying isn't supported for these two files so
+#  we should try the next one.
+_unsupported_errors = set(
+    getattr(errno, name) for name in (
+        'EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY',
+        'EBADF', 'EPERM', 'ETXTBSY'
+    ) if hasattr(errno, name)
+)
+
+
+def _copyfile(src, dst, link='copy', buffer_size=None):
+    """Copy src to dst with the fastest way the platform and filesystem
+    support.
+
+    A copy tries, in order, cloning the file (reflink), which shares the
+    data until either file changes, ``os.copy_file_range``,
+    ``os.sendfile`` and reading and writing with a buffer of
+    ``buffer_size`` bytes. ``link`` can be ``hard`` to hard link dst to
+    src instead, which falls back to a copy when src and dst aren't on
+    the same filesystem.
+
+    Like shutil.copy() the permission bits are copied but not the times.
+    The calling function is responsible for setting the time.
+
+    :returns: str, the way the file was copied. One of ``hard``,
+        ``reflink``, ``copy_file_range``, ``sendfile`` or ``buffer``.
+    """
+    # dst could be a hard link to src so it's removed rather than written
+    #  over.
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if link == 'hard':
         try:
-            os.close(fin)
-        except:
-            pass
+            os.link(src, dst)
+            return 'hard'
+        except OSError as e:
+            if e.errno not in _unsupported_errors:
+                raise
+
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            strategy = _copyfileobj(fsrc, fdst, buffer_size)
+    shutil.copymode(src, dst)
+    return strategy
+
+
+def _copyfileobj(fsrc, fdst, buffer_size):
+    if fcntl is not None:
         try:
-            os.close(fout)
-        except:
-            pass
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return 'reflink'
+        except (IOError, OSError) as e:
+            if e.errno not in _unsupported_errors:
+                raise
+
+    strategies = []
+    if hasattr(os, 'copy_file_range'):
+        strategies.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        strategies.append(('sendfile', _sendfile))
+
+    for name, function in strategies:
+        try:
+            function(fsrc.fileno(), fdst.fileno())
+            return name
+        except OSError as e:
+            if e.errno not in _unsupported_errors:
+                raise
+            # Start again from the beginning with the next one.
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+    shutil.copyfileobj(fsrc, fdst, buffer_size or copy_buffer_size)
+    return 'buffer'
+
+
+def _copy_file_range(fsrc, fdst):
+    size = os.fstat(fsrc).st_size
+    copied = 0
+    while True:
+        written = os.copy_file_range(fsrc, fdst, copy_buffer_size)
+        if written == 0:
+            break
+        copied += written
+    _check_copied(copied, size)
+
+
+def _sendfile(fsrc, fdst):
+    size = os.fstat(fsrc).st_size
+    offset = 0
+    while True:
+        sent = os.sendfile(fdst, fsrc, offset, copy_buffer_size)
+        if sent == 0:
+            break
+        offset += sent
+    _check_copied(offset, size)
+
+
+def _check_copied(copied, size):
+    # Some filesystems, like FUSE and NFS, return 0 straight away without
+    #  copying anything, so a short copy means we try the next way.
+    if copied != size:
+        raise OSError(errno.ENOSYS, 'Copied %d of %d bytes' % (copied, size))
 
 
 # If you want cross-platform overwriting of the destination, 
@@ -78,3 +170,68 @@ def _rename(src, dst):
         return os.replace(src, dst)
     else:
         return os.rename(src, dst)
+
+
+class _DirEntry(object):
+    """Stand in for os.DirEntry on Python 2, which has no os.scandir."""
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+        self._stat = None
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+
+def _scandir(path):
+    """List a directory's entries along with what the OS told us about them.
+
+    The whole directory is read straight away so it isn't held open.
+
+    :returns: list of os.DirEntry or :class:`_DirEntry`
+    """
+    if hasattr(os, 'scandir'):
+        return list(os.scandir(path))
+    return [_DirEntry(path, name) for name in os.listdir(path)]
+
+
+def _get_physical_offset(path):
+    """Get where the start of a file's data is on disk.
+
+    :returns: int, or None if the platform or filesystem can't tell us.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return None
+
+    header_size = struct.calcsize(_fiemap_format)
+    request = bytearray(
+        struct.pack(_fiemap_format, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) +
+        b'\0' * struct.calcsize(_fiemap_extent_format)
+    )
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+    except (IOError, OSError):
+        return None
+    finally:
+        os.close(fd)
+
+    mapped_extents = struct.unpack_from(_fiemap_format, request)[3]
+    if mapped_extents == 0:
+        return None
+    extent = struct.unpack_from(_fiemap_extent_format, request, header_size)
+    if extent[5] & _fiemap_extent_unplaced:
+        return None
+    return extent[1]
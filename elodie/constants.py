@@ -22,6 +22,31 @@ hash_db = '{}/hash.json'.format(application_directory)
 #: File in which to store geolocation details about media Elodie has seen.
 location_db = '{}/location.json'.format(application_directory)
 
+#: File in which to store the size and a sample of the contents of media
+#:  Elodie has seen.
+sample_db = '{}/sample.json'.format(application_directory)
+
+#: File in which to store the size and modification time of media Elodie
+#:  has hashed, so it can tell whether they changed without reading them.
+stat_db = '{}/stat.json'.format(application_directory)
+
+#: File which records the generate-db run in progress so it can resume.
+generate_db_checkpoint = '{}/generate-db.json'.format(application_directory)
+
+#: Directory of files which record what happened to each file of the last
+#:  import into each destination so it can resume.
+import_journal_directory = '{}/import-journals'.format(application_directory)
+
+#: File which records where the last scrub stopped.
+scrub_state = '{}/scrub.json'.format(application_directory)
+
+#: SQLite database used instead of hash_db and location_db when configured.
+sqlite_db = '{}/elodie.db'.format(application_directory)
+
+#: SQLite database of checksums of files Elodie has hashed, keyed by their
+#:  device, inode, size and modification time.
+checksum_cache_db = '{}/checksums.db'.format(application_directory)
+
 #: Elodie installation directory.
 script_directory = path.dirname(path.dirname(path.abspath(__file__)))
 
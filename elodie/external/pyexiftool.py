@@ -61,10 +61,14 @@ import sys
 import subprocess
 import os
 import json
+import multiprocessing
+import threading
 import warnings
 import logging
 import codecs
 
+from collections import deque
+
 from future.utils import with_metaclass
 
 try:        # Py3k compatibility
@@ -80,13 +84,14 @@ If the executable is not located in one of the paths listed in the
 """
 
 # Sentinel indicating the end of the output of a sequence of commands.
-# The standard value should be fine.
+# Each command is sent with a numbered ``-execute<N>`` so exiftool ends
+# its output with ``{ready<N>}``.
 sentinel = b"{ready}"
 
 # The block size when reading from exiftool.  The standard value
 # should be fine, though other values might give better performance in
 # some cases.
-block_size = 4096
+block_size = 65536
 
 # constants related to keywords manipulations 
 KW_TAGNAME = "IPTC:Keywords"
@@ -153,6 +158,153 @@ def format_error (result):
         else:
             return 'exiftool finished with error: "%s"' % strip_nl(result) 
 
+class Command(object):
+    """A command sent to exiftool with :py:meth:`ExifToolProcess.submit()`.
+    """
+
+    def __init__(self, number, reader=None):
+        self.number = number
+        self.sentinel = ("{ready%d}" % number).encode()
+        if reader is None:
+            reader = OutputReader()
+        self.reader = reader
+        self._last_byte = b"\n"
+        self._done = threading.Event()
+        self._error = None
+        self._result = None
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_done_callback(self, callback):
+        """Call callback with this command once it has finished.
+        """
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self):
+        """Return the exception the command failed with, if any.
+        """
+        return self._error
+
+    def feed(self, data):
+        if not data:
+            return
+        self._last_byte = data[-1:]
+        if self._error is not None:
+            return
+        try:
+            self.reader.feed(data)
+        except Exception as e:
+            # Keep reading up to the sentinel so the next command gets
+            # its own output.
+            self._error = e
+
+    def find_sentinel(self, buffer):
+        """Find this command's sentinel on a line of its own in buffer.
+
+        :returns: tuple of where the sentinel's line starts and ends or
+            None if it hasn't arrived yet.
+        """
+        index = buffer.find(self.sentinel)
+        while index >= 0:
+            end = index + len(self.sentinel)
+            if end >= len(buffer):
+                return None
+            if index > 0:
+                before = bytes(buffer[index - 1:index])
+            else:
+                before = self._last_byte
+            if before == b"\n" and buffer[end:end + 1] in (b"\r", b"\n"):
+                if buffer[end:end + 1] == b"\r":
+                    end += 1
+                if buffer[end:end + 1] == b"\n":
+                    end += 1
+                return (index, end)
+            index = buffer.find(self.sentinel, index + 1)
+        return None
+
+    def finish(self):
+        if self._error is None:
+            try:
+                self._result = self.reader.finish()
+            except Exception as e:
+                self._error = e
+        self._set_done()
+
+    def fail(self, error):
+        self._error = error
+        self._set_done()
+
+    def _set_done(self):
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def result(self):
+        """Wait for the command to finish and return its output.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class OutputReader(object):
+    """Collect the output of a command into ``bytes``."""
+
+    def __init__(self):
+        self.output = bytearray()
+
+    def feed(self, data):
+        self.output.extend(data)
+
+    def finish(self):
+        return bytes(self.output).strip()
+
+
+class JsonObjectReader(object):
+    """Parse the output of a ``-j`` command one object at a time."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.results = []
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        # exiftool writes the closing brace of each object at the start of
+        # a line.  Braces of nested structures are indented.
+        end = self.buffer.find(b"\n}")
+        while end >= 0:
+            self._add_object(bytes(self.buffer[:end + 2]))
+            del self.buffer[:end + 2]
+            end = self.buffer.find(b"\n}")
+
+    def finish(self):
+        self._add_object(bytes(self.buffer))
+        self.buffer = bytearray()
+        return self.results
+
+    def _add_object(self, data):
+        data = data.strip().lstrip(b"[,").rstrip(b",]").strip()
+        if data:
+            self.results.append(_loads_json_object(data))
+
+
+def _loads_json_object(data):
+    # Some latin bytes won't decode to utf-8.
+    # Try utf-8 and fallback to latin.
+    # https://github.com/jmathai/elodie/issues/127
+    try:
+        return json.loads(data.decode("utf-8"))
+    except UnicodeDecodeError:
+        return json.loads(data.decode("latin-1"))
+
 class Singleton(type):
     """Metaclass to use the singleton [anti-]pattern"""
     instance = None
@@ -162,15 +314,19 @@ class Singleton(type):
             cls.instance = super(Singleton, cls).__call__(*args, **kwargs)
         return cls.instance
 
-class ExifTool(object, with_metaclass(Singleton)):
+class ExifToolProcess(object):
     """Run the `exiftool` command-line tool and communicate to it.
 
-    You can pass two arguments to the constructor:
+    You can pass these arguments to the constructor:
     - ``addedargs`` (list of strings): contains additional paramaters for
       the stay-open instance of exiftool
     - ``executable`` (string): file name of the ``exiftool`` executable.
       The default value ``exiftool`` will only work if the executable
       is in your ``PATH``
+    - ``fast`` (int): 1 or 2 to read meta-data with ``-fast`` or
+      ``-fast2``.  exiftool then stops reading large files early, which
+      can miss meta-data stored after the image or video data.  Writing
+      isn't affected.
 
     Most methods of this class are only available after calling
     :py:meth:`start()`, which will actually launch the subprocess.  To
@@ -184,9 +340,9 @@ class ExifTool(object, with_metaclass(Singleton)):
     until manually killed.
 
     A convenient way to make sure that the subprocess is terminated is
-    to use the :py:class:`ExifTool` instance as a context manager::
+    to use the :py:class:`ExifToolProcess` instance as a context manager::
 
-        with ExifTool() as et:
+        with ExifToolProcess() as et:
             ...
 
     .. warning:: Note that there is no error handling.  Nonsensical
@@ -201,7 +357,8 @@ class ExifTool(object, with_metaclass(Singleton)):
        associated with a running subprocess.
     """
 
-    def __init__(self, executable_=None, addedargs=None):
+    def __init__(self, executable_=None, addedargs=None, block_size_=None,
+                 fast=0):
         
         if executable_ is None:
             self.executable = executable
@@ -214,8 +371,24 @@ class ExifTool(object, with_metaclass(Singleton)):
             self.addedargs = addedargs
         else:
             raise TypeError("addedargs not a list of strings")
+
+        if block_size_ is None:
+            self.block_size = block_size
+        else:
+            self.block_size = block_size_
+
+        if fast not in (0, 1, 2):
+            raise ValueError("fast must be 0, 1 or 2")
+        self.fast = fast
         
         self.running = False
+        # Commands are written under _write_lock and added to _pending in
+        # the order they were written.  exiftool answers them in the same
+        # order so the reader thread hands output to _pending[0].
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = deque()
+        self._number = 0
 
     def start(self):
         """Start an ``exiftool`` process in batch mode for this instance.
@@ -237,6 +410,9 @@ class ExifTool(object, with_metaclass(Singleton)):
                 procargs,
                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                 stderr=devnull)
+        self._reader = threading.Thread(target=self._read_output)
+        self._reader.daemon = True
+        self._reader.start()
         self.running = True
 
     def terminate(self):
@@ -246,11 +422,18 @@ class ExifTool(object, with_metaclass(Singleton)):
         """
         if not self.running:
             return
-        self._process.stdin.write(b"-stay_open\nFalse\n")
-        self._process.stdin.flush()
-        self._process.communicate()
-        del self._process
         self.running = False
+        with self._write_lock:
+            try:
+                self._process.stdin.write(b"-stay_open\nFalse\n")
+                self._process.stdin.close()
+            except (IOError, OSError, ValueError):
+                pass
+        self._process.wait()
+        if threading.current_thread() is not self._reader:
+            self._reader.join()
+        self._process.stdout.close()
+        del self._process
 
     def __enter__(self):
         self.start()
@@ -281,15 +464,85 @@ class ExifTool(object, with_metaclass(Singleton)):
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
+        return self.submit(*params).result()
+
+    def submit(self, *params, **kwargs):
+        """Send the given batch of parameters to ``exiftool`` without
+        waiting for its output.
+
+        Several commands can be submitted before any of their output is
+        read so ``exiftool`` never waits for us between commands.  The
+        returned :py:class:`Command` has a ``result()`` method which
+        waits for the output of this command and returns it the same way
+        as :py:meth:`execute()` does.
+
+        The optional ``reader`` keyword argument is an object with
+        ``feed(data)`` and ``finish()`` methods which gets the output as
+        it arrives instead of collecting it into ``bytes``.
+        """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
-        self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
-        self._process.stdin.flush()
-        output = b""
+        with self._write_lock:
+            self._number += 1
+            command = Command(self._number, kwargs.get('reader'))
+            with self._pending_lock:
+                self._pending.append(command)
+            try:
+                self._process.stdin.write(b"\n".join(
+                    params + (("-execute%d\n" % command.number).encode(),)))
+                self._process.stdin.flush()
+            except (IOError, OSError, ValueError) as e:
+                with self._pending_lock:
+                    if command in self._pending:
+                        self._pending.remove(command)
+                command.fail(e)
+        return command
+
+    def _read_output(self):
+        # Runs in its own thread for as long as the process does, so the
+        # pipe from exiftool never fills up while commands are waiting to
+        # be written.
         fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+        buffer = bytearray()
+        while True:
+            try:
+                block = os.read(fd, self.block_size)
+            except (IOError, OSError):
+                block = b""
+            if not block:
+                break
+            buffer.extend(block)
+
+            while buffer:
+                with self._pending_lock:
+                    command = self._pending[0] if self._pending else None
+                if command is None:
+                    # Nothing is waiting for this output.
+                    del buffer[:]
+                    break
+
+                found = command.find_sentinel(buffer)
+                if found is None:
+                    # Hold back enough to recognize a sentinel which is
+                    # split between two reads.
+                    keep = len(command.sentinel) + 1
+                    if len(buffer) > keep:
+                        command.feed(bytes(buffer[:-keep]))
+                        del buffer[:-keep]
+                    break
+
+                start, end = found
+                command.feed(bytes(buffer[:start]))
+                del buffer[:end]
+                with self._pending_lock:
+                    self._pending.popleft()
+                command.finish()
+
+        with self._pending_lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        for command in pending:
+            command.fail(IOError("exiftool exited unexpectedly."))
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -323,13 +576,43 @@ class ExifTool(object, with_metaclass(Singleton)):
         except UnicodeDecodeError as e:
             return json.loads(self.execute(b"-j", *params).decode("latin-1"))
 
+    def execute_json_objects(self, *params):
+        """Execute the given batch of parameters and parse the JSON output
+        one object at a time.
+
+        This method returns the same value as :py:meth:`execute_json()`
+        but parses each object as soon as exiftool has written it instead
+        of holding on to the output of the whole batch.  Each object is
+        decoded as UTF-8 and falls back to latin-1 on its own.
+        """
+        return self.submit_json_objects(*params).result()
+
+    def submit_json_objects(self, *params):
+        """Submit the given batch of parameters like :py:meth:`submit()`
+        and parse its output like :py:meth:`execute_json_objects()`.
+        """
+        params = (b"-j",) + tuple(map(fsencode, params))
+        return self.submit(*params, reader=JsonObjectReader())
+
+    def get_metadata_batches(self, batches, in_flight=4):
+        """Return all meta-data for several batches of files.
+
+        Up to ``in_flight`` batches are sent to exiftool before waiting
+        for the output of the first one.
+
+        :returns: generator with the return value of
+            :py:meth:`get_metadata_batch()` for each batch, in order.
+        """
+        return self.get_tags_batches([], batches, in_flight)
+
     def get_metadata_batch(self, filenames):
         """Return all meta-data for the given files.
 
         The return value will have the format described in the
         documentation of :py:meth:`execute_json()`.
         """
-        return self.execute_json(*filenames)
+        return self.execute_json_objects(
+            *(self._read_params() + list(filenames)))
 
     def get_metadata(self, filename):
         """Return meta-data for a single file.
@@ -337,7 +620,29 @@ class ExifTool(object, with_metaclass(Singleton)):
         The returned dictionary has the format described in the
         documentation of :py:meth:`execute_json()`.
         """
-        return self.execute_json(filename)[0]
+        return self.execute_json(*(self._read_params() + [filename]))[0]
+
+    def get_tags_batches(self, tags, batches, in_flight=4):
+        """Return only specified tags for several batches of files.
+
+        This is :py:meth:`get_metadata_batches()` for the tags in
+        ``tags``.  An empty ``tags`` returns all meta-data.
+
+        :returns: generator with the return value of
+            :py:meth:`get_tags_batch()` for each batch, in order.
+        """
+        if isinstance(tags, basestring):
+            raise TypeError("The argument 'tags' must be "
+                            "an iterable of strings")
+        params = self._read_params() + ["-" + t for t in tags]
+        commands = deque()
+        for filenames in batches:
+            commands.append(
+                self.submit_json_objects(*(params + list(filenames))))
+            if len(commands) >= in_flight:
+                yield commands.popleft().result()
+        while commands:
+            yield commands.popleft().result()
 
     def get_tags_batch(self, tags, filenames):
         """Return only specified tags for the given files.
@@ -358,7 +663,7 @@ class ExifTool(object, with_metaclass(Singleton)):
         if isinstance(filenames, basestring):
             raise TypeError("The argument 'filenames' must be "
                             "an iterable of strings")
-        params = ["-" + t for t in tags]
+        params = self._read_params() + ["-" + t for t in tags]
         params.extend(filenames)
         return self.execute_json(*params)
 
@@ -435,6 +740,25 @@ class ExifTool(object, with_metaclass(Singleton)):
         as a string. 
         """
         return self.set_tags_batch(tags, [filename])
+
+    def copy_with_tags(self, tags, filename, output):
+        """Writes a copy of the given file with the values of the
+        specified tags to ``output``, leaving the file itself unchanged.
+
+        exiftool won't replace an existing file so ``output`` must not
+        exist.  The format of the return value is the same as for
+        :py:meth:`execute()`.
+        """
+        if isinstance(tags, basestring):
+            raise TypeError("The argument 'tags' must be dictionary "
+                            "of strings")
+
+        params = []
+        for tag, value in tags.items():
+            params.append(u'-%s=%s' % (tag, value))
+        params_utf8 = [x.encode('utf-8') for x in params]
+        params_utf8.extend([b"-o", fsencode(output), fsencode(filename)])
+        return self.execute(*params_utf8)
     
     def set_keywords_batch(self, mode, keywords, filenames):
         """Modifies the keywords tag for the given files.
@@ -485,3 +809,138 @@ class ExifTool(object, with_metaclass(Singleton)):
         as a string. 
         """
         return self.set_keywords_batch(mode, keywords, [filename])
+
+    def _read_params(self):
+        if self.fast:
+            return ["-fast%d" % self.fast]
+        return []
+
+
+class ExifTool(with_metaclass(Singleton, ExifToolProcess)):
+    """A pool of stay-open ``exiftool`` processes.
+
+    Every command is sent to the process with the fewest commands in
+    flight.  A new process is started when every process is busy, up to
+    ``processes`` of them.  After that up to ``in_flight`` commands are
+    queued on each process's pipe before callers have to wait.  A
+    process which has exited is replaced the next time a command is
+    sent.
+
+    ``ExifTool()`` always returns the same pool.  Its arguments are the
+    same as :py:class:`ExifToolProcess` plus ``processes``, the most
+    processes to run at once, which defaults to the number of CPUs, and
+    ``in_flight``.  Reads honour ``fast`` whichever process they're sent
+    to.
+    """
+
+    def __init__(self, executable_=None, addedargs=None, processes=None,
+                 in_flight=4, block_size_=None, fast=0):
+        super(ExifTool, self).__init__(executable_, addedargs, block_size_,
+                                       fast)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(1, processes)
+        self.in_flight = max(1, in_flight)
+        # Number of commands in flight for each running process.
+        self._load = {}
+        self._available = threading.Condition(threading.Lock())
+
+    def start(self):
+        """Start the pool with one ``exiftool`` process.
+
+        More processes are started as they're needed.
+        """
+        if self.running:
+            warnings.warn("ExifTool already running; doing nothing.")
+            return
+        self.running = True
+        try:
+            self._checkin(self._checkout())
+        except Exception:
+            self.running = False
+            raise
+
+    def terminate(self):
+        """Terminate every ``exiftool`` process in the pool.
+        """
+        if not self.running:
+            return
+        with self._available:
+            processes = list(self._load)
+            self._load = {}
+            self.running = False
+            self._available.notify_all()
+        for process in processes:
+            _terminate_quietly(process)
+
+    def submit(self, *params, **kwargs):
+        """Send the given batch of parameters to one of the pool's
+        ``exiftool`` processes.
+
+        See :py:meth:`ExifToolProcess.submit()`.
+        """
+        process = self._checkout()
+        command = process.submit(*params, **kwargs)
+        command.add_done_callback(
+            lambda command: self._command_done(process, command))
+        return command
+
+    def _checkout(self):
+        with self._available:
+            while True:
+                if not self.running:
+                    raise ValueError("ExifTool instance not running.")
+                # Processes which exited are dropped so they're replaced.
+                for process in list(self._load):
+                    if process._process.poll() is not None:
+                        del self._load[process]
+                        process.running = False
+
+                process = None
+                if self._load:
+                    process = min(self._load, key=self._load.get)
+                if process is not None and self._load[process] == 0:
+                    break
+                if len(self._load) < self.processes:
+                    process = ExifToolProcess(self.executable, self.addedargs,
+                                              self.block_size)
+                    try:
+                        process.start()
+                    except Exception:
+                        _terminate_quietly(process)
+                        raise
+                    self._load[process] = 0
+                    break
+                if self._load[process] < self.in_flight:
+                    break
+                self._available.wait()
+
+            self._load[process] += 1
+            return process
+
+    def _checkin(self, process):
+        with self._available:
+            if process in self._load:
+                self._load[process] -= 1
+            self._available.notify()
+
+    def _command_done(self, process, command):
+        if isinstance(command.exception(), (IOError, OSError)):
+            self._discard(process)
+        else:
+            self._checkin(process)
+
+    def _discard(self, process):
+        with self._available:
+            if process in self._load:
+                del self._load[process]
+            self._available.notify()
+        _terminate_quietly(process)
+
+
+def _terminate_quietly(process):
+    # A process which has already exited can't be asked to stop.
+    try:
+        process.terminate()
+    except (IOError, OSError, ValueError):
+        process.running = False
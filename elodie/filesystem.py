@@ -9,16 +9,42 @@ from builtins import object
 import os
 import re
 import shutil
+import stat as stat_module
+import tempfile
 import time
 
 from elodie import compatability
 from elodie import geolocation
 from elodie import log
 from elodie.config import load_config
-from elodie.localstorage import Db
-from elodie.media.base import Base, get_all_subclasses
+from elodie.localstorage import get_session, size_and_mtime
+from elodie.media.base import get_supported_extensions
+from elodie.media.media import Media
 from elodie.plugins.plugins import Plugins
 
+#: Parts of a regular expression which depend on what follows the match:
+#:  end anchors, word boundaries and lookaheads.
+_looks_ahead = re.compile(r'\$|\\[bBZ]|\(\?[=!]')
+
+
+class FileEntry(object):
+    """A file found by :meth:`FileSystem.scan_files`.
+
+    :param str path: Path of the file.
+    :param stat: Result of os.stat() for the file, or None if it couldn't
+        be read.
+    """
+
+    __slots__ = ('path', 'stat')
+
+    def __init__(self, path, stat=None):
+        self.path = path
+        self.stat = stat
+
+    def __repr__(self):
+        return 'FileEntry(%r)' % self.path
+
+
 class FileSystem(object):
     """A class for interacting with the file system."""
 
@@ -38,6 +64,7 @@ class FileSystem(object):
         }
         self.cached_file_name_definition = None
         self.cached_folder_path_definition = None
+        self.cached_metadata_keys = None
         # Python3 treats the regex \s differently than Python2.
         # It captures some additional characters like the unicode checkmark \u2713.
         # See build failures in Python3 here.
@@ -61,10 +88,11 @@ class FileSystem(object):
                 os.makedirs(directory_path)
                 return True
         except OSError:
-            # OSError is thrown for cases like no permission
+            # OSError is thrown for cases like no permission or when another
+            #  thread created the directory after we checked for it.
             pass
 
-        return False
+        return os.path.isdir(directory_path)
 
     def delete_directory_if_empty(self, directory_path):
         """Delete a directory only if it's empty.
@@ -90,26 +118,72 @@ class FileSystem(object):
         :param tuple(str) extensions: File extensions to include (whitelist)
         :returns: generator
         """
+        for entry in self.scan_files(path, extensions, exclude_regex_list):
+            yield entry.path
+
+    def scan_files(self, path, extensions=None, exclude_regex_list=set()):
+        """Recursively find all files which match a path and extension.
+
+        Files are found in path order, one directory at a time, so the
+        first ones are yielded straight away. A directory whose path, with
+        a trailing separator, matches an exclusion from
+        :meth:`get_prune_patterns` is skipped along with everything in it.
+        Other exclusions are checked against each file. The stat of each
+        file is taken from the directory listing where the OS provides it
+        and is passed along so the file isn't statted again.
+
+        :param str path: Path to start recursive file listing
+        :param tuple(str) extensions: File extensions to include (whitelist)
+        :param exclude_regex_list: Regular expressions for paths to exclude.
+        :returns: generator of :class:`FileEntry`
+        """
         # If extensions is None then we get all supported extensions
         if not extensions:
-            extensions = set()
-            subclasses = get_all_subclasses(Base)
-            for cls in subclasses:
-                extensions.update(cls.extensions)
-
-        # Create a list of compiled regular expressions to match against the file path
-        compiled_regex_list = [re.compile(regex) for regex in exclude_regex_list]
-        for dirname, dirnames, filenames in os.walk(path):
-            for filename in filenames:
-                # If file extension is in `extensions` 
+            extensions = get_supported_extensions()
+
+        exclude_patterns = self.get_exclude_patterns(exclude_regex_list)
+        prune_patterns = self.get_prune_patterns(exclude_regex_list)
+        dirnames = [path]
+        while dirnames:
+            dirname = dirnames.pop()
+            try:
+                entries = sorted(compatability._scandir(dirname),
+                                 key=lambda entry: entry.name)
+            except OSError as e:
+                # os.walk() skipped directories it couldn't read as well.
+                log.info('Could not read %s: %s' % (dirname, e))
+                continue
+
+            subdirnames = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    # Like os.walk() we don't follow links to directories.
+                    if(entry.is_symlink() or self.should_exclude(
+                            entry.path + os.sep, prune_patterns)):
+                        continue
+                    subdirnames.append(entry.path)
+                    continue
+
+                # If file extension is in `extensions`
                 # And if file path is not in exclude regexes
-                # Then append to the list
-                filename_path = os.path.join(dirname, filename)
-                if (
-                        os.path.splitext(filename)[1][1:].lower() in extensions and
-                        not self.should_exclude(filename_path, compiled_regex_list, False)
-                    ):
-                    yield filename_path
+                # Then yield it
+                if(os.path.splitext(entry.name)[1][1:].lower() not in extensions or  # noqa
+                        self.should_exclude(entry.path, exclude_patterns)):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    stat = None
+                yield FileEntry(entry.path, stat)
+
+            # Directories are walked in the order they were listed.
+            dirnames.extend(reversed(subdirnames))
 
     def get_current_directory(self):
         """Get the current working directory.
@@ -343,6 +417,55 @@ class FileSystem(object):
 
         return self.cached_folder_path_definition
 
+    def get_copy_buffer_size(self):
+        """Returns the buffer size for copies which read and write the file
+        themselves, from copy_buffer_size in the [Import] section of
+        config.ini.
+
+        :returns: int or None for the default
+        """
+        config = load_config()
+        if('Import' in config and 'copy_buffer_size' in config['Import']):
+            return int(config['Import']['copy_buffer_size'])
+
+        return None
+
+    def get_metadata_keys(self):
+        """Returns the metadata keys to read from exiftool for a file.
+
+        Keys in :attr:`Media.optional_metadata_keys` are left out unless
+        the folder or file name template uses them.
+
+        :returns: list
+        """
+        if self.cached_metadata_keys is not None:
+            return self.cached_metadata_keys
+
+        config = load_config()
+
+        definitions = [
+            self.default_folder_path_definition,
+            self.default_file_name_definition
+        ]
+        if('Directory' in config):
+            definitions[0] = config['Directory']
+        if('File' in config):
+            definitions[1] = config['File']
+
+        # Fallbacks and custom masks can use any key so we look for them
+        #  anywhere in the templates.
+        templates = ' '.join(
+            value for definition in definitions
+            for value in definition.values()
+        )
+        used = re.findall('%([a-z_]+)', templates)
+
+        self.cached_metadata_keys = [
+            key for key in Media.exiftool_metadata_keys
+            if key not in Media.optional_metadata_keys or key in used
+        ]
+        return self.cached_metadata_keys
+
     def get_folder_path(self, metadata, path_parts=None):
         """Given a media's metadata this function returns the folder path as a string.
 
@@ -484,9 +607,10 @@ class FileSystem(object):
 
         return folder_name
 
-    def process_checksum(self, _file, allow_duplicate):
-        db = Db()
-        checksum = db.checksum(_file)
+    def process_checksum(self, _file, allow_duplicate, checksum=None):
+        db = get_session()
+        if(checksum is None):
+            checksum = db.checksum(_file)
         if(checksum is None):
             log.info('Could not get checksum for %s.' % _file)
             return None
@@ -511,7 +635,53 @@ class FileSystem(object):
                 ))
         return checksum
 
+    def get_checksum_by_sample(self, sample):
+        """Find the checksum of a file in the hash db from its size and
+        sample.
+
+        :param tuple sample: Size and sample from
+            :meth:`~elodie.localstorage.Db.checksum_sample`.
+        :returns: str, or None if no file or more than one file in the hash
+            db has this size and sample.
+        """
+        checksums = get_session().get_sample(sample)
+        # Files which share a sample but aren't the same can only be told
+        #  apart by reading them.
+        if(len(checksums) != 1):
+            return None
+
+        return checksums[0]
+
     def process_file(self, _file, destination, media, **kwargs):
+        plan = self.prepare_file(_file, destination, media, **kwargs)
+        if(plan is None):
+            return
+
+        return self.commit_file(plan)
+
+    def prepare_file(self, _file, destination, media, **kwargs):
+        """Work out where a file should go without changing anything on disk.
+
+        This is the first half of :meth:`process_file` and only reads the
+        file, so it's safe to run for several files at once.
+
+        :returns: dict describing the import for :meth:`commit_file`, or None
+            if the file should be skipped.
+        """
+        plan = self.start_plan(_file, destination, media, **kwargs)
+        for step in (self.plan_checksum, self.plan_metadata,
+                     self.plan_destination):
+            plan = step(plan)
+            if(plan is None):
+                return
+
+        return plan
+
+    def start_plan(self, _file, destination, media, **kwargs):
+        """Start the dict which :meth:`prepare_file` fills in.
+
+        :returns: dict
+        """
         move = False
         if('move' in kwargs):
             move = kwargs['move']
@@ -520,19 +690,134 @@ class FileSystem(object):
         if('allowDuplicate' in kwargs):
             allow_duplicate = kwargs['allowDuplicate']
 
-        stat_info_original = os.stat(_file)
-        metadata = media.get_metadata()
+        link = 'copy'
+        if('link' in kwargs):
+            link = kwargs['link']
 
-        if(not media.is_valid()):
-            print('%s is not a valid media file. Skipping...' % _file)
-            return
+        # The stat from when the file was found saves statting it again.
+        stat = None
+        if('stat' in kwargs):
+            stat = kwargs['stat']
+        if(stat is None):
+            stat = os.stat(_file)
+
+        # Only ask exiftool for what the templates need.
+        if(isinstance(media, Media)):
+            media.metadata_keys = self.get_metadata_keys()
+
+        # A copy gets its tags written straight into the destination so the
+        #  source is only read, unless config.ini has write_tags=source in
+        #  its [Import] section. With hash_while_copy=true the checksum is
+        #  worked out while the file is copied instead of reading it for
+        #  the checksum first.
+        tags_in_copy = False
+        hash_while_copy = False
+        import_config = {}
+        config = load_config()
+        if('Import' in config):
+            import_config = config['Import']
+        if(move is False):
+            hash_while_copy = link == 'copy' and import_config.get(
+                'hash_while_copy', 'false').lower() in ('true', 'yes', '1')
+            tags_in_copy = (hash_while_copy or
+                import_config.get('write_tags') != 'source')
+
+        # Large files whose size and sample match a file in the hash db are
+        #  taken to be duplicates without reading all of them, unless
+        #  config.ini has sample_duplicates=false in its [Import] section.
+        sample_duplicates = import_config.get(
+            'sample_duplicates', 'true').lower() in ('true', 'yes', '1')
+
+        return {
+            'file': _file,
+            'destination': destination,
+            'media': media,
+            'stat': stat,
+            'move': move,
+            'allow_duplicate': allow_duplicate,
+            'tags_in_copy': tags_in_copy,
+            'hash_while_copy': hash_while_copy,
+            'sample_duplicates': sample_duplicates,
+            'link': link,
+        }
 
-        checksum = self.process_checksum(_file, allow_duplicate)
+    def plan_checksum(self, plan):
+        """Add the file's checksum to a plan.
+
+        The plan's ``duplicate`` key is set to True if the file is skipped
+        because it was already imported.
+
+        :returns: dict or None if the file was already imported.
+        """
+        _file = plan['file']
+        db = get_session()
+        # A file whose checksum is cached is as cheap to check as a sample,
+        #  so a sample is only read when it saves reading the whole file.
+        plan['sample'] = None
+        if(plan['sample_duplicates'] is True and
+                plan['allow_duplicate'] is False and
+                db.get_cached_checksum(_file, plan['stat']) is None):
+            plan['sample'] = db.checksum_sample(_file, plan['stat'].st_size)
+        if(plan['sample'] is not None):
+            checksum = self.get_checksum_by_sample(plan['sample'])
+            # process_checksum() logs the duplicate and returns None, or
+            #  returns the checksum if the file it matched has gone.
+            if(checksum is not None and
+                    self.process_checksum(_file, False, checksum) is None):
+                plan['duplicate'] = True
+                return
+
+        # commit_copy() works the checksum out while it copies the file.
+        if(plan['hash_while_copy'] is True):
+            plan['checksum'] = None
+            return plan
+
+        checksum = db.checksum(_file, stat=plan['stat'])
         if(checksum is None):
             log.info('Original checksum returned None for %s. Skipping...' %
                      _file)
             return
 
+        if(self.process_checksum(_file, plan['allow_duplicate'],
+                                 checksum) is None):
+            plan['duplicate'] = True
+            return
+
+        plan['checksum'] = checksum
+        return plan
+
+    def plan_metadata(self, plan):
+        """Add the file's metadata to a plan.
+
+        :returns: dict or None if the file isn't valid media.
+        """
+        media = plan['media']
+        plan['metadata'] = media.get_metadata()
+
+        if(not media.is_valid()):
+            print('%s is not a valid media file. Skipping...' % plan['file'])
+            return
+
+        return plan
+
+    def plan_metadata_batch(self, plans):
+        """Add metadata to several plans, reading it with one exiftool
+        command per batch of files.
+
+        :returns: list of dicts or None in the same order as plans.
+        """
+        Media.load_exiftool_attributes([plan['media'] for plan in plans])
+        return [self.plan_metadata(plan) for plan in plans]
+
+    def plan_destination(self, plan):
+        """Add the destination directory and path to a plan.
+
+        :returns: dict or None if the file should be skipped.
+        """
+        _file = plan['file']
+        destination = plan['destination']
+        metadata = plan['metadata']
+
         # Run `before()` for every loaded plugin and if any of them raise an exception
         #  then we skip importing the file and log a message.
         plugins_run_before_status = self.plugins.run_all_before(_file, destination)
@@ -545,15 +830,57 @@ class FileSystem(object):
         file_name = self.get_file_name(metadata)
         dest_path = os.path.join(dest_directory, file_name)        
 
-        media.set_original_name()
-
         # If source and destination are identical then
         #  we should not write the file. gh-210
         if(_file == dest_path):
             print('Final source and destination path should not be identical')
             return
 
-        self.create_directory(dest_directory)
+        plan['dest_directory'] = dest_directory
+        plan['dest_path'] = dest_path
+        return plan
+
+    def commit_file(self, plan):
+        """Copy or move a file to the destination planned by :meth:`prepare_file`.
+
+        :param dict plan: Return value of :meth:`prepare_file`.
+        :returns: str or None
+        """
+        for step in (self.commit_tags, self.commit_copy, self.commit_hash):
+            plan = step(plan)
+            if(plan is None):
+                return None
+
+        return self.commit_plugins(plan)
+
+    def commit_tags(self, plan):
+        """Write the tags which are set on every imported file along with
+        any which were set since the media's
+        :meth:`~elodie.media.base.Base.begin_write`.
+
+        :returns: dict
+        """
+        media = plan['media']
+        media.begin_write()
+        media.set_original_name()
+        # Otherwise they're written by commit_copy().
+        if(plan['tags_in_copy'] is False):
+            media.commit_write()
+        return plan
+
+    def commit_copy(self, plan):
+        """Copy or move the file to its destination path.
+
+        :returns: dict, or None if the file couldn't be copied.
+        """
+        _file = plan['file']
+        dest_path = plan['dest_path']
+        stat_info_original = plan['stat']
+
+        self.create_directory(plan['dest_directory'])
+
+        if(plan['hash_while_copy'] is True):
+            return self.commit_copy_with_checksum(plan)
 
         # exiftool renames the original file by appending '_original' to the
         # file name. A new file is written with new tags with the initial file
@@ -566,7 +893,7 @@ class FileSystem(object):
         if(os.path.exists(exif_original_file)):
             exif_original_file_exists = True
 
-        if(move is True):
+        if(plan['move'] is True):
             stat = os.stat(_file)
             # Move the processed file into the destination directory
             shutil.move(_file, dest_path)
@@ -576,28 +903,125 @@ class FileSystem(object):
                 os.remove(exif_original_file)
             os.utime(dest_path, (stat.st_atime, stat.st_mtime))
         else:
-            if(exif_original_file_exists is True):
+            # Write the copy with its tags in one go. If there are no tags to
+            #  write or they can't be written it's copied as it is, or
+            #  linked if the plan asks for it.
+            copied = False
+            if(plan['tags_in_copy'] is True):
+                copied = plan['media'].commit_write(dest_path)
+
+            if(copied):
+                strategy = 'tags'
+            elif(exif_original_file_exists is True):
                 # Move the newly processed file with any updated tags to the
                 # destination directory
                 shutil.move(_file, dest_path)
                 # Move the exif _original back to the initial source file
                 shutil.move(exif_original_file, _file)
+                # Set the utime based on what the original file contained 
+                #  before we made any changes.
+                os.utime(_file, (stat_info_original.st_atime, stat_info_original.st_mtime))
+                strategy = 'move'
             else:
-                compatability._copyfile(_file, dest_path)
+                strategy = compatability._copyfile(_file, dest_path,
+                    plan['link'], self.get_copy_buffer_size())
+
+            log.info('%s copied to %s with %s' % (_file, dest_path, strategy))
+            # Files which had tags written can't be linked.
+            if(plan['link'] in ('hard', 'reflink') and
+                    strategy not in (plan['link'], 'tags', 'move')):
+                log.warn('Could not link %s with %s, copied it instead' % (
+                    _file, plan['link']))
 
-            # Set the utime based on what the original file contained 
-            #  before we made any changes.
             # Then set the utime on the destination file based on metadata.
-            os.utime(_file, (stat_info_original.st_atime, stat_info_original.st_mtime))
-            self.set_utime_from_metadata(metadata, dest_path)
+            # A hard link shares its times with the source so we leave them.
+            if(strategy != 'hard'):
+                self.set_utime_from_metadata(plan['metadata'], dest_path)
 
-        db = Db()
-        db.add_hash(checksum, dest_path)
-        db.update_hash_db()
+        return plan
+
+    def commit_copy_with_checksum(self, plan):
+        """Copy the file next to its destination path and work out its
+        checksum from the same read.
+
+        The copy is only moved to the destination path by
+        :meth:`commit_hash` once we know it isn't a duplicate. Set
+        verify_copy=true in the [Import] section of config.ini to read the
+        copy back and check it matches.
+
+        :returns: dict, or None if the copy didn't match.
+        """
+        _file = plan['file']
+        dest_path = plan['dest_path']
+        db = get_session()
+
+        # The copy keeps the extension so exiftool knows what it is.
+        fd, part_path = tempfile.mkstemp(
+            prefix='.',
+            suffix=os.path.splitext(dest_path)[1],
+            dir=plan['dest_directory']
+        )
+        os.close(fd)
+        try:
+            checksum = db.checksum_copy(_file, part_path)
+
+            config = load_config()
+            if('Import' in config and config['Import'].get(
+                    'verify_copy', 'false').lower() in ('true', 'yes', '1')):
+                if(db.checksum(part_path) != checksum):
+                    log.error('Copy of %s does not match' % _file)
+                    log.all('{"source":"%s", "error_msg":"Copy does not match"}' %
+                              _file)
+                    os.remove(part_path)
+                    return None
+
+            plan['media'].commit_write_to_copy(part_path)
+            self.set_utime_from_metadata(plan['metadata'], part_path)
+        except:
+            os.remove(part_path)
+            raise
+
+        plan['checksum'] = checksum
+        plan['part_path'] = part_path
+        return plan
+
+    def commit_hash(self, plan):
+        """Add the imported file to the hash db.
+
+        A file copied by :meth:`commit_copy_with_checksum` is checked for
+        duplicates here and moved to its destination path, or removed if
+        it's a duplicate.
+
+        :returns: dict, or None if the file was a duplicate.
+        """
+        if('part_path' in plan):
+            checksum = self.process_checksum(plan['file'],
+                plan['allow_duplicate'], plan['checksum'])
+            if(checksum is None):
+                os.remove(plan['part_path'])
+                plan['duplicate'] = True
+                return None
+            compatability._rename(plan['part_path'], plan['dest_path'])
+
+        db = get_session()
+        db.add_hash(plan['checksum'], plan['dest_path'], True)
+        if(plan.get('sample') is not None):
+            db.add_sample(plan['sample'], plan['checksum'])
+        # What verify --quick compares the destination with later.
+        db.add_stat(plan['checksum'], size_and_mtime(os.stat(plan['dest_path'])))
+        return plan
+
+    def commit_plugins(self, plan):
+        """Run `after()` for every loaded plugin.
+
+        :returns: str or None
+        """
+        _file = plan['file']
+        dest_path = plan['dest_path']
 
         # Run `after()` for every loaded plugin and if any of them raise an exception
         #  then we skip importing the file and log a message.
-        plugins_run_after_status = self.plugins.run_all_after(_file, destination, dest_path, metadata)
+        plugins_run_after_status = self.plugins.run_all_after(_file, plan['destination'], dest_path, plan['metadata'])
         if(plugins_run_after_status == False):
             log.warn('At least one plugin pre-run failed for %s' % _file)
             return
@@ -632,6 +1056,181 @@ class FileSystem(object):
             date_taken_in_seconds = time.mktime(date_taken)
             os.utime(file_path, (time.time(), (date_taken_in_seconds)))
 
+    def discover_files(self, paths, exclude_regex_list=set(),
+                       check_extensions=False, seen=None):
+        """Find the files to import from a mix of files and directories.
+
+        Files are yielded as soon as they're found. A file which is found
+        more than once, because paths overlap or through a hard link, is
+        only yielded the first time. That's tracked with a set of inodes for
+        each device rather than a set of paths so it stays small.
+
+        :param paths: Iterable of paths to files and directories.
+        :param exclude_regex_list: Regular expressions for paths to exclude.
+        :param bool check_extensions: Skip files in paths which don't have a
+            supported extension, e.g. for a list from another program. By
+            default an unsupported file which was named explicitly is
+            passed on so it's reported instead of ignored.
+        :param dict seen: Inodes which were already yielded for each device,
+            to share with another call.
+        :returns: generator of :class:`FileEntry`
+        """
+        exclude_patterns = self.get_exclude_patterns(exclude_regex_list)
+        extensions = get_supported_extensions()
+        if(seen is None):
+            seen = {}
+        for path in paths:
+            path = os.path.expanduser(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # The import reports that it couldn't find the file.
+                stat = None
+
+            if(stat is not None and stat_module.S_ISDIR(stat.st_mode)):
+                entries = self.scan_files(path, None, exclude_regex_list)
+            elif(self.should_exclude(path, exclude_patterns)):
+                continue
+            elif(check_extensions and
+                    os.path.splitext(path)[1][1:].lower() not in extensions):
+                continue
+            else:
+                entries = [FileEntry(path, stat)]
+
+            for entry in entries:
+                if(entry.stat is not None):
+                    inodes = seen.setdefault(entry.stat.st_dev, set())
+                    if(entry.stat.st_ino in inodes):
+                        continue
+                    inodes.add(entry.stat.st_ino)
+                yield entry
+
+    def order_files(self, entries, order='path', window=10000):
+        """Reorder files so they're read in an order which saves seeking.
+
+        Files are sorted a window at a time so the import can start before
+        every file has been found. A bigger window saves more seeking and
+        takes longer to fill.
+
+        * ``path`` keeps the order they were found in, which is path order
+          one directory at a time.
+        * ``inode`` sorts by device and inode, which is usually close to the
+          order files were written in.
+        * ``extent`` sorts by where each file starts on disk, asking the
+          filesystem with FIEMAP on Linux. Files it can't place are sorted
+          by inode after the ones it can.
+
+        Files without a stat keep path order at the end of their window.
+
+        :param entries: Iterable of :class:`FileEntry`.
+        :param str order: ``path``, ``inode`` or ``extent``.
+        :param int window: Number of files to sort at a time.
+        :returns: generator of :class:`FileEntry`
+        """
+        if(order == 'path'):
+            for entry in entries:
+                yield entry
+            return
+
+        pending = []
+        for entry in entries:
+            pending.append((self.get_order_key(entry, order), entry))
+            if(len(pending) >= window):
+                pending.sort(key=lambda item: item[0])
+                for key, pending_entry in pending:
+                    yield pending_entry
+                pending = []
+
+        pending.sort(key=lambda item: item[0])
+        for key, pending_entry in pending:
+            yield pending_entry
+
+    def get_order_key(self, entry, order):
+        """Get what :meth:`order_files` sorts a file by.
+
+        :returns: tuple
+        """
+        stat = entry.stat
+        if(stat is None):
+            return (1, 0, 0, 0, entry.path)
+
+        if(order == 'extent'):
+            offset = compatability._get_physical_offset(entry.path)
+            if(offset is not None):
+                return (0, stat.st_dev, 0, offset, entry.path)
+
+        return (0, stat.st_dev, 1, stat.st_ino, entry.path)
+
+    def read_path_list(self, f, separator=b'\n', chunk_size=65536):
+        """Read a list of paths, e.g. from another program.
+
+        The list is read a chunk at a time so it never has to fit in
+        memory. Paths are separated by new lines unless separator is a NUL
+        character, like the output of ``find -print0``.
+
+        :param f: File object opened in binary mode.
+        :param bytes separator: Character between paths.
+        :param int chunk_size: Read this many bytes at a time.
+        :returns: generator of str
+        """
+        remainder = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if(not chunk):
+                break
+
+            lines = (remainder + chunk).split(separator)
+            remainder = lines.pop()
+            for line in lines:
+                path = self._decode_listed_path(line, separator)
+                if(path):
+                    yield path
+
+        path = self._decode_listed_path(remainder, separator)
+        if(path):
+            yield path
+
+    def _decode_listed_path(self, line, separator):
+        # Lists written on Windows end their lines with \r\n.
+        if(separator == b'\n' and line.endswith(b'\r')):
+            line = line[:-1]
+        # Names which aren't valid in the filesystem encoding have to
+        #  round trip back to the same bytes when the file is opened.
+        if(hasattr(os, 'fsdecode')):
+            return os.fsdecode(line)
+        return line
+
+    def get_exclude_patterns(self, regex_list):
+        """Compile regular expressions for paths to exclude.
+
+        Each one is kept separate, for :meth:`should_exclude`, so its
+        groups and flags mean what they do on their own.
+
+        :param regex_list: Regular expressions as strings or compiled.
+        :returns: list of compiled regular expressions
+        """
+        return [
+            regex if hasattr(regex, 'search') else re.compile(regex)
+            for regex in regex_list
+        ]
+
+    def get_prune_patterns(self, regex_list):
+        """Compile the regular expressions for paths to exclude which
+        exclude everything in a directory they match.
+
+        A match on a directory's path is also a match on the path of
+        everything in it unless the expression looks at what comes after
+        the match, like ``London/$`` does. Those are left out, erring on
+        the side of leaving out ones which only look like they do.
+
+        :param regex_list: Regular expressions as strings or compiled.
+        :returns: list of compiled regular expressions
+        """
+        return self.get_exclude_patterns([
+            regex for regex in regex_list
+            if not _looks_ahead.search(getattr(regex, 'pattern', regex))
+        ])
+
     def should_exclude(self, path, regex_list=set(), needs_compiled=False):
         if(len(regex_list) == 0):
             return False
@@ -16,7 +16,7 @@ import urllib.error
 from elodie.config import load_config
 from elodie import constants
 from elodie import log
-from elodie.localstorage import Db
+from elodie.localstorage import get_session
 
 __KEY__ = None
 __DEFAULT_LOCATION__ = 'Unknown Location'
@@ -25,7 +25,7 @@ __PREFER_ENGLISH_NAMES__ = None
 
 def coordinates_by_name(name):
     # Try to get cached location first
-    db = Db()
+    db = get_session()
     cached_coordinates = db.get_location_coordinates(name)
     if(cached_coordinates is not None):
         return {
@@ -146,7 +146,7 @@ def place_name(lat, lon):
         lon = float(lon)
 
     # Try to get cached location first
-    db = Db()
+    db = get_session()
     # 3km distace radious for a match
     cached_place_name = db.get_location_name(lat, lon, 3000)
     # We check that it's a dict to coerce an upgrade of the location
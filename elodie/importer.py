@@ -0,0 +1,577 @@
+"""
+Import files into a library through a pipeline of stages.
+"""
+from __future__ import print_function
+from builtins import object
+
+import hashlib
+import json
+import os
+import threading
+
+from send2trash import send2trash
+
+from elodie import constants
+from elodie import log
+from elodie.compatability import _decode
+from elodie.config import load_config
+from elodie.localstorage import _nanoseconds
+from elodie.media.base import get_all_subclasses
+from elodie.media.media import Media
+# Imported so get_all_subclasses() finds them.
+from elodie.media.text import Text  # noqa
+from elodie.media.audio import Audio  # noqa
+from elodie.media.photo import Photo  # noqa
+from elodie.media.video import Video  # noqa
+from elodie.pipeline import Pipeline, Stage
+
+
+class Importer(object):
+    """Import files into a destination directory.
+
+    :meth:`import_files` runs each step of importing a file as a stage of a
+    :class:`~elodie.pipeline.Pipeline` so that hashing, reading metadata
+    and copying different files overlap. Everything that can conflict
+    between files is ordered so the result is the same as importing the
+    files one at a time in the order they were given.
+
+    * A file whose checksum matches an earlier file in the run is skipped
+      as a duplicate, just as it would be once the earlier file was in
+      the hash db.
+    * A file planned for the same destination path as an earlier file
+      waits for the earlier file to be copied, so the last one wins as it
+      would in a serial run.
+
+    The number of workers for each stage and the size of the queues
+    between them can be set in the ``[Import]`` section of config.ini,
+    e.g. ``checksum_workers=8`` or ``queue_size=32``.
+
+    :param FileSystem filesystem: FileSystem used to process the files.
+    :param str destination: Directory to import the files into.
+    :param bool album_from_folder: Use the files' folders as their albums.
+    :param bool trash: Move the files to the trash after importing them,
+        or once they're found to be duplicates.
+    :param bool allow_duplicates: Import files which were already imported.
+    :param int jobs: Default number of workers for stages which can run
+        for several files at once.
+    :param str link: ``hard`` or ``reflink`` to link files into the
+        destination instead of copying them when they don't need any tags
+        written, or ``copy``.
+    :param ImportJournal journal: Journal to record what happened to each
+        file in and to skip the files an earlier run finished, or None.
+    """
+
+    #: Stages which always have a single worker.
+    serial_stages = ('claim', 'hash', 'plugins')
+
+    #: Most files a single copy worker takes at a time so it can write the
+    #:  ones going into the same directory one after another.
+    copy_batch_files = 32
+
+    def __init__(self, filesystem, destination, album_from_folder=False,
+                 trash=False, allow_duplicates=False, jobs=1, link='copy',
+                 journal=None):
+        self.filesystem = filesystem
+        self.destination = _decode(destination)
+        self.album_from_folder = album_from_folder
+        self.trash = trash
+        self.allow_duplicates = allow_duplicates
+        self.jobs = max(1, jobs)
+        self.link = link
+        self.journal = journal
+        self.pipeline = None
+        # Files which were skipped on purpose rather than because they
+        #  failed, and whether they were duplicates rather than not media.
+        #  Each is removed once it's recorded.
+        self.skipped_files = {}
+        # Checksums planned for import in this run which aren't in the hash
+        #  db yet and the file they came from.
+        self.claimed_checksums = {}
+        # Destination paths which are being copied to and an event which is
+        #  set once the copy is done.
+        self.claimed_paths = {}
+        self.claimed_paths_lock = threading.Lock()
+        # Copies made with hash_while_copy which commit_hash() hasn't moved
+        #  into place yet.
+        self.part_paths = set()
+
+    def import_file(self, _file):
+        """Set file metadata and move it to destination.
+
+        :param str _file: Path of the file to import.
+        :returns: str or None
+        """
+        identity = None
+        if self.journal is not None:
+            identity = self.journal.get_identity(
+                _get_path(_file), getattr(_file, 'stat', None))
+            finished = self.journal.get_finished(_file, identity)
+            if finished is not None:
+                return finished['destination']
+
+        dest_path = None
+        plan = self.prepare(_file)
+        if plan is not None:
+            if self.claim(plan):
+                dest_path = self.commit(plan)
+                self._release_checksum(plan)
+            else:
+                self.skipped_files[plan['file']] = True
+
+        self._record(_get_path(_file), identity, dest_path)
+        return dest_path
+
+    def import_files(self, files):
+        """Import an iterable of files.
+
+        Files which the journal says an earlier run finished are yielded
+        with the destination they were imported to, or None if they were
+        skipped, without being read. They still pass through the pipeline,
+        without any work being done, so they come out in order as soon as
+        the files before them are done.
+
+        :param files: Iterable of paths, or of
+            :class:`~elodie.filesystem.FileEntry` from
+            :meth:`~elodie.filesystem.FileSystem.scan_files`, to import.
+        :returns: generator of (file, destination path or None) tuples in the
+            same order as files.
+        """
+        def pending_files():
+            for _file in files:
+                pending = _PendingFile(_file)
+                if self.journal is not None:
+                    pending.identity = self.journal.get_identity(
+                        pending.path, getattr(_file, 'stat', None))
+                    pending.finished = self.journal.get_finished(
+                        pending.path, pending.identity)
+                yield pending
+
+        self.pipeline = self.get_pipeline()
+        results = self.pipeline.run(pending_files())
+        try:
+            for pending, dest_path in results:
+                if pending.finished is not None:
+                    yield (pending.path, pending.finished['destination'])
+                    continue
+                self._record(pending.path, pending.identity, dest_path)
+                yield (pending.path, dest_path)
+        finally:
+            # Wait for the pipeline to stop before cleaning up after it.
+            results.close()
+            # Copies which were never moved into place because the import
+            #  stopped early.
+            for part_path in self.part_paths:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            self.part_paths.clear()
+
+    def get_pipeline(self):
+        """Build the :class:`~elodie.pipeline.Pipeline` for :meth:`import_files`.
+
+        :returns: Pipeline
+        """
+        filesystem = self.filesystem
+        stages = [
+            ('filter', self._check_pending_file),
+            ('checksum', self._checksum),
+            ('metadata', filesystem.plan_metadata_batch),
+            ('plan', filesystem.plan_destination),
+            ('claim', self._claim_in_order),
+            ('tags', filesystem.commit_tags),
+            ('copy', self._copy),
+            ('hash', self._hash),
+            ('plugins', self._finish),
+        ]
+
+        config = load_config()
+        import_config = {}
+        if 'Import' in config:
+            import_config = config['Import']
+
+        pipeline_stages = []
+        for name, function in stages:
+            workers = self.jobs
+            if '%s_workers' % name in import_config:
+                workers = int(import_config['%s_workers' % name])
+            batch_size = 1
+            if name == 'metadata':
+                batch_size = Media.exiftool_batch_files
+            elif name == 'copy' and workers == 1:
+                # With several workers the writes are interleaved anyway
+                #  and a batch would keep the others waiting.
+                function = self._copy_batch
+                batch_size = self.copy_batch_files
+            pipeline_stages.append(Stage(
+                name, function, workers, name in self.serial_stages,
+                batch_size
+            ))
+
+        queue_size = self.jobs * 4
+        if 'queue_size' in import_config:
+            queue_size = int(import_config['queue_size'])
+
+        return Pipeline(pipeline_stages, queue_size)
+
+    def check_file(self, _file):
+        """Check that a file can be imported and start its plan.
+
+        :param _file: Path of the file or a
+            :class:`~elodie.filesystem.FileEntry`.
+        :returns: dict from :meth:`FileSystem.start_plan` or None
+        """
+        stat = getattr(_file, 'stat', None)
+        _file = _decode(_get_path(_file))
+        destination = self.destination
+
+        if not os.path.exists(_file):
+            log.warn('Could not find %s' % _file)
+            log.all('{"source":"%s", "error_msg":"Could not find %s"}' %
+                      (_file, _file))
+            return None
+        # Check if the source, _file, is a child folder within destination
+        elif destination.startswith(os.path.abspath(os.path.dirname(_file))+os.sep):
+            log.all('{"source": "%s", "destination": "%s", "error_msg": "Source cannot be in destination"}' % (
+                _file, destination))
+            self.skipped_files[_file] = False
+            return None
+
+        media = Media.get_class_by_file(_file, get_all_subclasses())
+        if not media:
+            log.warn('Not a supported file (%s)' % _file)
+            log.all('{"source":"%s", "error_msg":"Not a supported file"}' % _file)
+            self.skipped_files[_file] = False
+            return None
+
+        media.stat = stat
+        # Tags set while planning are written once by commit_tags().
+        media.begin_write()
+        if self.album_from_folder:
+            media.set_album_from_folder()
+
+        plan = self.filesystem.start_plan(_file, destination, media,
+            allowDuplicate=self.allow_duplicates, move=False, link=self.link,
+            stat=stat)
+        # A file we only think is a duplicate from a sample of it would be
+        #  trashed without being in the library, so read all of it.
+        if self.trash:
+            plan['sample_duplicates'] = False
+
+        return plan
+
+    def prepare(self, _file):
+        """Check a file and work out where it should be imported to.
+
+        :returns: dict from :meth:`FileSystem.prepare_file` or None
+        """
+        plan = self.check_file(_file)
+        for step in (self._checksum,
+                     self.filesystem.plan_metadata,
+                     self.filesystem.plan_destination):
+            if plan is None:
+                return None
+            plan = step(plan)
+
+        return plan
+
+    def claim(self, plan):
+        """Claim a planned file's checksum for this run.
+
+        :returns: bool, False if an earlier file in this run has the same
+            checksum and duplicates are not allowed.
+        """
+        checksum = plan['checksum']
+        # Files copied with hash_while_copy are checked by commit_hash()
+        #  once they've been copied.
+        if checksum is None:
+            return True
+
+        if(self.allow_duplicates is False):
+            if(checksum in self.claimed_checksums):
+                log.info('%s already at %s.' % (
+                    plan['file'],
+                    self.claimed_checksums[checksum]
+                ))
+                return False
+            # An earlier file's claim is released once its checksum is in
+            #  the hash db, which can be after this file was checked.
+            if(self.filesystem.process_checksum(plan['file'], False,
+                                                checksum) is None):
+                return False
+
+        self.claimed_checksums[checksum] = plan['file']
+        return True
+
+    def commit(self, plan):
+        """Copy a planned file into the destination.
+
+        :returns: str or None
+        """
+        dest_path = self.filesystem.commit_file(plan)
+        if plan.get('duplicate') is True:
+            self.skipped_files[plan['file']] = True
+        return self._log(plan, dest_path)
+
+    def _check_pending_file(self, pending):
+        # Files an earlier run finished pass through the other stages
+        #  without being planned.
+        if pending.finished is not None:
+            return None
+        return self.check_file(pending.file)
+
+    def _checksum(self, plan):
+        checksum_plan = self.filesystem.plan_checksum(plan)
+        if plan.get('duplicate') is True:
+            self.skipped_files[plan['file']] = True
+        return checksum_plan
+
+    def _claim_in_order(self, plan):
+        if not self.claim(plan):
+            self.skipped_files[plan['file']] = True
+            return None
+
+        dest_path = plan['dest_path']
+        with self.claimed_paths_lock:
+            copied = self.claimed_paths.get(dest_path)
+            plan['copied'] = self.claimed_paths[dest_path] = threading.Event()
+
+        # Wait for an earlier file going to the same place so they're copied
+        #  in the same order as a serial run.
+        if copied is not None:
+            while not copied.wait(0.1):
+                if self.pipeline.cancelled.is_set():
+                    return None
+
+        return plan
+
+    def _copy(self, plan):
+        try:
+            copied_plan = self.filesystem.commit_copy(plan)
+            if copied_plan is not None and 'part_path' in copied_plan:
+                with self.claimed_paths_lock:
+                    self.part_paths.add(copied_plan['part_path'])
+            return copied_plan
+        finally:
+            self._release_path(plan)
+
+    def _copy_batch(self, plans):
+        # Files going into the same directory are written one after another.
+        order = sorted(
+            range(len(plans)),
+            key=lambda index: (plans[index]['dest_directory'],
+                               plans[index]['dest_path'])
+        )
+        copied_plans = [None] * len(plans)
+        try:
+            for position, index in enumerate(order):
+                copied_plans[index] = self._copy(plans[index])
+        except Exception:
+            # Don't leave later files for the same paths waiting.
+            for index in order[position + 1:]:
+                self._release_path(plans[index])
+            raise
+        return copied_plans
+
+    def _release_path(self, plan):
+        plan['copied'].set()
+        with self.claimed_paths_lock:
+            if self.claimed_paths.get(plan['dest_path']) is plan['copied']:
+                del self.claimed_paths[plan['dest_path']]
+
+    def _hash(self, plan):
+        try:
+            hash_plan = self.filesystem.commit_hash(plan)
+            if plan.get('duplicate') is True:
+                self.skipped_files[plan['file']] = True
+            self._release_checksum(plan)
+            return hash_plan
+        finally:
+            with self.claimed_paths_lock:
+                self.part_paths.discard(plan.get('part_path'))
+
+    def _release_checksum(self, plan):
+        # Later files with the same checksum are found in the hash db.
+        checksum = plan.get('checksum')
+        if self.claimed_checksums.get(checksum) == plan['file']:
+            del self.claimed_checksums[checksum]
+
+    def _finish(self, plan):
+        dest_path = self.filesystem.commit_plugins(plan)
+        return self._log(plan, dest_path)
+
+    def _log(self, plan, dest_path):
+        if dest_path:
+            log.all('%s -> %s' % (plan['file'], dest_path))
+        return dest_path or None
+
+    def _record(self, _file, identity, dest_path):
+        """Journal what happened to a file once it's done with and move
+        it to the trash if it was imported or is a duplicate.
+        """
+        _file = _decode(_file)
+        skipped = _file in self.skipped_files
+        duplicate = self.skipped_files.pop(_file, False)
+        if self.journal is not None:
+            if dest_path:
+                status = 'completed'
+            elif skipped:
+                status = 'skipped'
+            else:
+                status = 'failed'
+            self.journal.add(_file, identity, status, dest_path)
+
+        if self.trash and (dest_path or duplicate):
+            send2trash(_file)
+
+
+class _PendingFile(object):
+    """A file given to :meth:`Importer.import_files` along with what the
+    journal knows about it.
+
+    :param _file: Path of the file or a
+        :class:`~elodie.filesystem.FileEntry`.
+    """
+
+    __slots__ = ('file', 'path', 'identity', 'finished')
+
+    def __init__(self, _file):
+        self.file = _file
+        self.path = _get_path(_file)
+        self.identity = None
+        self.finished = None
+
+
+def _get_path(_file):
+    """Get the path of a file given as a path or a
+    :class:`~elodie.filesystem.FileEntry`.
+    """
+    return getattr(_file, 'path', _file)
+
+
+class ImportJournal(object):
+    """Record what happened to each file of an import so an interrupted
+    import can resume.
+
+    Each file is recorded as ``completed``, ``skipped`` or ``failed`` under
+    its path along with its device, inode, size and modification time.
+    When resuming, a completed or skipped file which hasn't changed since
+    is skipped without being read again and a failed one is retried.
+
+    Each destination has its own journal so importing somewhere else doesn't
+    lose what a resume needs. The journal is appended to one line at a time
+    so everything recorded before an import was killed is kept, and it's
+    only read back into memory when resuming.
+
+    :param str destination: Directory files are being imported into.
+    :param bool resume: Carry on from the journal of the last import into
+        the same destination instead of starting a new one.
+    """
+
+    #: Statuses of files which don't need importing again.
+    finished_statuses = ('completed', 'skipped')
+
+    def __init__(self, destination, resume=False):
+        self.destination = _decode(destination)
+        self.entries = {}
+        self.resumed = False
+
+        if not os.path.exists(constants.import_journal_directory):
+            os.makedirs(constants.import_journal_directory)
+        # json.dumps escapes anything which can't be encoded, like the
+        #  surrogates of an undecodable path.
+        self.path = os.path.join(
+            constants.import_journal_directory,
+            '%s.json' % hashlib.sha1(
+                json.dumps(self.destination).encode('ascii')
+            ).hexdigest()
+        )
+
+        if resume:
+            self.resumed = self.load()
+        if not self.resumed:
+            with open(self.path, 'w') as f:
+                f.write('%s\n' % json.dumps(
+                    {'destination': self.destination}
+                ))
+        self.journal = open(self.path, 'a')
+
+    def load(self):
+        """Load the journal of the last import into this destination.
+
+        :returns: bool, False if there isn't one.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                header = json.loads(f.readline())
+                if header.get('destination') != self.destination:
+                    return False
+                for line in f:
+                    try:
+                        _file, identity, status, dest_path = json.loads(line)
+                    except ValueError:
+                        # The last line is cut short if the import was
+                        #  killed while writing it.
+                        continue
+                    self.entries[_file] = {
+                        'identity': identity,
+                        'status': status,
+                        'destination': dest_path,
+                    }
+        except (IOError, ValueError):
+            return False
+
+        return True
+
+    def get_identity(self, _file, stat=None):
+        """Get what tells a file apart from a different file at the same
+        path.
+
+        :param str _file: Path of the file.
+        :param stat: Result of os.stat() for the file if it's already known.
+        :returns: list of the device, inode, size and modification time, or
+            None if the file can't be found.
+        """
+        if stat is None:
+            try:
+                stat = os.stat(_file)
+            except OSError:
+                return None
+
+        return [stat.st_dev, stat.st_ino, stat.st_size,
+                _nanoseconds(stat, 'mtime')]
+
+    def get_finished(self, _file, identity):
+        """Get the entry of a file which an earlier run finished.
+
+        :param str _file: Path of the file.
+        :param list identity: From :meth:`get_identity`.
+        :returns: dict with the status and destination, or None if the file
+            needs importing.
+        """
+        entry = self.entries.get(_decode(_file))
+        if entry is None or entry['status'] not in self.finished_statuses:
+            return None
+
+        # A file which is gone was moved to the trash once it was imported.
+        if identity is not None and identity != entry['identity']:
+            return None
+
+        return entry
+
+    def add(self, _file, identity, status, dest_path=None):
+        """Record what happened to a file.
+
+        :param str _file: Path of the file.
+        :param list identity: From :meth:`get_identity` before the file was
+            imported.
+        :param str status: ``completed``, ``skipped`` or ``failed``.
+        :param str dest_path: Where the file was imported to.
+        """
+        # Nothing looks a file up again during this run so the entry only
+        #  goes to disk.
+        self.journal.write('%s\n' % json.dumps(
+            [_decode(_file), identity, status, dest_path]
+        ))
+        self.journal.flush()
+
+    def close(self):
+        self.journal.close()
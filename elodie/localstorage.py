@@ -7,76 +7,285 @@ from builtins import object
 import hashlib
 import json
 import os
+import sqlite3
 import sys
+import threading
+import time
 
-from math import radians, cos, sqrt
-from shutil import copyfile
+from math import floor, pi, radians, cos, sqrt
+from shutil import copyfile, copymode
 from time import strftime
 
 from elodie import constants
+from elodie.compatability import _rename
+from elodie.config import load_config
+
+# xxhash is optional and only needed for the xxh3 checksum algorithm.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+#: Functions which create a hasher for each checksum algorithm which can be
+#:  set in the [Checksum] section of config.ini.
+checksum_algorithms = {'sha256': hashlib.sha256}
+if hasattr(hashlib, 'blake2b'):
+    checksum_algorithms['blake2b'] = hashlib.blake2b
+if hasattr(xxhash, 'xxh3_128'):
+    checksum_algorithms['xxh3'] = xxhash.xxh3_128
 
 
 class Db(object):
 
     """A class for interacting with the JSON files created by Elodie."""
 
+    #: Fold the hash db journal into hash.json once it grows past this many
+    #:  bytes or half the size of hash.json, whichever is larger.
+    journal_compact_min_bytes = 1048576
+
+    #: :class:`ChecksumCache` used by :meth:`checksum`, or None to always
+    #:  read the whole file.
+    checksum_cache = None
+
+    #: Algorithm :meth:`checksum` uses, one of :data:`checksum_algorithms`.
+    checksum_algorithm = 'sha256'
+
+    #: Files at least this many bytes get a sample from
+    #:  :meth:`checksum_sample` so duplicates can be found without reading
+    #:  all of them.
+    sample_min_size = 16777216
+
+    #: Number of blocks read for a sample, spread evenly from the start to
+    #:  the end of the file.
+    sample_blocks = 6
+
+    #: Size of each block read for a sample.
+    sample_block_size = 65536
+
     def __init__(self):
         # verify that the application directory (~/.elodie) exists,
         #   else create it
         if not os.path.exists(constants.application_directory):
             os.makedirs(constants.application_directory)
 
-        # If the hash db doesn't exist we create it.
-        # Otherwise we only open for reading
-        if not os.path.isfile(constants.hash_db):
-            with open(constants.hash_db, 'a'):
-                os.utime(constants.hash_db, None)
+        # The hash and location dbs are loaded lazily the first time they
+        #   are accessed. We remember the path, mtime and size of the files we
+        #   loaded so that we can reload them if another process changes them.
+        # Hashes added with write=True are appended to a journal next to
+        #   hash.json which is replayed on load and periodically compacted.
+        self._hash_db = None
+        self._hash_db_signature = None
+        self._hash_db_pending = {}
+        self._hash_db_reset = False
 
-        self.hash_db = {}
+        self._location_db = None
+        self._location_db_signature = None
+        self._location_db_pending = []
+        self._location_index = None
 
-        # We know from above that this file exists so we open it
-        #   for reading only.
-        with open(constants.hash_db, 'r') as f:
-            try:
-                self.hash_db = json.load(f)
-            except ValueError:
-                pass
+        self._sample_db = None
+        self._sample_db_signature = None
+        self._sample_db_pending = {}
+        self._sample_db_reset = False
+
+        self._stat_db = None
+        self._stat_db_signature = None
+        self._stat_db_pending = {}
+        self._stat_db_reset = False
+
+        # The session is shared by the threads of a parallel import.
+        self.lock = threading.RLock()
+
+        # If the hash db doesn't exist we create it.
+        # Otherwise we only open for reading
+        self._create_if_missing(constants.hash_db)
 
         # If the location db doesn't exist we create it.
         # Otherwise we only open for reading
-        if not os.path.isfile(constants.location_db):
-            with open(constants.location_db, 'a'):
-                os.utime(constants.location_db, None)
+        self._create_if_missing(constants.location_db)
 
-        self.location_db = []
+    @property
+    def hash_db(self):
+        """The hash db as a dictionary of checksum to file path.
 
-        # We know from above that this file exists so we open it
-        #   for reading only.
-        with open(constants.location_db, 'r') as f:
-            try:
-                self.location_db = json.load(f)
-            except ValueError:
-                pass
+        Loaded from disk the first time it's accessed and reloaded if the
+        file was changed by another process and we have nothing unsaved.
+        """
+        if(self._hash_db is None or (
+                len(self._hash_db_pending) == 0 and
+                self._hash_db_reset is False and
+                self._hash_db_signature_on_disk() != self._hash_db_signature)):
+            self._hash_db, self._hash_db_signature = self._load_hash_db()
+        return self._hash_db
+
+    @hash_db.setter
+    def hash_db(self, value):
+        self._hash_db = value
+        self._hash_db_signature = self._hash_db_signature_on_disk()
+
+    @property
+    def hash_db_journal(self):
+        """Path to the append-only journal of the hash db."""
+        return '%s.journal' % constants.hash_db
+
+    @property
+    def sample_db(self):
+        """The sample db as a dictionary of size and sample, from
+        :meth:`checksum_sample`, to a list of checksums.
+
+        Loaded from disk the first time it's accessed and reloaded if the
+        file was changed by another process and we have nothing unsaved.
+        """
+        if(self._sample_db is None or (
+                len(self._sample_db_pending) == 0 and
+                self._sample_db_reset is False and
+                self._signature(constants.sample_db) != self._sample_db_signature)):  # noqa
+            self._sample_db, self._sample_db_signature = self._load(
+                constants.sample_db,
+                {}
+            )
+        return self._sample_db
+
+    @sample_db.setter
+    def sample_db(self, value):
+        self._sample_db = value
+        self._sample_db_signature = self._signature(constants.sample_db)
+
+    @property
+    def stat_db(self):
+        """The stat db as a dictionary of checksum to the size and
+        modification time, from :func:`size_and_mtime`, of the file in the
+        hash db.
+
+        Loaded from disk the first time it's accessed and reloaded if the
+        file was changed by another process and we have nothing unsaved.
+        """
+        if(self._stat_db is None or (
+                len(self._stat_db_pending) == 0 and
+                self._stat_db_reset is False and
+                self._signature(constants.stat_db) != self._stat_db_signature)):  # noqa
+            self._stat_db, self._stat_db_signature = self._load(
+                constants.stat_db,
+                {}
+            )
+        return self._stat_db
+
+    @stat_db.setter
+    def stat_db(self, value):
+        self._stat_db = value
+        self._stat_db_signature = self._signature(constants.stat_db)
+
+    @property
+    def location_db(self):
+        """The location db as a list of dictionaries with lat, long and name.
+
+        Loaded from disk the first time it's accessed and reloaded if the
+        file was changed by another process and we have nothing unsaved.
+        """
+        if(self._location_db is None or (
+                len(self._location_db_pending) == 0 and
+                self._signature(constants.location_db) != self._location_db_signature)):  # noqa
+            self._location_db, self._location_db_signature = self._load(
+                constants.location_db,
+                []
+            )
+        return self._location_db
+
+    @location_db.setter
+    def location_db(self, value):
+        self._location_db = value
+        self._location_db_signature = self._signature(constants.location_db)
 
     def add_hash(self, key, value, write=False):
         """Add a hash to the hash db.
 
+        Writing appends a single record to the journal instead of rewriting
+        hash.json so the cost doesn't grow with the size of the hash db.
+
         :param str key:
         :param str value:
-        :param bool write: If true, write the hash db to disk.
+        :param bool write: If true, write the hash to disk.
         """
-        self.hash_db[key] = value
-        if(write is True):
-            self.update_hash_db()
+        with self.lock:
+            self.hash_db[key] = value
+
+            if(write is False):
+                self._hash_db_pending[key] = value
+            elif(self._hash_db_reset is True):
+                # The journal is replayed on top of hash.json which we are
+                #   replacing so we have to write the whole hash db instead.
+                self._hash_db_pending[key] = value
+                self.update_hash_db()
+            else:
+                self._append_to_journal(key, value)
+
+    def remove_hash(self, key, write=False):
+        """Remove a hash from the hash db.
+
+        Writing appends a record with no path to the journal, which removes
+        the hash when the journal is replayed.
+
+        :param str key:
+        :param bool write: If true, write the removal to disk.
+        """
+        with self.lock:
+            self.hash_db.pop(key, None)
+            if(key in self.stat_db):
+                self.stat_db.pop(key)
+                self._stat_db_pending[key] = None
+
+            if(write is False):
+                self._hash_db_pending[key] = None
+            elif(self._hash_db_reset is True):
+                self._hash_db_pending[key] = None
+                self.update_hash_db()
+            else:
+                self._append_to_journal(key, None)
+
+    def add_sample(self, sample, checksum, write=False):
+        """Add the sample of a file to the sample db.
+
+        The sample db is only used to skip reading files which were already
+        imported so it's written when the session is flushed rather than
+        journaled.
+
+        :param tuple sample: Size and sample from :meth:`checksum_sample`.
+        :param str checksum: Checksum of the file.
+        :param bool write: If true, write the sample db to disk.
+        """
+        with self.lock:
+            key = self._sample_key(sample)
+            checksums = self.sample_db.setdefault(key, [])
+            if(checksum not in checksums):
+                checksums.append(checksum)
+                self._sample_db_pending.setdefault(key, []).append(checksum)
+            if(write is True):
+                self.update_sample_db()
+
+    def add_stat(self, checksum, stat, write=False):
+        """Add the size and modification time of a file to the stat db.
+
+        Like the sample db it's written when the session is flushed. A file
+        whose stat was lost is read again by ``verify --quick``.
+
+        :param str checksum: Checksum of the file in the hash db.
+        :param tuple stat: Size and modification time from
+            :func:`size_and_mtime`.
+        :param bool write: If true, write the stat db to disk.
+        """
+        with self.lock:
+            value = list(stat)
+            if(self.stat_db.get(checksum) != value):
+                self.stat_db[checksum] = value
+                self._stat_db_pending[checksum] = value
+            if(write is True):
+                self.update_stat_db()
 
     # Location database
-    # Currently quite simple just a list of long/lat pairs with a name
-    # If it gets many entries a lookup might take too long and a better
-    # structure might be needed. Some speed up ideas:
-    # - Sort it and inter-half method can be used
-    # - Use integer part of long or lat as key to get a lower search list
-    # - Cache a small number of lookups, photos are likely to be taken in
-    #   clusters around a spot during import.
+    # A list of long/lat pairs with a name. Lookups by coordinates go through
+    # a :class:`LocationIndex` which is built the first time it's needed and
+    # updated as locations are added.
     def add_location(self, latitude, longitude, place, write=False):
         """Add a location to the database.
 
@@ -85,21 +294,32 @@ class Db(object):
         :param str place: Name for the location.
         :param bool write: If true, write the location db to disk.
         """
-        data = {}
-        data['lat'] = latitude
-        data['long'] = longitude
-        data['name'] = place
-        self.location_db.append(data)
-        if(write is True):
-            self.update_location_db()
+        with self.lock:
+            data = {}
+            data['lat'] = latitude
+            data['long'] = longitude
+            data['name'] = place
+            self.location_db.append(data)
+            self._location_db_pending.append(data)
+            if(self._location_index is not None and
+                    self._location_index.locations is self._location_db):
+                self._location_index.add(data)
+            if(write is True):
+                self.update_location_db()
 
     def backup_hash_db(self):
         """Backs up the hash db."""
-        if os.path.isfile(constants.hash_db):
-            mask = strftime('%Y-%m-%d_%H-%M-%S')
-            backup_file_name = '%s-%s' % (constants.hash_db, mask)
-            copyfile(constants.hash_db, backup_file_name)
-            return backup_file_name
+        with self.lock:
+            if os.path.isfile(constants.hash_db):
+                mask = strftime('%Y-%m-%d_%H-%M-%S')
+                backup_file_name = '%s-%s' % (constants.hash_db, mask)
+                # Entries in the journal aren't in hash.json yet so we write out
+                #   the merged hash db in that case.
+                if(self._journal_size() > 0):
+                    self._write_atomic(backup_file_name, self.hash_db)
+                else:
+                    copyfile(constants.hash_db, backup_file_name)
+                return backup_file_name
 
     def check_hash(self, key):
         """Check whether a hash is present for the given key.
@@ -107,27 +327,142 @@ class Db(object):
         :param str key:
         :returns: bool
         """
-        return key in self.hash_db
+        with self.lock:
+            return key in self.hash_db
 
-    def checksum(self, file_path, blocksize=65536):
+    def checksum(self, file_path, blocksize=1048576, algorithm=None,
+                 rehash=False, throttle=None, stat=None):
         """Create a hash value for the given file.
 
         See http://stackoverflow.com/a/3431835/1318758.
 
+        If there's a :attr:`checksum_cache` and the file hasn't changed since
+        it was last hashed the cached value is returned without reading it.
+
         :param str file_path: Path to the file to create a hash for.
         :param int blocksize: Read blocks of this size from the file when
             creating the hash.
+        :param str algorithm: Algorithm to use instead of
+            :attr:`checksum_algorithm`.
+        :param bool rehash: Read the file even if it's in the cache. The
+            cache is still updated.
+        :param throttle: Called with the number of bytes after each block
+            is read, e.g. to limit how fast the file is read.
+        :param stat: Result of os.stat() for the file if it's already
+            known.
         :returns: str or None
         """
+        if(algorithm is None):
+            algorithm = self.checksum_algorithm
+
+        checksum_cache = self.checksum_cache
+        if(checksum_cache is not None):
+            # Stat before reading so a change while we read is noticed the
+            #  next time.
+            if(stat is None):
+                stat = os.stat(file_path)
+            checksum = None
+            if(rehash is False):
+                checksum = checksum_cache.get(stat)
+            if(checksum is not None and
+                    get_checksum_algorithm(checksum) == algorithm):
+                return checksum
+
+        hasher = new_hasher(algorithm)
+        buf = bytearray(blocksize)
+        view = memoryview(buf)
+        with open(file_path, 'rb') as f:
+            _advise_sequential(f)
+            size = f.readinto(buf)
+
+            while size > 0:
+                hasher.update(view[:size])
+                if(throttle is not None):
+                    throttle(size)
+                size = f.readinto(buf)
+            checksum = format_checksum(algorithm, hasher.hexdigest())
+
+        if(checksum_cache is not None):
+            checksum_cache.add(stat, checksum)
+        return checksum
+
+    def get_cached_checksum(self, file_path, stat=None):
+        """Get a file's checksum from the :attr:`checksum_cache` without
+        reading the file.
+
+        :param str file_path: Path to the file.
+        :param stat: Result of os.stat() for the file if it's already
+            known.
+        :returns: str or None if the file isn't in the cache, has changed
+            or was hashed with a different algorithm.
+        """
+        checksum_cache = self.checksum_cache
+        if(checksum_cache is None):
+            return None
+
+        if(stat is None):
+            stat = os.stat(file_path)
+        checksum = checksum_cache.get(stat)
+        if(checksum is None or
+                get_checksum_algorithm(checksum) != self.checksum_algorithm):
+            return None
+        return checksum
+
+    def checksum_sample(self, file_path, size=None):
+        """Create a hash value from a few blocks of a large file.
+
+        Two files with the same size and sample are almost certainly the
+        same, which lets an import skip a large file it already has after
+        reading :attr:`sample_blocks` blocks of it.
+
+        :param str file_path: Path to the file to sample.
+        :param int size: Size of the file, if it's already known.
+        :returns: tuple of the size and the hash value, or None if the file
+            is smaller than :attr:`sample_min_size`.
+        """
+        if(size is None):
+            size = os.path.getsize(file_path)
+        if(size < self.sample_min_size):
+            return None
+
         hasher = hashlib.sha256()
+        last_offset = max(0, size - self.sample_block_size)
         with open(file_path, 'rb') as f:
-            buf = f.read(blocksize)
+            for block in range(self.sample_blocks):
+                f.seek(last_offset * block // (self.sample_blocks - 1))
+                hasher.update(f.read(self.sample_block_size))
+        return (size, hasher.hexdigest())
+
+    def checksum_copy(self, file_path, dest_path, blocksize=1048576):
+        """Copy a file and create its hash value from the same read.
+
+        The hash value is the same as :meth:`checksum` returns for
+        file_path.
 
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = f.read(blocksize)
-            return hasher.hexdigest()
-        return None
+        :param str file_path: Path to the file to copy.
+        :param str dest_path: Path to copy the file to.
+        :param int blocksize: Read and write blocks of this size.
+        :returns: str
+        """
+        stat = os.stat(file_path)
+        hasher = new_hasher(self.checksum_algorithm)
+        buf = bytearray(blocksize)
+        view = memoryview(buf)
+        with open(file_path, 'rb') as f_read:
+            _advise_sequential(f_read)
+            with open(dest_path, 'wb') as f_write:
+                size = f_read.readinto(buf)
+
+                while size > 0:
+                    hasher.update(view[:size])
+                    f_write.write(view[:size])
+                    size = f_read.readinto(buf)
+        copymode(file_path, dest_path)
+        checksum = format_checksum(self.checksum_algorithm, hasher.hexdigest())
+
+        if(self.checksum_cache is not None):
+            self.checksum_cache.add(stat, checksum)
+        return checksum
 
     def get_hash(self, key):
         """Get the hash value for a given key.
@@ -135,12 +470,35 @@ class Db(object):
         :param str key:
         :returns: str or None
         """
-        if(self.check_hash(key) is True):
-            return self.hash_db[key]
-        return None
+        with self.lock:
+            if(self.check_hash(key) is True):
+                return self.hash_db[key]
+            return None
+
+    def get_sample(self, sample):
+        """Get the checksums of files with a given size and sample.
+
+        :param tuple sample: Size and sample from :meth:`checksum_sample`.
+        :returns: list of str
+        """
+        with self.lock:
+            return list(self.sample_db.get(self._sample_key(sample), []))
+
+    def get_stat(self, checksum):
+        """Get the size and modification time of a file in the hash db.
+
+        :param str checksum:
+        :returns: tuple from :func:`size_and_mtime`, or None if it isn't
+            in the stat db.
+        """
+        with self.lock:
+            value = self.stat_db.get(checksum)
+            if(value is None):
+                return None
+            return tuple(value)
 
     def get_location_name(self, latitude, longitude, threshold_m):
-        """Find a name for a location in the database.
+        """Find the nearest name for a location in the database.
 
         :param float latitude: Latitude of the location.
         :param float longitude: Longitude of the location.
@@ -148,28 +506,17 @@ class Db(object):
             the given latitude and longitude.
         :returns: str, or None if a matching location couldn't be found.
         """
-        last_d = sys.maxsize
-        name = None
-        for data in self.location_db:
-            # As threshold is quite small use simple math
-            # From http://stackoverflow.com/questions/15736995/how-can-i-quickly-estimate-the-distance-between-two-latitude-longitude-points  # noqa
-            # convert decimal degrees to radians
-
-            lon1, lat1, lon2, lat2 = list(map(
-                radians,
-                [longitude, latitude, data['long'], data['lat']]
-            ))
-
-            r = 6371000  # radius of the earth in m
-            x = (lon2 - lon1) * cos(0.5 * (lat2 + lat1))
-            y = lat2 - lat1
-            d = r * sqrt(x * x + y * y)
-            # Use if closer then threshold_km reuse lookup
-            if(d <= threshold_m and d < last_d):
-                name = data['name']
-            last_d = d
-
-        return name
+        with self.lock:
+            # The index is rebuilt if the location db was reloaded from disk.
+            location_db = self.location_db
+            if(self._location_index is None or
+                    self._location_index.locations is not location_db):
+                self._location_index = LocationIndex(location_db)
+
+            data = self._location_index.nearest(latitude, longitude, threshold_m)
+            if data is None:
+                return None
+            return data['name']
 
     def get_location_coordinates(self, name):
         """Get the latitude and longitude for a location.
@@ -177,11 +524,12 @@ class Db(object):
         :param str name: Name of the location.
         :returns: tuple(float), or None if the location wasn't in the database.
         """
-        for data in self.location_db:
-            if data['name'] == name:
-                return (data['lat'], data['long'])
+        with self.lock:
+            for data in self.location_db:
+                if data['name'] == name:
+                    return (data['lat'], data['long'])
 
-        return None
+            return None
 
     def all(self):
         """Generator to get all entries from self.hash_db
@@ -191,15 +539,1033 @@ class Db(object):
         for checksum, path in self.hash_db.items():
             yield (checksum, path)
 
+    def all_samples(self):
+        """Generator to get all entries from self.sample_db
+
+        :returns: tuple of the size and sample and the checksum
+        """
+        for key, checksums in self.sample_db.items():
+            size, sample = key.split(':', 1)
+            for checksum in checksums:
+                yield ((int(size), sample), checksum)
+
+    def all_stats(self):
+        """Generator to get all entries from self.stat_db
+
+        :returns: tuple of the checksum and the size and modification time
+        """
+        for checksum, value in self.stat_db.items():
+            yield (checksum, tuple(value))
+
+    def flush(self):
+        """Write any unsaved changes to the hash and location dbs to disk.
+
+        Called once at the end of an import, update or verify run. This also
+        compacts the hash db journal into hash.json.
+        """
+        if(self.checksum_cache is not None):
+            self.checksum_cache.flush()
+        with self.lock:
+            if(len(self._hash_db_pending) > 0 or
+                    self._hash_db_reset is True or
+                    self._journal_size() > 0):
+                self.update_hash_db()
+            if(len(self._location_db_pending) > 0):
+                self.update_location_db()
+            if(len(self._sample_db_pending) > 0 or
+                    self._sample_db_reset is True):
+                self.update_sample_db()
+            if(len(self._stat_db_pending) > 0 or
+                    self._stat_db_reset is True):
+                self.update_stat_db()
+
     def reset_hash_db(self):
-        self.hash_db = {}
+        with self.lock:
+            self.hash_db = {}
+            self._hash_db_pending = {}
+            self._hash_db_reset = True
+            self.sample_db = {}
+            self._sample_db_pending = {}
+            self._sample_db_reset = True
+            self.stat_db = {}
+            self._stat_db_pending = {}
+            self._stat_db_reset = True
 
     def update_hash_db(self):
-        """Write the hash db to disk."""
-        with open(constants.hash_db, 'w') as f:
-            json.dump(self.hash_db, f)
+        """Write the hash db to disk and empty the journal.
+
+        If another process changed the files since we loaded them then we
+        merge our unsaved changes into what's on disk instead of overwriting
+        it. hash.json is replaced atomically so a crash can't truncate it.
+        """
+        with self.lock:
+            hash_db = self.hash_db
+            if(self._hash_db_reset is False and
+                    self._hash_db_signature_on_disk() != self._hash_db_signature):
+                hash_db, _ = self._load_hash_db()
+                for key, value in self._hash_db_pending.items():
+                    # Removed hashes are pending with no path.
+                    if(value is None):
+                        hash_db.pop(key, None)
+                    else:
+                        hash_db[key] = value
+
+            self._write_atomic(constants.hash_db, hash_db)
+            # A crash before the journal is emptied only means its records get
+            #   replayed again, which is harmless.
+            with open(self.hash_db_journal, 'w'):
+                pass
+
+            self.hash_db = hash_db
+            self._hash_db_pending = {}
+            self._hash_db_reset = False
 
     def update_location_db(self):
-        """Write the location db to disk."""
-        with open(constants.location_db, 'w') as f:
-            json.dump(self.location_db, f)
+        """Write the location db to disk.
+
+        If another process changed the file since we loaded it then we merge
+        our unsaved changes into what's on disk instead of overwriting it.
+        """
+        with self.lock:
+            location_db = self.location_db
+            if(self._signature(constants.location_db) != self._location_db_signature):  # noqa
+                location_db, _ = self._load(constants.location_db, [])
+                location_db.extend(self._location_db_pending)
+
+            self._write_atomic(constants.location_db, location_db)
+
+            self.location_db = location_db
+            self._location_db_pending = []
+
+    def update_sample_db(self):
+        """Write the sample db to disk.
+
+        If another process changed the file since we loaded it then we merge
+        our unsaved changes into what's on disk instead of overwriting it.
+        """
+        with self.lock:
+            sample_db = self.sample_db
+            if(self._sample_db_reset is False and
+                    self._signature(constants.sample_db) != self._sample_db_signature):  # noqa
+                sample_db, _ = self._load(constants.sample_db, {})
+                for key, checksums in self._sample_db_pending.items():
+                    sample_checksums = sample_db.setdefault(key, [])
+                    sample_checksums.extend(
+                        checksum for checksum in checksums
+                        if checksum not in sample_checksums
+                    )
+
+            self._write_atomic(constants.sample_db, sample_db)
+
+            self.sample_db = sample_db
+            self._sample_db_pending = {}
+            self._sample_db_reset = False
+
+    def update_stat_db(self):
+        """Write the stat db to disk.
+
+        If another process changed the file since we loaded it then we merge
+        our unsaved changes into what's on disk instead of overwriting it.
+        """
+        with self.lock:
+            stat_db = self.stat_db
+            if(self._stat_db_reset is False and
+                    self._signature(constants.stat_db) != self._stat_db_signature):  # noqa
+                stat_db, _ = self._load(constants.stat_db, {})
+                for key, value in self._stat_db_pending.items():
+                    # Removed stats are pending with no value.
+                    if(value is None):
+                        stat_db.pop(key, None)
+                    else:
+                        stat_db[key] = value
+
+            self._write_atomic(constants.stat_db, stat_db)
+
+            self.stat_db = stat_db
+            self._stat_db_pending = {}
+            self._stat_db_reset = False
+
+    def _append_to_journal(self, key, value):
+        """Append a single hash to the journal and compact it if needed."""
+        signature_before = self._hash_db_signature_on_disk()
+        with open(self.hash_db_journal, 'a') as f:
+            f.write('%s\n' % json.dumps([key, value]))
+
+        # If nobody else changed the files since we loaded them then what we
+        #   have in memory is still current and doesn't need to be reloaded.
+        if(signature_before == self._hash_db_signature):
+            self._hash_db_signature = self._hash_db_signature_on_disk()
+
+        # Compacting rewrites all of hash.json so we only do it once the
+        #   journal is large relative to it. That keeps the cost per hash
+        #   flat as the hash db grows.
+        journal_size = self._journal_size()
+        hash_db_signature = self._signature(constants.hash_db)
+        hash_db_size = hash_db_signature[2] if hash_db_signature else 0
+        if(journal_size > max(self.journal_compact_min_bytes, hash_db_size // 2)):  # noqa
+            self.update_hash_db()
+
+    def _create_if_missing(self, file_path):
+        if not os.path.isfile(file_path):
+            with open(file_path, 'a'):
+                os.utime(file_path, None)
+
+    def _load(self, file_path, default):
+        """Load a JSON db from disk.
+
+        :returns: tuple of the parsed contents and the file's signature
+        """
+        self._create_if_missing(file_path)
+        signature = self._signature(file_path)
+
+        # We know from above that this file exists so we open it
+        #   for reading only.
+        with open(file_path, 'r') as f:
+            try:
+                return (json.load(f), signature)
+            except ValueError:
+                pass
+
+        return (default, signature)
+
+    def _hash_db_signature_on_disk(self):
+        return (
+            self._signature(constants.hash_db),
+            self._signature(self.hash_db_journal)
+        )
+
+    def _journal_size(self):
+        signature = self._signature(self.hash_db_journal)
+        if signature is None:
+            return 0
+        return signature[2]
+
+    def _load_hash_db(self):
+        """Load hash.json from disk and replay the journal on top of it.
+
+        :returns: tuple of the hash db and the signature of its files
+        """
+        signature = self._hash_db_signature_on_disk()
+        hash_db, _ = self._load(constants.hash_db, {})
+
+        if os.path.isfile(self.hash_db_journal):
+            with open(self.hash_db_journal, 'r') as f:
+                for line in f:
+                    # The last line may be incomplete if we crashed while
+                    #   writing it so we skip anything we can't parse.
+                    try:
+                        key, value = json.loads(line)
+                    except ValueError:
+                        continue
+                    if(value is None):
+                        hash_db.pop(key, None)
+                    else:
+                        hash_db[key] = value
+
+        return (hash_db, signature)
+
+    def _sample_key(self, sample):
+        return '%d:%s' % sample
+
+    def _signature(self, file_path):
+        """Identify the version of a db file on disk.
+
+        :returns: tuple(str, float, int) or None if the file does not exist
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (file_path, stat.st_mtime, stat.st_size)
+
+    def _write_atomic(self, file_path, data):
+        """Write data as JSON to a temporary file and rename it into place."""
+        temporary_file_path = '%s.tmp-%s' % (file_path, os.getpid())
+        with open(temporary_file_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        _rename(temporary_file_path, file_path)
+
+
+class SqliteDb(Db):
+
+    """A class for storing what Elodie caches in a SQLite database.
+
+    Used instead of :class:`Db` when config.ini has a [Database] section with
+    backend=sqlite. Hashes are keyed by checksum with an index on the path
+    and locations are indexed by latitude and longitude so lookups don't
+    require loading the whole library into memory.
+
+    The first time the database is created it's populated from hash.json and
+    location.json. :meth:`export_to_json` writes them back out.
+    """
+
+    def __init__(self):
+        # verify that the application directory (~/.elodie) exists,
+        #   else create it
+        if not os.path.exists(constants.application_directory):
+            os.makedirs(constants.application_directory)
+
+        is_new = not os.path.isfile(constants.sqlite_db)
+
+        # The session is shared by the threads of a parallel import so we
+        #   serialize access to the connection ourselves.
+        self.lock = threading.RLock()
+
+        self.connection = sqlite3.connect(
+            constants.sqlite_db,
+            check_same_thread=False
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                checksum TEXT PRIMARY KEY,
+                path TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS hashes_path ON hashes (path);
+            CREATE TABLE IF NOT EXISTS samples (
+                size INTEGER NOT NULL,
+                sample TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                PRIMARY KEY (size, sample, checksum)
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                checksum TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS locations (
+                id INTEGER PRIMARY KEY,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                name TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS locations_latitude_longitude
+                ON locations (latitude, longitude);
+            CREATE INDEX IF NOT EXISTS locations_name ON locations (name);
+        """)
+
+        if is_new:
+            self.import_from_json()
+
+    def add_hash(self, key, value, write=False):
+        """Add a hash to the hash db.
+
+        :param str key:
+        :param str value:
+        :param bool write: If true, commit the hash to disk.
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO hashes (checksum, path) VALUES (?, ?)',
+                (key, value)
+            )
+            if(write is True):
+                self.connection.commit()
+
+    def remove_hash(self, key, write=False):
+        """Remove a hash from the hash db.
+
+        :param str key:
+        :param bool write: If true, commit the removal to disk.
+        """
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM hashes WHERE checksum = ?',
+                (key,)
+            )
+            self.connection.execute(
+                'DELETE FROM stats WHERE checksum = ?',
+                (key,)
+            )
+            if(write is True):
+                self.connection.commit()
+
+    def add_sample(self, sample, checksum, write=False):
+        """Add the sample of a file to the sample db.
+
+        :param tuple sample: Size and sample from :meth:`checksum_sample`.
+        :param str checksum: Checksum of the file.
+        :param bool write: If true, commit the sample to disk.
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO samples (size, sample, checksum) VALUES (?, ?, ?)',  # noqa
+                sample + (checksum,)
+            )
+            if(write is True):
+                self.connection.commit()
+
+    def add_stat(self, checksum, stat, write=False):
+        """Add the size and modification time of a file to the stat db.
+
+        :param str checksum: Checksum of the file in the hash db.
+        :param tuple stat: Size and modification time from
+            :func:`size_and_mtime`.
+        :param bool write: If true, commit the stat to disk.
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stats (checksum, size, mtime_ns) VALUES (?, ?, ?)',  # noqa
+                (checksum,) + tuple(stat)
+            )
+            if(write is True):
+                self.connection.commit()
+
+    def add_location(self, latitude, longitude, place, write=False):
+        """Add a location to the database.
+
+        :param float latitude: Latitude of the location.
+        :param float longitude: Longitude of the location.
+        :param str place: Name for the location.
+        :param bool write: If true, commit the location to disk.
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO locations (latitude, longitude, name) VALUES (?, ?, ?)',  # noqa
+                (latitude, longitude, self._encode_name(place))
+            )
+            if(write is True):
+                self.connection.commit()
+
+    def backup_hash_db(self):
+        """Backs up the database."""
+        with self.lock:
+            self.connection.commit()
+            mask = strftime('%Y-%m-%d_%H-%M-%S')
+            backup_file_name = '%s-%s' % (constants.sqlite_db, mask)
+            # Checkpoint the write-ahead log so the database file is complete.
+            self.connection.execute('PRAGMA wal_checkpoint(FULL)')
+            copyfile(constants.sqlite_db, backup_file_name)
+            return backup_file_name
+
+    def check_hash(self, key):
+        """Check whether a hash is present for the given key.
+
+        :param str key:
+        :returns: bool
+        """
+        return self.get_hash(key) is not None
+
+    def get_hash(self, key):
+        """Get the hash value for a given key.
+
+        :param str key:
+        :returns: str or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT path FROM hashes WHERE checksum = ?',
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def get_sample(self, sample):
+        """Get the checksums of files with a given size and sample.
+
+        :param tuple sample: Size and sample from :meth:`checksum_sample`.
+        :returns: list of str
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                'SELECT checksum FROM samples WHERE size = ? AND sample = ?',
+                sample
+            )]
+
+    def get_stat(self, checksum):
+        """Get the size and modification time of a file in the hash db.
+
+        :param str checksum:
+        :returns: tuple from :func:`size_and_mtime`, or None if it isn't
+            in the stat db.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT size, mtime_ns FROM stats WHERE checksum = ?',
+                (checksum,)
+            ).fetchone()
+            if row is None:
+                return None
+            return tuple(row)
+
+    def get_location_name(self, latitude, longitude, threshold_m):
+        """Find the nearest name for a location in the database.
+
+        Only locations inside a box of threshold_m around the given latitude
+        and longitude are read from the database.
+
+        :param float latitude: Latitude of the location.
+        :param float longitude: Longitude of the location.
+        :param int threshold_m: Location in the database must be this close to
+            the given latitude and longitude.
+        :returns: str, or None if a matching location couldn't be found.
+        """
+        with self.lock:
+            min_latitude, max_latitude, min_longitude, max_longitude = \
+                bounding_box(latitude, longitude, threshold_m)
+
+            # A box which crosses the antimeridian is split in two.
+            longitude_ranges = longitude_ranges_in_box(min_longitude,
+                                                       max_longitude)
+            rows = self.connection.execute(
+                """SELECT latitude, longitude, name FROM locations
+                   WHERE latitude BETWEEN ? AND ? AND (%s)""" % ' OR '.join(
+                    ['longitude BETWEEN ? AND ?'] * len(longitude_ranges)
+                ),
+                (min_latitude, max_latitude) + sum(longitude_ranges, ())
+            )
+
+            name = None
+            last_d = sys.maxsize
+            for row_latitude, row_longitude, row_name in rows:
+                d = distance_m(latitude, longitude, row_latitude, row_longitude)
+                if(d <= threshold_m and d < last_d):
+                    name = row_name
+                    last_d = d
+
+            if name is None:
+                return None
+            return json.loads(name)
+
+    def get_location_coordinates(self, name):
+        """Get the latitude and longitude for a location.
+
+        :param str name: Name of the location.
+        :returns: tuple(float), or None if the location wasn't in the database.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT latitude, longitude FROM locations WHERE name = ? LIMIT 1',
+                (self._encode_name(name),)
+            ).fetchone()
+            if row is None:
+                return None
+            return (row[0], row[1])
+
+    def all(self):
+        """Generator to get all entries from the hash db
+
+        :returns tuple(string)
+        """
+        for checksum, path in self.connection.execute(
+                'SELECT checksum, path FROM hashes'):
+            yield (checksum, path)
+
+    def all_samples(self):
+        """Generator to get all entries from the sample db
+
+        :returns: tuple of the size and sample and the checksum
+        """
+        for size, sample, checksum in self.connection.execute(
+                'SELECT size, sample, checksum FROM samples'):
+            yield ((size, sample), checksum)
+
+    def all_stats(self):
+        """Generator to get all entries from the stat db
+
+        :returns: tuple of the checksum and the size and modification time
+        """
+        for checksum, size, mtime_ns in self.connection.execute(
+                'SELECT checksum, size, mtime_ns FROM stats'):
+            yield (checksum, (size, mtime_ns))
+
+    def flush(self):
+        """Commit any unsaved changes to disk."""
+        if(self.checksum_cache is not None):
+            self.checksum_cache.flush()
+        with self.lock:
+            self.connection.commit()
+
+    def reset_hash_db(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM hashes')
+            self.connection.execute('DELETE FROM samples')
+            self.connection.execute('DELETE FROM stats')
+
+    def update_hash_db(self):
+        """Commit the hash db to disk."""
+        with self.lock:
+            self.connection.commit()
+
+    def update_location_db(self):
+        """Commit the location db to disk."""
+        with self.lock:
+            self.connection.commit()
+
+    def update_sample_db(self):
+        """Commit the sample db to disk."""
+        with self.lock:
+            self.connection.commit()
+
+    def update_stat_db(self):
+        """Commit the stat db to disk."""
+        with self.lock:
+            self.connection.commit()
+
+    def export_to_json(self):
+        """Write the hashes, locations, samples and stats out to hash.json,
+        location.json, sample.json and stat.json.
+
+        :returns: :class:`Db`
+        """
+        with self.lock:
+            self.connection.commit()
+            db = Db()
+            db.reset_hash_db()
+            for checksum, path in self.all():
+                db.add_hash(checksum, path)
+            db.update_hash_db()
+
+            db.location_db = [
+                {'lat': latitude, 'long': longitude, 'name': json.loads(name)}
+                for latitude, longitude, name in self.connection.execute(
+                    'SELECT latitude, longitude, name FROM locations ORDER BY id')
+            ]
+            db.update_location_db()
+
+            for sample, checksum in self.all_samples():
+                db.add_sample(sample, checksum)
+            db.update_sample_db()
+
+            db.stat_db = dict(
+                (checksum, list(value))
+                for checksum, value in self.all_stats()
+            )
+            db.update_stat_db()
+            return db
+
+    def import_from_json(self):
+        """Copy the hashes, locations, samples and stats from hash.json,
+        location.json, sample.json and stat.json."""
+        with self.lock:
+            db = Db()
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO hashes (checksum, path) VALUES (?, ?)',
+                db.all()
+            )
+            self.connection.executemany(
+                'INSERT INTO locations (latitude, longitude, name) VALUES (?, ?, ?)',  # noqa
+                (
+                    (data['lat'], data['long'], self._encode_name(data['name']))
+                    for data in db.location_db
+                )
+            )
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO samples (size, sample, checksum) VALUES (?, ?, ?)',  # noqa
+                (sample + (checksum,) for sample, checksum in db.all_samples())
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO stats (checksum, size, mtime_ns) VALUES (?, ?, ?)',  # noqa
+                ((checksum,) + value for checksum, value in db.all_stats())
+            )
+            self.connection.commit()
+
+    def _encode_name(self, name):
+        # Place names are dictionaries so we store them as JSON with sorted
+        #   keys so equal names are always stored the same way.
+        return json.dumps(name, sort_keys=True)
+
+
+def format_checksum(algorithm, hexdigest):
+    """Format a hash value as it's stored in the hash db.
+
+    Checksums are prefixed with the algorithm which made them, except for
+    sha256 so hash dbs from before there was a choice still work.
+
+    :param str algorithm: One of :data:`checksum_algorithms`.
+    :param str hexdigest:
+    :returns: str
+    """
+    if(algorithm == 'sha256'):
+        return hexdigest
+    return '%s:%s' % (algorithm, hexdigest)
+
+
+def get_checksum_algorithm(checksum):
+    """Get the algorithm a checksum from :func:`format_checksum` was made
+    with.
+
+    :param str checksum:
+    :returns: str
+    """
+    if(':' in checksum):
+        return checksum.split(':', 1)[0]
+    return 'sha256'
+
+
+def new_hasher(algorithm):
+    """Create a hasher for one of :data:`checksum_algorithms`.
+
+    :param str algorithm:
+    :returns: hashlib style hash object
+    """
+    if(algorithm not in checksum_algorithms):
+        raise ValueError('Unknown checksum algorithm %s, use one of %s' % (
+            algorithm, ', '.join(sorted(checksum_algorithms))))
+    return checksum_algorithms[algorithm]()
+
+
+def _advise_sequential(f):
+    # Ask the kernel to read ahead further since we read the whole file.
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+class ChecksumCache(object):
+
+    """Checksums of files which were already hashed, stored in SQLite.
+
+    Entries are keyed by the file's device and inode and are only used if
+    its size, modification time and change time are the same as when it
+    was hashed. The change time can't be set back by tools which preserve
+    modification times, so a file which was rewritten is always hashed
+    again. Entries which haven't been used for :attr:`max_age_days` are
+    evicted when the cache is flushed.
+
+    Entries are committed as they're added so several runs can share the
+    cache. The cache is only there to save time, so if another run has it
+    locked we carry on without writing to it.
+
+    :param bool rehash: Hash every file again and update its entry instead
+        of trusting the cache.
+    """
+
+    #: Evict entries which haven't been used for this many days.
+    max_age_days = 90
+
+    #: Files changed this recently aren't cached. Their size and times could
+    #:  stay the same if they're written to again within the resolution of
+    #:  the filesystem's timestamps.
+    racy_seconds = 2
+
+    def __init__(self, rehash=False):
+        if not os.path.exists(constants.application_directory):
+            os.makedirs(constants.application_directory)
+
+        self.rehash = rehash
+        self.lock = threading.RLock()
+        # Keys of entries which were used, so their last used time can be
+        #  updated in one go when we flush.
+        self._used = set()
+
+        self.connection = sqlite3.connect(
+            constants.checksum_cache_db,
+            check_same_thread=False
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS checksums (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ctime_ns INTEGER NOT NULL,
+                checksum TEXT NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (device, inode)
+            );
+            CREATE INDEX IF NOT EXISTS checksums_used ON checksums (used);
+        """)
+
+    def get(self, stat):
+        """Get the cached checksum of a file.
+
+        :param stat: Result of os.stat() for the file.
+        :returns: str or None if the file isn't cached or has changed.
+        """
+        if(self.rehash is True):
+            return None
+
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT size, mtime_ns, ctime_ns, checksum FROM checksums
+                   WHERE device = ? AND inode = ?""",
+                (stat.st_dev, stat.st_ino)
+            ).fetchone()
+            if(row is None or tuple(row[:3]) != self._identity(stat)[2:]):
+                return None
+
+            self._used.add((stat.st_dev, stat.st_ino))
+            return row[3]
+
+    def add(self, stat, checksum):
+        """Cache the checksum of a file, replacing any older entry.
+
+        :param stat: Result of os.stat() for the file taken before it was
+            read.
+        :param str checksum:
+        """
+        now = time.time()
+        if(max(stat.st_mtime, stat.st_ctime) > now - self.racy_seconds):
+            return
+
+        with self.lock:
+            try:
+                self.connection.execute(
+                    """INSERT OR REPLACE INTO checksums
+                       (device, inode, size, mtime_ns, ctime_ns, checksum, used)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    self._identity(stat) + (checksum, int(now))
+                )
+                self.connection.commit()
+            except sqlite3.OperationalError:
+                self.connection.rollback()
+
+    def flush(self):
+        """Write the cache to disk and evict entries which weren't used for
+        :attr:`max_age_days`.
+        """
+        with self.lock:
+            now = int(time.time())
+            try:
+                self.connection.executemany(
+                    'UPDATE checksums SET used = ? WHERE device = ? AND inode = ?',
+                    ((now, device, inode) for device, inode in self._used)
+                )
+                self.connection.execute(
+                    'DELETE FROM checksums WHERE used < ?',
+                    (now - self.max_age_days * 86400,)
+                )
+                self.connection.commit()
+            except sqlite3.OperationalError:
+                self.connection.rollback()
+            self._used = set()
+
+    def close(self):
+        """Flush the cache and close the database."""
+        with self.lock:
+            self.flush()
+            self.connection.close()
+
+    def _identity(self, stat):
+        return (
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_size,
+            _nanoseconds(stat, 'mtime'),
+            _nanoseconds(stat, 'ctime')
+        )
+
+
+def size_and_mtime(stat):
+    """Get what the stat db stores about a file.
+
+    :param stat: Result of os.stat() for the file.
+    :returns: tuple of the size and the modification time in nanoseconds
+    """
+    return (stat.st_size, _nanoseconds(stat, 'mtime'))
+
+
+def _nanoseconds(stat, name):
+    # st_mtime_ns and st_ctime_ns aren't available before Python 3.3.
+    if hasattr(stat, 'st_%s_ns' % name):
+        return getattr(stat, 'st_%s_ns' % name)
+    return int(getattr(stat, 'st_%s' % name) * 1000000000)
+
+
+class LocationIndex(object):
+
+    """A grid of locations bucketed by latitude and longitude.
+
+    Finding the nearest location only looks at the cells which overlap the
+    threshold instead of every location in the location db.
+
+    :param list locations: Dictionaries with lat, long and name keys. The
+        list is indexed but not copied.
+    """
+
+    #: Size of each cell in degrees. Roughly 11km of latitude.
+    cell_degrees = 0.1
+
+    def __init__(self, locations):
+        self.locations = locations
+        self.longitude_cells = int(round(360 / self.cell_degrees))
+        self.cells = {}
+        for data in locations:
+            self.add(data)
+
+    def add(self, data):
+        """Add a location to the index.
+
+        :param dict data: Dictionary with lat, long and name keys.
+        """
+        key = (
+            self._cell(float(data['lat'])),
+            self._cell(float(data['long'])) % self.longitude_cells
+        )
+        self.cells.setdefault(key, []).append(data)
+
+    def nearest(self, latitude, longitude, threshold_m):
+        """Find the nearest location within threshold_m.
+
+        :returns: dict, or None if no location is close enough.
+        """
+        min_latitude, max_latitude, min_longitude, max_longitude = \
+            bounding_box(latitude, longitude, threshold_m)
+
+        longitude_cells = range(
+            self._cell(min_longitude),
+            self._cell(max_longitude) + 1
+        )
+        if len(longitude_cells) >= self.longitude_cells:
+            longitude_cells = range(self.longitude_cells)
+
+        nearest = None
+        last_d = sys.maxsize
+        for latitude_cell in range(self._cell(min_latitude),
+                                   self._cell(max_latitude) + 1):
+            for longitude_cell in longitude_cells:
+                key = (latitude_cell, longitude_cell % self.longitude_cells)
+                for data in self.cells.get(key, ()):
+                    d = distance_m(
+                        latitude,
+                        longitude,
+                        float(data['lat']),
+                        float(data['long'])
+                    )
+                    if(d <= threshold_m and d < last_d):
+                        nearest = data
+                        last_d = d
+
+        return nearest
+
+    def _cell(self, degrees):
+        return int(floor(degrees / self.cell_degrees))
+
+
+#: Metres per degree of latitude, used to bound location lookups.
+METRES_PER_DEGREE = 111195
+
+
+def bounding_box(latitude, longitude, threshold_m):
+    """Get the latitudes and longitudes within threshold_m of a location.
+
+    Longitudes are not wrapped so they may fall outside of -180 to 180.
+
+    :returns: tuple(float) of min and max latitude then min and max longitude
+    """
+    latitude_delta = float(threshold_m) / METRES_PER_DEGREE
+    # Degrees of longitude are shortest at the edge closest to a pole.
+    longitude_scale = cos(radians(min(abs(latitude) + latitude_delta, 90)))
+    if longitude_scale <= latitude_delta / 180:
+        longitude_delta = 180
+    else:
+        longitude_delta = min(latitude_delta / longitude_scale, 180)
+
+    return (
+        latitude - latitude_delta,
+        latitude + latitude_delta,
+        longitude - longitude_delta,
+        longitude + longitude_delta
+    )
+
+
+def longitude_ranges_in_box(min_longitude, max_longitude):
+    """Wrap the longitudes of a :func:`bounding_box` into -180 to 180.
+
+    :returns: list of tuple(float) of min and max longitude, two of them if
+        the box crosses the antimeridian
+    """
+    if max_longitude - min_longitude >= 360:
+        return [(-180.0, 180.0)]
+    elif min_longitude < -180:
+        return [(min_longitude + 360, 180.0), (-180.0, max_longitude)]
+    elif max_longitude > 180:
+        return [(min_longitude, 180.0), (-180.0, max_longitude - 360)]
+    return [(min_longitude, max_longitude)]
+
+
+def distance_m(latitude1, longitude1, latitude2, longitude2):
+    """Approximate the distance in metres between two coordinates.
+
+    As the distances we compare are quite small we use simple math.
+    From http://stackoverflow.com/questions/15736995/how-can-i-quickly-estimate-the-distance-between-two-latitude-longitude-points  # noqa
+
+    :returns: float
+    """
+    # convert decimal degrees to radians
+    lon1, lat1, lon2, lat2 = list(map(
+        radians,
+        [longitude1, latitude1, longitude2, latitude2]
+    ))
+
+    # Take the short way around when crossing the antimeridian.
+    delta_lon = lon2 - lon1
+    if delta_lon > pi:
+        delta_lon -= 2 * pi
+    elif delta_lon < -pi:
+        delta_lon += 2 * pi
+
+    r = 6371000  # radius of the earth in m
+    x = delta_lon * cos(0.5 * (lat2 + lat1))
+    y = lat2 - lat1
+    return r * sqrt(x * x + y * y)
+
+
+#: The :class:`Db` shared by everything running in this process.
+__SESSION__ = None
+
+
+def get_session():
+    """Get the :class:`Db` for the current import, update or verify run.
+
+    The first call creates the session and later calls return the same
+    instance so the hash and location dbs are only read from disk once.
+    The session's checksums are cached in a :class:`ChecksumCache`.
+
+    :returns: :class:`Db`
+    """
+    global __SESSION__
+    if __SESSION__ is None:
+        if is_sqlite_configured():
+            __SESSION__ = SqliteDb()
+        else:
+            __SESSION__ = Db()
+        __SESSION__.checksum_algorithm = get_configured_checksum_algorithm()
+        __SESSION__.checksum_cache = ChecksumCache()
+    return __SESSION__
+
+
+def get_configured_checksum_algorithm():
+    """Get the checksum algorithm set in config.ini.
+
+    :returns: str, sha256 unless the [Checksum] section has an algorithm.
+    """
+    config = load_config()
+    algorithm = 'sha256'
+    if('Checksum' in config and 'algorithm' in config['Checksum']):
+        algorithm = config['Checksum']['algorithm']
+    # Fail now rather than on the first file.
+    new_hasher(algorithm)
+    return algorithm
+
+
+def is_sqlite_configured():
+    """Check if config.ini selects the SQLite backend.
+
+    :returns: bool
+    """
+    config = load_config()
+    return (
+        'Database' in config and
+        'backend' in config['Database'] and
+        config['Database']['backend'] == 'sqlite'
+    )
+
+
+def close_session():
+    """Flush the current session to disk and discard it."""
+    global __SESSION__
+    if __SESSION__ is not None:
+        __SESSION__.flush()
+        if __SESSION__.checksum_cache is not None:
+            __SESSION__.checksum_cache.close()
+    __SESSION__ = None
@@ -32,8 +32,52 @@ class Base(object):
 
     def __init__(self, source=None):
         self.source = source
+        # Changes collected between begin_write() and commit_write().
+        self.pending_writes = None
         self.reset_cache()
 
+    def begin_write(self):
+        """Collect the changes made by setters until :meth:`commit_write`
+        instead of writing the file for each one.
+
+        Getters return the new values straight away.
+        """
+        if self.pending_writes is None:
+            self.pending_writes = {}
+
+    def commit_write(self, output=None):
+        """Write the changes collected since :meth:`begin_write`.
+
+        :param str output: Write a copy of the file with the changes to
+            this path instead of changing the file. Nothing is written to
+            output if there are no changes.
+        :returns: bool, or None if there was nothing to write
+        """
+        self.pending_writes = None
+        return None
+
+    def commit_write_to_copy(self, path):
+        """Write the changes collected since :meth:`begin_write` to a copy
+        of the file which was already made, instead of to the file.
+
+        :param str path: Path of the copy.
+        :returns: bool, or None if there was nothing to write
+        """
+        pending_writes = self.pending_writes
+        self.pending_writes = None
+        if not pending_writes:
+            return None
+
+        copy = self.__class__(path)
+        copy.pending_writes = pending_writes
+        status = copy.commit_write()
+
+        # Writing a file leaves the file it was before next to it.
+        if os.path.exists(path + '_original'):
+            os.remove(path + '_original')
+
+        return status
+
     def format_metadata(self, **kwargs):
         """Method to consistently return a populated metadata dictionary.
 
@@ -151,6 +195,19 @@ class Base(object):
         """Resets any internal cache
         """
         self.metadata = None
+        #: Result of os.stat() for the source if it's already known, e.g.
+        #:  from when the file was found.
+        self.stat = None
+
+    def get_file_time(self):
+        """Get the earlier of the source's modification and change times.
+
+        :returns: float, seconds since the epoch
+        """
+        stat = self.stat
+        if stat is None:
+            stat = os.stat(self.source)
+        return min(stat.st_mtime, stat.st_ctime)
 
     def set_album(self, name):
         """Base method for setting the album of a file
@@ -250,3 +307,19 @@ def get_all_subclasses(cls=None):
         subclasses.update(get_all_subclasses(child_class))
 
     return subclasses
+
+
+def get_supported_extensions():
+    """Module method to get the extensions of every media class.
+
+    The set is built once since the media classes don't change.
+
+    :returns: set(str)
+    """
+    if not hasattr(get_supported_extensions, 'extensions'):
+        extensions = set()
+        for cls in get_all_subclasses(Base):
+            extensions.update(cls.extensions)
+        get_supported_extensions.extensions = extensions
+
+    return get_supported_extensions.extensions
@@ -11,6 +11,7 @@ are used to represent the actual files.
 from __future__ import print_function
 
 import os
+import shutil
 import six
 
 # load modules
@@ -31,6 +32,23 @@ class Media(Base):
         'longitude': 'longitude_ref'
     }
 
+    #: Most files to read metadata for in one exiftool command.
+    exiftool_batch_files = 100
+
+    #: Most bytes of files to read metadata for in one exiftool command.
+    #:  Large videos take exiftool longer to read so batches of them are
+    #:  smaller.
+    exiftool_batch_bytes = 256 * 1024 * 1024
+
+    #: Keys of :meth:`get_metadata` which are read from exiftool.
+    exiftool_metadata_keys = ('date_taken', 'camera_make', 'camera_model',
+                              'latitude', 'longitude', 'album', 'title',
+                              'original_name')
+
+    #: Keys of :attr:`exiftool_metadata_keys` which only the folder and file
+    #:  name templates use.
+    optional_metadata_keys = ('camera_make', 'camera_model')
+
     def __init__(self, source=None):
         super(Media, self).__init__(source)
         self.exif_map = {
@@ -51,6 +69,9 @@ class Media(Base):
         self.original_name_key = 'XMP:OriginalFileName'
         self.set_gps_ref = True
         self.exif_metadata = None
+        # Keys of get_metadata() to read from exiftool. None reads all of
+        #  them.
+        self.metadata_keys = None
 
     def get_album(self):
         """Get album from EXIF
@@ -125,13 +146,60 @@ class Media(Base):
 
         #Cache exif metadata results and use if already exists for media
         if(self.exif_metadata is None):
-            self.exif_metadata = ExifTool().get_metadata(source)
+            self.set_exiftool_attributes(ExifTool().get_tags(
+                self.get_exiftool_tags(),
+                source
+            ))
 
         if not self.exif_metadata:
             return False
 
         return self.exif_metadata
 
+    def set_exiftool_attributes(self, attributes):
+        """Cache attributes read from exiftool.
+
+        Tags which were set since :meth:`begin_write` are applied on top
+        so the attributes match what the file will have once they're
+        written.
+
+        :param dict attributes: Attributes for the file from exiftool.
+        """
+        self.exif_metadata = attributes
+        if self.pending_writes:
+            self.__update_exiftool_attributes(self.pending_writes)
+
+    def get_exiftool_tags(self):
+        """Get the tags to ask exiftool for.
+
+        Only the tags behind the keys in :attr:`metadata_keys` are read,
+        or every tag this class uses if it's None.
+
+        :returns: list of tags in <group>:<tag> format
+        """
+        tags_by_key = {
+            'date_taken': self.exif_map['date_taken'],
+            'camera_make': self.camera_make_keys,
+            'camera_model': self.camera_model_keys,
+            'latitude': self.latitude_keys + [self.latitude_ref_key],
+            'longitude': self.longitude_keys + [self.longitude_ref_key],
+            'album': self.album_keys,
+            'title': [self.title_key],
+            'original_name': [self.original_name_key],
+        }
+
+        keys = self.metadata_keys
+        if keys is None:
+            keys = self.exiftool_metadata_keys
+
+        tags = []
+        for key in keys:
+            for tag in tags_by_key.get(key, []):
+                if tag not in tags:
+                    tags.append(tag)
+
+        return tags
+
     def get_camera_make(self):
         """Get the camera make stored in EXIF.
 
@@ -224,7 +292,6 @@ class Media(Base):
 
         tags = {self.album_keys[0]: album}
         status = self.__set_tags(tags)
-        self.reset_cache()
 
         return status
 
@@ -243,7 +310,6 @@ class Media(Base):
             tags[key] = formatted_time
 
         status = self.__set_tags(tags)
-        self.reset_cache()
         return status
 
     def set_location(self, latitude, longitude):
@@ -269,7 +335,6 @@ class Media(Base):
                 tags[self.longitude_ref_key] = 'W'
 
         status = self.__set_tags(tags)
-        self.reset_cache()
 
         return status
 
@@ -292,7 +357,6 @@ class Media(Base):
 
         tags = {self.original_name_key: name}
         status = self.__set_tags(tags)
-        self.reset_cache()
         return status
 
     def set_title(self, title):
@@ -309,17 +373,151 @@ class Media(Base):
 
         tags = {self.title_key: title}
         status = self.__set_tags(tags)
-        self.reset_cache()
 
         return status
 
+    @classmethod
+    def load_exiftool_attributes(cls, media_list):
+        """Read exiftool attributes for several media objects at once.
+
+        Files are sent to exiftool in batches instead of one command per
+        file and the results are cached on each object so later calls to
+        :meth:`get_exiftool_attributes` don't run exiftool again. Objects
+        which aren't :class:`Media` or already have attributes cached are
+        skipped.
+
+        :param list media_list: Media objects to read attributes for.
+        """
+        media_list = [
+            media for media in media_list
+            if isinstance(media, Media) and media.exif_metadata is None
+        ]
+
+        # Every file in a call is asked for the same tags so the tags of
+        #  all of them are combined.
+        tags = []
+        for media in media_list:
+            for tag in media.get_exiftool_tags():
+                if tag not in tags:
+                    tags.append(tag)
+
+        batches = list(cls.get_exiftool_batches(media_list))
+        # Later batches are sent before the output of earlier ones is read
+        #  so exiftool doesn't wait for us in between.
+        all_results = ExifTool().get_tags_batches(
+            tags,
+            [[media.source for media in batch] for batch in batches]
+        )
+        for batch, results in zip(batches, all_results):
+            by_source = {}
+            for result in results:
+                if 'SourceFile' in result:
+                    by_source[os.path.normpath(result['SourceFile'])] = result
+
+            # Files exiftool couldn't read are left alone and will be read
+            #  one at a time if they're needed.
+            for media in batch:
+                source = os.path.normpath(media.source)
+                if source in by_source:
+                    media.set_exiftool_attributes(by_source[source])
+
+    @classmethod
+    def get_exiftool_batches(cls, media_list):
+        """Split media objects into batches for exiftool.
+
+        A batch ends when it has :attr:`exiftool_batch_files` files or the
+        next file would take it past :attr:`exiftool_batch_bytes`.
+
+        :param list media_list: Media objects to split.
+        :returns: generator of lists
+        """
+        batch = []
+        batch_bytes = 0
+        for media in media_list:
+            try:
+                size = os.path.getsize(media.source)
+            except OSError:
+                size = 0
+
+            if batch and (len(batch) >= cls.exiftool_batch_files or
+                    batch_bytes + size > cls.exiftool_batch_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+
+            batch.append(media)
+            batch_bytes += size
+
+        if batch:
+            yield batch
+
+    def commit_write(self, output=None):
+        """Write the tags set since :meth:`begin_write` with one exiftool
+        command.
+
+        :param str output: Have exiftool write a copy of the file with the
+            tags to this path and leave the file alone.
+        :returns: bool, or None if no tags were set
+        """
+        tags = self.pending_writes
+        self.pending_writes = None
+        if not tags:
+            return None
+
+        if output is None:
+            status = ExifTool().set_tags(tags, self.source) != ''
+        else:
+            status = self.__copy_with_tags(tags, output)
+        if not status:
+            # Forget the tags which were only applied in memory.
+            self.reset_cache()
+
+        return status
+
+    def __copy_with_tags(self, tags, output):
+        # exiftool won't write over a file so the copy is written next to
+        #  output and moved into place.
+        directory, name = os.path.split(output)
+        temporary = os.path.join(directory, '.%s' % name)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+        ExifTool().copy_with_tags(tags, self.source, temporary)
+        if not os.path.exists(temporary):
+            return False
+
+        shutil.move(temporary, output)
+        return True
+
     def __set_tags(self, tags):
         if(not self.is_valid()):
             return None
 
         source = self.source
 
-        status = ''
-        status = ExifTool().set_tags(tags,source)
+        if self.pending_writes is not None:
+            self.pending_writes.update(tags)
+            status = True
+        else:
+            status = ExifTool().set_tags(tags,source) != ''
+
+        # Update what we've read instead of asking exiftool for it again.
+        if status:
+            self.__update_exiftool_attributes(tags)
+        else:
+            self.reset_cache()
+
+        return status
 
-        return status != ''
+    def __update_exiftool_attributes(self, tags):
+        self.metadata = None
+        if not isinstance(self.exif_metadata, dict):
+            return
+
+        for tag, value in tags.items():
+            # EXIF coordinates are read back without their sign, which is
+            #  in the reference tag.
+            if(self.set_gps_ref and
+                    tag in self.latitude_keys + self.longitude_keys):
+                value = abs(value)
+            self.exif_metadata[tag] = value
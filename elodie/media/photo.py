@@ -55,8 +55,7 @@ class Photo(Media):
         if(not self.is_valid()):
             return None
 
-        source = self.source
-        seconds_since_epoch = min(os.path.getmtime(source), os.path.getctime(source))  # noqa
+        seconds_since_epoch = self.get_file_time()
 
         exif = self.get_exiftool_attributes()
         if not exif:
@@ -52,7 +52,6 @@ class Text(Base):
         return None
 
     def get_date_taken(self):
-        source = self.source
         self.parse_metadata_line()
 
         # We return the value if found in metadata
@@ -62,11 +61,7 @@ class Text(Base):
 
         # If there's no date_taken in the metadata we return
         #   from the filesystem
-        seconds_since_epoch = min(
-            os.path.getmtime(source),
-            os.path.getctime(source)
-        )
-        return time.gmtime(seconds_since_epoch)
+        return time.gmtime(self.get_file_time())
 
     def get_metadata(self):
         self.parse_metadata_line()
@@ -99,7 +94,6 @@ class Text(Base):
 
     def set_album(self, name):
         status = self.write_metadata(album=name)
-        self.reset_cache()
         return status
 
     def set_date_taken(self, passed_in_time):
@@ -108,7 +102,6 @@ class Text(Base):
 
         seconds_since_epoch = time.mktime(passed_in_time.timetuple())
         status = self.write_metadata(date_taken=seconds_since_epoch)
-        self.reset_cache()
         return status
 
     def set_original_name(self, name=None):
@@ -129,14 +122,49 @@ class Text(Base):
             name = os.path.basename(source)
 
         status = self.write_metadata(original_name=name)
-        self.reset_cache()
         return status
 
     def set_location(self, latitude, longitude):
         status = self.write_metadata(latitude=latitude, longitude=longitude)
-        self.reset_cache()
         return status
 
+    def commit_write(self, output=None):
+        """Write the metadata set since :meth:`begin_write` with one
+        rewrite of the file.
+
+        :param str output: Write a copy of the file with the metadata to
+            this path and leave the file alone.
+        :returns: bool, or None if no metadata was set
+        """
+        metadata = self.pending_writes
+        self.pending_writes = None
+        if not metadata:
+            return None
+
+        # Start from what's in the file rather than what's in memory.
+        self.metadata_line = None
+        if output is None:
+            return self.write_metadata(**metadata)
+
+        self.parse_metadata_line()
+        metadata_line = {}
+        has_metadata = False
+        if isinstance(self.metadata_line, dict):
+            metadata_line = self.metadata_line
+            has_metadata = True
+        metadata_line.update(metadata)
+
+        with open(self.source, 'r') as f_read:
+            if has_metadata:
+                f_read.readline()
+            with open(output, 'w') as f_write:
+                f_write.write("{}\n".format(dumps(metadata_line)))
+                copyfileobj(f_read, f_write)
+
+        self.metadata_line = metadata_line
+        self.metadata = None
+        return True
+
     def parse_metadata_line(self):
         if isinstance(self.metadata_line, dict):
             return self.metadata_line
@@ -164,6 +192,17 @@ class Text(Base):
 
         self.parse_metadata_line()
 
+        if self.pending_writes is not None:
+            # Written by commit_write().
+            self.pending_writes.update(kwargs)
+            metadata_line = {}
+            if isinstance(self.metadata_line, dict):
+                metadata_line = self.metadata_line
+            metadata_line.update(kwargs)
+            self.metadata_line = metadata_line
+            self.metadata = None
+            return True
+
         # Set defaults for a file without metadata
         # Check if self.metadata_line is set and use that instead
         metadata_line = {}
@@ -199,5 +238,7 @@ class Text(Base):
                         original_contents)
                     )
 
-        self.reset_cache()
+        # Keep what we wrote instead of reading the file again.
+        self.metadata_line = metadata_line
+        self.metadata = None
         return True
@@ -11,7 +11,6 @@ from __future__ import division
 # load modules
 from datetime import datetime
 
-import os
 import re
 import time
 
@@ -64,8 +63,7 @@ class Video(Media):
         if(not self.is_valid()):
             return None
 
-        source = self.source
-        seconds_since_epoch = min(os.path.getmtime(source), os.path.getctime(source))  # noqa
+        seconds_since_epoch = self.get_file_time()
 
         exif = self.get_exiftool_attributes()
         for date_key in self.exif_map['date_taken']:
@@ -0,0 +1,322 @@
+"""
+A pipeline of stages connected by bounded queues.
+
+Each stage runs its own pool of threads so stages which wait on the disk,
+the CPU or a subprocess overlap instead of taking turns. Queues between
+stages are bounded, so a slow stage makes the stages in front of it wait
+rather than letting work pile up in memory.
+"""
+from __future__ import division
+from __future__ import print_function
+from builtins import object
+
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
+from tabulate import tabulate
+
+
+class Stage(object):
+    """A step of a :class:`Pipeline`.
+
+    :param str name: Name used when reporting stats.
+    :param function: Called with each item's value. Returns the new value
+        or None to drop the item. Items which were dropped by an earlier
+        stage pass through without calling function.
+    :param int workers: Number of threads running function.
+    :param bool ordered: Call function for items in the order they entered
+        the pipeline. An ordered stage always has a single worker.
+    :param int batch_size: Call function with a list of up to this many
+        values and expect a list of new values back. A worker only takes
+        the items which are already waiting, so batches are small when
+        the stage keeps up and grow when it falls behind.
+    """
+
+    def __init__(self, name, function, workers=1, ordered=False,
+                 batch_size=1):
+        self.name = name
+        self.function = function
+        self.ordered = ordered
+        self.workers = 1 if ordered else max(1, workers)
+        self.batch_size = 1 if ordered else max(1, batch_size)
+
+
+class StageStats(object):
+    """Counters for one stage of a :class:`Pipeline`.
+
+    busy is the time spent in the stage's function, starved the time its
+    workers waited for input and blocked the time they waited for room in
+    the next queue. A stage with a high blocked time is waiting on the
+    stage after it and more workers won't help.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.queue_depth_max = 0
+        self.queue_depth_total = 0
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        elapsed = 0.0
+        if self.started is not None and self.finished is not None:
+            elapsed = self.finished - self.started
+
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'batch_mean': self.items / self.batches if self.batches else 1.0,
+            'per_second': self.items / elapsed if elapsed > 0 else 0.0,
+            'busy': self.busy,
+            'starved': self.starved,
+            'blocked': self.blocked,
+            'queue_max': self.queue_depth_max,
+            'queue_mean': (
+                self.queue_depth_total / self.items if self.items else 0.0
+            ),
+        }
+
+
+class Pipeline(object):
+    """Run items through a list of :class:`Stage` objects.
+
+    :param list stages: Stages in the order items go through them.
+    :param int queue_size: Number of items each queue between stages holds.
+    :param int max_in_flight: Number of items in the pipeline at once.
+        Defaults to enough to fill every queue and worker.
+    """
+
+    def __init__(self, stages, queue_size=8, max_in_flight=None):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        if max_in_flight is None:
+            max_in_flight = sum(
+                self.queue_size + stage.workers for stage in stages
+            )
+        self.max_in_flight = max(1, max_in_flight)
+        self.stats = [StageStats(stage.name, stage.workers) for stage in stages]
+        self.cancelled = threading.Event()
+
+    def run(self, items):
+        """Send items through the pipeline.
+
+        If a stage raises an exception it's raised here when the item it
+        was working on comes out of the pipeline.
+
+        :param items: Iterable of items.
+        :returns: generator of (item, value) tuples in the same order as
+            items. value is None for items which were dropped.
+        """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        output = queue.Queue()
+        queues.append(output)
+        slots = threading.Semaphore(self.max_in_flight)
+        self.cancelled.clear()
+
+        threads = [threading.Thread(
+            target=self._feed, args=(items, queues[0], slots)
+        )]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(index, queues[index], queues[index + 1], remaining)
+                ))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        finished = False
+        try:
+            for item in self._reorder(output):
+                sequence, original, value, error = item
+                if error is not None:
+                    six.reraise(*error)
+                yield (original, value)
+                slots.release()
+            finished = True
+        finally:
+            if not finished:
+                # Stop feeding and let what's already in the pipeline pass
+                #  through without doing any more work.
+                self.cancelled.set()
+                slots.release()
+                for _ in self._reorder(output):
+                    slots.release()
+            for thread in threads:
+                thread.join()
+
+    def write_stats(self):
+        """Print a table of :class:`StageStats` for the last run.
+        """
+        headers = ["Stage", "Workers", "Items", "Items/s", "Batch mean",
+                   "Busy s", "Starved s", "Blocked s", "Queue max",
+                   "Queue mean"]
+        rows = []
+        for stats in self.stats:
+            stats = stats.as_dict()
+            rows.append([
+                stats['stage'], stats['workers'], stats['items'],
+                '%.1f' % stats['per_second'], '%.1f' % stats['batch_mean'],
+                '%.2f' % stats['busy'],
+                '%.2f' % stats['starved'], '%.2f' % stats['blocked'],
+                stats['queue_max'], '%.1f' % stats['queue_mean'],
+            ])
+
+        print("****** PIPELINE ******")
+        print(tabulate(rows, headers=headers))
+
+    def _feed(self, items, first, slots):
+        try:
+            for sequence, original in enumerate(items):
+                slots.acquire()
+                if self.cancelled.is_set():
+                    break
+                first.put((sequence, original, original, None))
+        except Exception:
+            self.cancelled.set()
+            first.put((-1, None, None, sys.exc_info()))
+        first.put(None)
+
+    def _work(self, index, source, destination, remaining):
+        stage = self.stages[index]
+        stats = self.stats[index]
+        pending = {}
+        expected = 0
+
+        while True:
+            start = time.time()
+            item = source.get()
+            depth = source.qsize()
+            with stats.lock:
+                stats.starved += time.time() - start
+                if stats.started is None:
+                    stats.started = time.time()
+
+            if item is None:
+                # Let the other workers of this stage see the end too. The
+                #  last one to stop tells the next stage.
+                source.put(None)
+                with stats.lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                    stats.finished = time.time()
+                if last:
+                    for item in sorted(pending.values(), key=lambda i: i[0]):
+                        self._process(stage, stats, item, destination, depth)
+                    destination.put(None)
+                return
+
+            if stage.batch_size > 1:
+                batch = [item]
+                while len(batch) < stage.batch_size:
+                    try:
+                        item = source.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        # Leave the end for the next time around.
+                        source.put(None)
+                        break
+                    batch.append(item)
+                self._process_batch(stage, stats, batch, destination, depth)
+                continue
+
+            if not stage.ordered or item[0] < 0:
+                self._process(stage, stats, item, destination, depth)
+                continue
+
+            pending[item[0]] = item
+            while expected in pending:
+                self._process(
+                    stage, stats, pending.pop(expected), destination, depth
+                )
+                expected += 1
+
+    def _process(self, stage, stats, item, destination, depth):
+        sequence, original, value, error = item
+        if self.cancelled.is_set():
+            # Don't report items as finished when a stage was skipped.
+            value = None
+        elif value is not None and error is None:
+            start = time.time()
+            try:
+                value = stage.function(value)
+            except Exception:
+                error = sys.exc_info()
+                value = None
+                self.cancelled.set()
+            with stats.lock:
+                stats.busy += time.time() - start
+                stats.items += 1
+                stats.queue_depth_total += depth
+                stats.queue_depth_max = max(stats.queue_depth_max, depth)
+
+        start = time.time()
+        destination.put((sequence, original, value, error))
+        with stats.lock:
+            stats.blocked += time.time() - start
+
+    def _process_batch(self, stage, stats, batch, destination, depth):
+        if self.cancelled.is_set():
+            batch = [
+                (sequence, original, None, error)
+                for sequence, original, value, error in batch
+            ]
+        else:
+            indexes = [
+                index for index, item in enumerate(batch)
+                if item[2] is not None and item[3] is None
+            ]
+            if indexes:
+                start = time.time()
+                error = None
+                try:
+                    values = stage.function([batch[i][2] for i in indexes])
+                except Exception:
+                    error = sys.exc_info()
+                    values = [None] * len(indexes)
+                    self.cancelled.set()
+                for index, value in zip(indexes, values):
+                    sequence, original = batch[index][:2]
+                    batch[index] = (sequence, original, value, error)
+                with stats.lock:
+                    stats.busy += time.time() - start
+                    stats.items += len(indexes)
+                    stats.batches += 1
+                    stats.queue_depth_total += depth * len(indexes)
+                    stats.queue_depth_max = max(stats.queue_depth_max, depth)
+
+        start = time.time()
+        for item in batch:
+            destination.put(item)
+        with stats.lock:
+            stats.blocked += time.time() - start
+
+    def _reorder(self, output):
+        pending = {}
+        expected = 0
+        while True:
+            item = output.get()
+            if item is None:
+                break
+            if item[0] < 0:
+                # The items iterable raised an exception.
+                yield item
+                continue
+            pending[item[0]] = item
+            while expected in pending:
+                yield pending.pop(expected)
+                expected += 1
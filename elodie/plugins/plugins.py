@@ -7,6 +7,7 @@ from __future__ import print_function
 from builtins import object
 
 import io
+import threading
 
 from json import dumps, loads
 from importlib import import_module
@@ -123,6 +124,9 @@ class Plugins(object):
         self.plugins = []
         self.classes = {}
         self.loaded = False
+        # Plugins aren't expected to be thread safe so a parallel import
+        #  calls them one at a time.
+        self.lock = threading.RLock()
 
     def load(self):
         """Load plugins from config file.
@@ -154,26 +158,27 @@ class Plugins(object):
     def run_all_after(self, file_path, destination_folder, final_file_path, metadata):
         """Process `before` methods of each plugin that was loaded.
         """
-        self.load()
-        pass_status = True
-        for cls in self.classes:
-            this_method = getattr(self.classes[cls], 'after')
-            # We try to call the plugin's `before()` method.
-            # If the method explicitly raises an ElodiePluginError we'll fail the import
-            #  by setting pass_status to False.
-            # If any other error occurs we log the message and proceed as usual.
-            # By default, plugins don't change behavior.
-            try:
-                this_method(file_path, destination_folder, final_file_path, metadata)
-                log.info('Called after() for {}'.format(cls))
-            except ElodiePluginError as err:
-                log.warn('Plugin {} raised an exception in run_all_before: {}'.format(cls, err))
-                log.error(format_exc())
-                log.error('false')
-                pass_status = False
-            except:
-                log.error(format_exc())
-        return pass_status
+        with self.lock:
+            self.load()
+            pass_status = True
+            for cls in self.classes:
+                this_method = getattr(self.classes[cls], 'after')
+                # We try to call the plugin's `before()` method.
+                # If the method explicitly raises an ElodiePluginError we'll fail the import
+                #  by setting pass_status to False.
+                # If any other error occurs we log the message and proceed as usual.
+                # By default, plugins don't change behavior.
+                try:
+                    this_method(file_path, destination_folder, final_file_path, metadata)
+                    log.info('Called after() for {}'.format(cls))
+                except ElodiePluginError as err:
+                    log.warn('Plugin {} raised an exception in run_all_before: {}'.format(cls, err))
+                    log.error(format_exc())
+                    log.error('false')
+                    pass_status = False
+                except:
+                    log.error(format_exc())
+            return pass_status
 
     def run_batch(self):
         self.load()
@@ -199,22 +204,23 @@ class Plugins(object):
     def run_all_before(self, file_path, destination_folder):
         """Process `before` methods of each plugin that was loaded.
         """
-        self.load()
-        pass_status = True
-        for cls in self.classes:
-            this_method = getattr(self.classes[cls], 'before')
-            # We try to call the plugin's `before()` method.
-            # If the method explicitly raises an ElodiePluginError we'll fail the import
-            #  by setting pass_status to False.
-            # If any other error occurs we log the message and proceed as usual.
-            # By default, plugins don't change behavior.
-            try:
-                this_method(file_path, destination_folder)
-                log.info('Called before() for {}'.format(cls))
-            except ElodiePluginError as err:
-                log.warn('Plugin {} raised an exception in run_all_after: {}'.format(cls, err))
-                log.error(format_exc())
-                pass_status = False
-            except:
-                log.error(format_exc())
-        return pass_status
+        with self.lock:
+            self.load()
+            pass_status = True
+            for cls in self.classes:
+                this_method = getattr(self.classes[cls], 'before')
+                # We try to call the plugin's `before()` method.
+                # If the method explicitly raises an ElodiePluginError we'll fail the import
+                #  by setting pass_status to False.
+                # If any other error occurs we log the message and proceed as usual.
+                # By default, plugins don't change behavior.
+                try:
+                    this_method(file_path, destination_folder)
+                    log.info('Called before() for {}'.format(cls))
+                except ElodiePluginError as err:
+                    log.warn('Plugin {} raised an exception in run_all_after: {}'.format(cls, err))
+                    log.error(format_exc())
+                    pass_status = False
+                except:
+                    log.error(format_exc())
+            return pass_status
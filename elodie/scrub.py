@@ -0,0 +1,154 @@
+"""
+Read a rotating slice of the library on each run to find files which
+rotted.
+"""
+from __future__ import division
+from builtins import object
+
+import json
+import math
+import os
+import time
+
+from elodie import constants
+from elodie.compatability import _rename
+from elodie.localstorage import get_checksum_algorithm
+
+
+class Scrub(object):
+    """Verify the next slice of the hash db so every file is read once per
+    cycle.
+
+    Files are scrubbed in path order and the last one scrubbed is kept in
+    ``~/.elodie/scrub.json`` so the next run carries on from there. Each
+    run reads the files left in the cycle divided by the days left, so a
+    run which was missed or stopped early is caught up over the rest of
+    the cycle.
+
+    :param Db db: Session whose hash db is scrubbed.
+    :param int cycle_days: Number of days to read the whole library in.
+    :param float bandwidth: Read at most this many bytes a second, or None.
+    :param float time_budget: Don't start another file after this many
+        seconds, or None.
+    """
+
+    def __init__(self, db, cycle_days=30, bandwidth=None, time_budget=None):
+        self.db = db
+        self.cycle_days = max(1, cycle_days)
+        self.bandwidth = bandwidth
+        self.time_budget = time_budget
+        self.state = None
+        #: Number of files in the slice which weren't scrubbed because the
+        #:  time budget ran out.
+        self.skipped = 0
+        self._read_bytes = 0
+        self._read_started = time.time()
+
+    def get_slice(self):
+        """Get the hash db entries to scrub in this run.
+
+        :returns: list of (checksum, path) tuples in path order.
+        """
+        state = self.get_state()
+        entries = sorted(self.db.all(), key=lambda entry: entry[1])
+        if state['position'] is not None:
+            remaining = [
+                entry for entry in entries if entry[1] > state['position']
+            ]
+        else:
+            remaining = entries
+
+        if not remaining:
+            # Everything was scrubbed so we start the next cycle.
+            state['position'] = None
+            state['cycle_started'] = time.time()
+            remaining = entries
+
+        days_elapsed = (time.time() - state['cycle_started']) // 86400
+        days_left = max(1, self.cycle_days - int(days_elapsed))
+        size = int(math.ceil(len(remaining) / days_left))
+        return remaining[:size]
+
+    def get_state(self):
+        """Get where the last run stopped.
+
+        :returns: dict with the position, the path of the last file
+            scrubbed or None, and the time the cycle started.
+        """
+        if self.state is None:
+            self.state = {'position': None, 'cycle_started': time.time()}
+            try:
+                with open(constants.scrub_state, 'r') as f:
+                    self.state.update(json.load(f))
+            except (IOError, ValueError):
+                pass
+        return self.state
+
+    def run(self):
+        """Scrub the next slice of the hash db.
+
+        The position is saved when the generator is exhausted or closed.
+
+        :returns: generator of (path, checksum, status) tuples where status
+            is ``ok``, ``corrupt``, ``missing`` or ``unreadable``.
+        """
+        entries = self.get_slice()
+        state = self.get_state()
+        started = time.time()
+        self._read_bytes = 0
+        self._read_started = started
+        try:
+            for index, (checksum, file_path) in enumerate(entries):
+                if(self.time_budget is not None and
+                        time.time() - started > self.time_budget):
+                    self.skipped = len(entries) - index
+                    break
+
+                status = self.check(checksum, file_path)
+                state['position'] = file_path
+                yield (file_path, checksum, status)
+        finally:
+            self.write_state()
+
+    def check(self, checksum, file_path):
+        """Read a file and compare it to its checksum.
+
+        :returns: str, ``ok``, ``corrupt``, ``missing`` or ``unreadable``.
+        """
+        if not os.path.isfile(file_path):
+            return 'missing'
+
+        try:
+            actual_checksum = self.db.checksum(
+                file_path,
+                algorithm=get_checksum_algorithm(checksum),
+                rehash=True,
+                throttle=self.throttle
+            )
+        except (IOError, OSError):
+            return 'unreadable'
+
+        if actual_checksum != checksum:
+            return 'corrupt'
+        return 'ok'
+
+    def throttle(self, size):
+        """Sleep long enough to keep reads under :attr:`bandwidth`.
+
+        :param int size: Number of bytes which were just read.
+        """
+        if self.bandwidth is None:
+            return
+
+        self._read_bytes += size
+        ahead = (self._read_bytes / self.bandwidth -
+                 (time.time() - self._read_started))
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def write_state(self):
+        """Save where this run stopped."""
+        temporary_file_path = '%s.tmp-%s' % (constants.scrub_state, os.getpid())
+        with open(temporary_file_path, 'w') as f:
+            json.dump(self.get_state(), f)
+        _rename(temporary_file_path, constants.scrub_state)
@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+# Project imports
+import errno
+import mock
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
+
+from . import helper
+from elodie import compatability
+
+def _create_source(folder):
+    src = os.path.join(folder, 'source.txt')
+    with open(src, 'w') as f:
+        f.write('source contents\n' * 1000)
+    return src
+
+def _unsupported(*args):
+    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+def test_copyfile():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+    dst = os.path.join(folder, 'destination.txt')
+
+    strategy = compatability._copyfile(src, dst)
+    checksums = (helper.checksum(src), helper.checksum(dst))
+    linked = os.stat(src).st_ino == os.stat(dst).st_ino
+
+    shutil.rmtree(folder)
+
+    assert strategy in ('reflink', 'copy_file_range', 'sendfile', 'buffer'), strategy
+    assert checksums[0] == checksums[1], checksums
+    assert linked is False
+
+def test_copyfile_falls_back_to_buffer():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+    dst = os.path.join(folder, 'destination.txt')
+
+    with mock.patch.object(compatability, 'fcntl', None), \
+            mock.patch.object(compatability, '_copy_file_range', _unsupported), \
+            mock.patch.object(compatability, '_sendfile', _unsupported):
+        strategy = compatability._copyfile(src, dst, buffer_size=100)
+    checksums = (helper.checksum(src), helper.checksum(dst))
+
+    shutil.rmtree(folder)
+
+    assert strategy == 'buffer', strategy
+    assert checksums[0] == checksums[1], checksums
+
+def test_copyfile_falls_back_when_nothing_is_copied():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+    dst = os.path.join(folder, 'destination.txt')
+
+    # copy_file_range and sendfile return 0 without copying anything on
+    #  some filesystems.
+    with mock.patch.object(compatability, 'fcntl', None), \
+            mock.patch('os.copy_file_range', return_value=0, create=True), \
+            mock.patch('os.sendfile', return_value=0, create=True):
+        strategy = compatability._copyfile(src, dst)
+    checksums = (helper.checksum(src), helper.checksum(dst))
+
+    shutil.rmtree(folder)
+
+    assert strategy == 'buffer', strategy
+    assert checksums[0] == checksums[1], checksums
+
+def test_copyfile_hard_link():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+    dst = os.path.join(folder, 'destination.txt')
+
+    strategy = compatability._copyfile(src, dst, 'hard')
+    linked = os.stat(src).st_ino == os.stat(dst).st_ino
+
+    shutil.rmtree(folder)
+
+    assert strategy == 'hard', strategy
+    assert linked is True
+
+def test_copyfile_hard_link_falls_back_to_copy():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+    dst = os.path.join(folder, 'destination.txt')
+
+    with mock.patch('os.link', _unsupported):
+        strategy = compatability._copyfile(src, dst, 'hard')
+    checksums = (helper.checksum(src), helper.checksum(dst))
+
+    shutil.rmtree(folder)
+
+    assert strategy != 'hard', strategy
+    assert checksums[0] == checksums[1], checksums
+
+def test_copyfile_over_hard_link_keeps_source():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+    dst = os.path.join(folder, 'destination.txt')
+    os.link(src, dst)
+    checksum = helper.checksum(src)
+
+    compatability._copyfile(src, dst)
+    checksums = (helper.checksum(src), helper.checksum(dst))
+
+    shutil.rmtree(folder)
+
+    assert checksums == (checksum, checksum), checksums
+
+def test_get_physical_offset():
+    temporary_folder, folder = helper.create_working_folder()
+    src = _create_source(folder)
+
+    offset = compatability._get_physical_offset(src)
+    with mock.patch.object(compatability, 'fcntl', None):
+        offset_without_fcntl = compatability._get_physical_offset(src)
+
+    shutil.rmtree(folder)
+
+    assert offset is None or offset >= 0, offset
+    assert offset_without_fcntl is None, offset_without_fcntl
@@ -17,6 +17,7 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirna
 import helper
 elodie = load_source('elodie', os.path.abspath('{}/../../elodie.py'.format(os.path.dirname(os.path.realpath(__file__)))))
 
+from elodie import constants
 from elodie.config import load_config
 from elodie.localstorage import Db
 from elodie.media.audio import Audio
@@ -237,6 +238,74 @@ def test_import_file_send_to_trash_true():
 
     assert dest_path1 is not None
 
+def test_import_resume():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    origin = '%s/valid.txt' % folder
+    shutil.copyfile(helper.get_file('valid.txt'), origin)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    result = runner.invoke(elodie._import, ['--destination', folder_destination, folder])
+    with mock.patch('elodie.localstorage.Db.checksum') as checksum:
+        resumed_result = runner.invoke(elodie._import, ['--destination', folder_destination, '--resume', folder])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert 'Success         1' in result.output, result.output
+    assert 'Success         1' in resumed_result.output, resumed_result.output
+    assert checksum.called is False
+
+def test_import_from_list():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    listed = []
+    for name in ('listed.txt', 'excluded.txt', 'unsupported.xyz'):
+        origin = os.path.join(folder, name)
+        shutil.copyfile(helper.get_file('valid.txt'), origin)
+        with open(origin, 'a') as f:
+            f.write(name)
+        listed.append(origin)
+    not_listed = os.path.join(folder, 'not-listed.txt')
+    shutil.copyfile(helper.get_file('valid.txt'), not_listed)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    result = runner.invoke(elodie._import, ['--destination', folder_destination, '--exclude-regex', 'excluded', '--from-list', '-', '--null'], input='\0'.join(listed))
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert 'listed.txt' in result.output, result.output
+    assert 'not-listed.txt' not in result.output, result.output
+    assert 'Success         1' in result.output, result.output
+    assert 'Error           0' in result.output, result.output
+
+def test_import_order_inode():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    for i in range(3):
+        origin = os.path.join(folder, 'valid-%d.txt' % i)
+        shutil.copyfile(helper.get_file('valid.txt'), origin)
+        with open(origin, 'a') as f:
+            f.write(str(i))
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    result = runner.invoke(elodie._import, ['--destination', folder_destination, '--order', 'inode', folder])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert 'Success         3' in result.output, result.output
+
 def test_import_destination_in_source():
     temporary_folder, folder = helper.create_working_folder()
     folder_destination = '{}/destination'.format(folder)
@@ -727,6 +796,242 @@ def test_verify_error():
     assert origin in result.output, result.output
     assert 'Error           1' in result.output, result.output
 
+def test_verify_jobs_in_path_order():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 4)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    with open(files[1], 'w') as f:
+        f.write('changed text')
+    os.remove(files[2])
+    result = runner.invoke(elodie._verify, ['--jobs', '2', '--order', 'path'])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert files[1] in result.output, result.output
+    assert files[2] in result.output, result.output
+    assert 'Success         2' in result.output, result.output
+    assert 'Error           2' in result.output, result.output
+
+def test_verify_quick():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 3)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    # Quick verify compares with the stat db so neither the files nor the
+    #  checksum cache are needed.
+    with mock.patch('elodie.localstorage.Db.checksum') as checksum, \
+            mock.patch('elodie.localstorage.ChecksumCache.get', return_value=None):
+        result = runner.invoke(elodie._verify, ['--quick'])
+    with open(files[0], 'a') as f:
+        f.write('changed text')
+    os.utime(files[1], (0, 0))
+    with mock.patch('elodie.localstorage.Db.checksum') as changed_checksum:
+        changed_result = runner.invoke(elodie._verify, ['--quick'])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert checksum.called is False
+    assert changed_checksum.called is False
+    assert 'Success         3' in result.output, result.output
+    assert files[0] in changed_result.output, changed_result.output
+    assert files[1] in changed_result.output, changed_result.output
+    assert 'Error           2' in changed_result.output, changed_result.output
+
+def test_verify_quick_reads_files_without_stat():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 2)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    db = Db()
+    db.stat_db = {}
+    db.update_stat_db()
+    with mock.patch('elodie.localstorage.ChecksumCache.get', return_value=None):
+        result = runner.invoke(elodie._verify, ['--quick'])
+    stats = list(Db().all_stats())
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert 'Success         2' in result.output, result.output
+    # The files which were read can be checked quickly next time.
+    assert len(stats) == 2, stats
+
+@mock.patch('elodie.localstorage.ChecksumCache.racy_seconds', -10)
+def test_verify_sample():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 2)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    with mock.patch('elodie.localstorage.Db.checksum', return_value='') as checksum:
+        result = runner.invoke(elodie._verify, ['--sample', '100'])
+    invalid_result = runner.invoke(elodie._verify, ['--sample', '150'])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert checksum.call_count == 2, checksum.call_count
+    assert 'Error           2' in result.output, result.output
+    assert invalid_result.exit_code == 2, invalid_result.output
+
+def test_scrub_reports_corrupt_files():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 2)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    with open(files[0], 'a') as f:
+        f.write('changed text')
+    with mock.patch('elodie.constants.scrub_state', os.path.join(folder, 'scrub.json')):
+        result = runner.invoke(elodie._scrub, ['--cycle-days', '1'])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert '"status": "corrupt"' in result.output, result.output
+    assert files[0] in result.output, result.output
+    assert 'Success         1' in result.output, result.output
+    assert 'Error           1' in result.output, result.output
+
+def _create_generate_db_files(folder, count):
+    files = []
+    for i in range(count):
+        origin = '%s/valid-%02d.txt' % (folder, i)
+        shutil.copyfile(helper.get_file('valid.txt'), origin)
+        with open(origin, 'a') as f:
+            f.write('\n%s %s' % (folder, i))
+        files.append(origin)
+    return files
+
+def test_generate_db_jobs():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 6)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    result = runner.invoke(elodie._generate_db, ['--source', folder, '--jobs', '3'])
+    db = Db()
+    paths = [db.get_hash(db.checksum(_file)) for _file in files]
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert 'Success         6' in result.output, result.output
+    assert paths == files, paths
+    assert not os.path.exists(constants.generate_db_checkpoint)
+
+def test_generate_db_incremental():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 3)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    old_checksum = Db().checksum(files[0])
+    with open(files[0], 'a') as f:
+        f.write('changed')
+    deleted_checksum = Db().checksum(files[1])
+    os.remove(files[1])
+    # Unchanged files are recognized without the checksum cache.
+    with mock.patch('elodie.localstorage.Db.checksum', wraps=Db().checksum) as checksum:
+        result = runner.invoke(elodie._generate_db, ['--source', folder, '--incremental', '--no-checksum-cache'])
+    db = Db()
+    changed_path = db.get_hash(db.checksum(files[0]))
+    unchanged_path = db.get_hash(db.checksum(files[2]))
+    old_path = db.get_hash(old_checksum)
+    deleted_path = db.get_hash(deleted_checksum)
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert 'Success         2' in result.output, result.output
+    assert [call[0][0] for call in checksum.call_args_list] == [files[0]], checksum.call_args_list
+    assert changed_path == files[0], changed_path
+    assert unchanged_path == files[2], unchanged_path
+    assert old_path is None, old_path
+    assert deleted_path is None, deleted_path
+
+def test_generate_db_resumes():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 3)
+
+    helper.reset_dbs()
+    # An interrupted run which got as far as the first file.
+    db = Db()
+    db.reset_hash_db()
+    db.add_hash(db.checksum(files[0]), files[0])
+    db.update_hash_db()
+    elodie.write_generate_db_checkpoint({'source': folder})
+    runner = CliRunner()
+    result = runner.invoke(elodie._generate_db, ['--source', folder])
+    db = Db()
+    paths = [db.get_hash(db.checksum(_file)) for _file in files]
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert 'Resuming the interrupted generate-db of %s' % folder in result.output, result.output
+    assert 'Success         2' in result.output, result.output
+    assert paths == files, paths
+    assert not os.path.exists(constants.generate_db_checkpoint)
+
+def test_generate_db_restart():
+    temporary_folder, folder = helper.create_working_folder()
+    files = _create_generate_db_files(folder, 3)
+
+    helper.reset_dbs()
+    db = Db()
+    db.reset_hash_db()
+    db.add_hash(db.checksum(files[0]), files[0])
+    db.update_hash_db()
+    elodie.write_generate_db_checkpoint({'source': folder})
+    runner = CliRunner()
+    result = runner.invoke(elodie._generate_db, ['--source', folder, '--restart'])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert 'Resuming' not in result.output, result.output
+    assert 'Success         3' in result.output, result.output
+    assert not os.path.exists(constants.generate_db_checkpoint)
+
+def test_migrate_hashes():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/valid.txt' % folder
+    shutil.copyfile(helper.get_file('valid.txt'), origin)
+
+    helper.reset_dbs()
+    runner = CliRunner()
+    runner.invoke(elodie._generate_db, ['--source', folder])
+    result = runner.invoke(elodie._migrate_hashes, ['--algorithm', 'blake2b', '--jobs', '2'])
+    db = Db()
+    checksum = db.checksum(origin, algorithm='blake2b')
+    hash_path = db.get_hash(checksum)
+    sha256_path = db.get_hash(db.checksum(origin))
+    verify_result = runner.invoke(elodie._verify)
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+
+    assert 'Success         1' in result.output, result.output
+    assert checksum.startswith('blake2b:'), checksum
+    assert hash_path == origin, hash_path
+    assert sha256_path is None, sha256_path
+    assert 'Success         1' in verify_result.output, verify_result.output
+    assert 'Error           0' in verify_result.output, verify_result.output
+
 @mock.patch('elodie.config.config_file', '%s/config.ini-cli-batch-plugin-googlephotos' % gettempdir())
 def test_cli_batch_plugin_googlephotos():
     auth_file = helper.get_file('plugins/googlephotos/auth_file.json')
@@ -8,13 +8,15 @@ import sys
 import time
 from datetime import datetime
 from datetime import timedelta
+from io import BytesIO
 from tempfile import gettempdir
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
 
 from . import helper
+from elodie import compatability
 from elodie.config import load_config
-from elodie.filesystem import FileSystem
+from elodie.filesystem import FileEntry, FileSystem
 from elodie.media.text import Text
 from elodie.media.media import Media
 from elodie.media.photo import Photo
@@ -185,6 +187,198 @@ def test_get_all_files_for_loop():
 
     assert counter == 5, counter
 
+def test_scan_files_with_stat():
+    filesystem = FileSystem()
+    folder = helper.populate_folder(3)
+
+    entries = list(filesystem.scan_files(folder))
+    stats = [(entry.stat, os.stat(entry.path)) for entry in entries]
+    shutil.rmtree(folder)
+
+    assert len(entries) == 3, entries
+    for stat, expected in stats:
+        assert (stat.st_ino, stat.st_size, stat.st_mtime) == (expected.st_ino, expected.st_size, expected.st_mtime), stat
+
+def test_scan_files_prunes_excluded_directories():
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+    for name in ('keep', 'skip', os.path.join('skip', 'deeper')):
+        os.mkdir(os.path.join(folder, name))
+        shutil.copyfile(helper.get_file('valid.txt'), os.path.join(folder, name, 'valid.txt'))
+
+    scanned = []
+    _scandir = compatability._scandir
+    def record_scandir(path):
+        scanned.append(path)
+        return _scandir(path)
+
+    with mock.patch.object(compatability, '_scandir', record_scandir):
+        files = [entry.path for entry in filesystem.scan_files(folder, None, {'/skip/'})]
+    shutil.rmtree(folder)
+
+    assert files == [os.path.join(folder, 'keep', 'valid.txt')], files
+    assert os.path.join(folder, 'skip') not in scanned, scanned
+    assert os.path.join(folder, 'skip', 'deeper') not in scanned, scanned
+
+def test_scan_files_descends_into_directories_matched_by_anchored_exclusion():
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+    os.mkdir(os.path.join(folder, 'London'))
+    shutil.copyfile(helper.get_file('valid.txt'), os.path.join(folder, 'London', 'valid.txt'))
+
+    # Only the directory's own path ends with London/ so the files in it
+    #  aren't excluded.
+    files = [entry.path for entry in filesystem.scan_files(folder, None, {'London/$'})]
+    shutil.rmtree(folder)
+
+    assert files == [os.path.join(folder, 'London', 'valid.txt')], files
+
+def test_get_prune_patterns_leaves_out_lookaheads():
+    filesystem = FileSystem()
+
+    patterns = filesystem.get_prune_patterns(['/skip/', 'London/$', r'/keep(?!/this)/', r'\bword\b'])
+
+    assert [pattern.pattern for pattern in patterns] == ['/skip/'], patterns
+    assert filesystem.get_prune_patterns(['London/$']) == []
+
+def test_discover_files_skips_files_found_twice():
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+    os.mkdir(os.path.join(folder, 'nested'))
+    first = os.path.join(folder, 'a.txt')
+    second = os.path.join(folder, 'nested', 'b.txt')
+    shutil.copyfile(helper.get_file('valid.txt'), first)
+    shutil.copyfile(helper.get_file('valid.txt'), second)
+    os.link(first, os.path.join(folder, 'nested', 'link.txt'))
+
+    files = [entry.path for entry in filesystem.discover_files([folder, os.path.join(folder, 'nested'), second])]
+    shutil.rmtree(folder)
+
+    assert files == [first, second], files
+
+def test_discover_files_explicit_files():
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+    excluded = os.path.join(folder, 'excluded.txt')
+    unsupported = os.path.join(folder, 'unsupported.xyz')
+    missing = os.path.join(folder, 'missing.txt')
+    for path in (excluded, unsupported):
+        shutil.copyfile(helper.get_file('valid.txt'), path)
+
+    entries = list(filesystem.discover_files([excluded, unsupported, missing], {'excluded'}))
+    shutil.rmtree(folder)
+
+    assert [entry.path for entry in entries] == [unsupported, missing], entries
+    assert entries[0].stat is not None
+    assert entries[1].stat is None
+
+def test_discover_files_is_lazy():
+    filesystem = FileSystem()
+    folder = helper.populate_folder(2)
+    other_folder = helper.populate_folder(2)
+
+    scanned = []
+    scan_files = filesystem.scan_files
+    def record_scan_files(path, *args):
+        scanned.append(path)
+        return scan_files(path, *args)
+
+    with mock.patch.object(filesystem, 'scan_files', record_scan_files):
+        files = filesystem.discover_files([folder, other_folder])
+        first = next(files)
+        scanned_before_rest = list(scanned)
+        rest = list(files)
+    shutil.rmtree(folder)
+    shutil.rmtree(other_folder)
+
+    assert first.path.startswith(folder), first
+    assert scanned_before_rest == [folder], scanned_before_rest
+    assert len(rest) == 3, rest
+
+def test_read_path_list_newline_separated():
+    filesystem = FileSystem()
+
+    paths = list(filesystem.read_path_list(BytesIO(b'/a/one.jpg\r\n\n/b/two words.jpg\n/c/three.jpg'), chunk_size=4))
+
+    assert paths == ['/a/one.jpg', '/b/two words.jpg', '/c/three.jpg'], paths
+
+def test_read_path_list_nul_separated():
+    filesystem = FileSystem()
+
+    paths = list(filesystem.read_path_list(BytesIO(b'/a/one\n.jpg\0/b/two.jpg\0'), b'\0', 4))
+
+    assert paths == ['/a/one\n.jpg', '/b/two.jpg'], paths
+
+def test_read_path_list_keeps_undecodable_names():
+    if not hasattr(os, 'fsencode'):
+        raise SkipTest('fsencode is not available in python 2')
+
+    filesystem = FileSystem()
+
+    paths = list(filesystem.read_path_list(BytesIO(b'/a/\xff.jpg\n/b/two.jpg\n')))
+
+    assert [os.fsencode(path) for path in paths] == [b'/a/\xff.jpg', b'/b/two.jpg'], paths
+
+def test_discover_files_check_extensions():
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+    valid = os.path.join(folder, 'valid.txt')
+    unsupported = os.path.join(folder, 'unsupported.xyz')
+    for path in (valid, unsupported):
+        shutil.copyfile(helper.get_file('valid.txt'), path)
+
+    files = [entry.path for entry in filesystem.discover_files([valid, unsupported], set(), True)]
+    shutil.rmtree(folder)
+
+    assert files == [valid], files
+
+def _fake_entries(inodes):
+    entries = []
+    for index, inode in enumerate(inodes):
+        stat = None
+        if inode is not None:
+            stat = os.stat_result((0, inode, 1, 1, 0, 0, 0, 0, 0, 0))
+        entries.append(FileEntry('/source/%d.jpg' % index, stat))
+    return entries
+
+def test_order_files_by_path_keeps_order():
+    filesystem = FileSystem()
+    entries = _fake_entries([3, 1, 2])
+
+    ordered = list(filesystem.order_files(iter(entries), 'path'))
+
+    assert ordered == entries, ordered
+
+def test_order_files_by_inode_in_windows():
+    filesystem = FileSystem()
+    entries = _fake_entries([3, None, 1, 2, 6, 5, 4])
+
+    ordered = [entry.path for entry in filesystem.order_files(iter(entries), 'inode', 4)]
+
+    # Files without a stat go at the end of their window.
+    assert ordered == ['/source/2.jpg', '/source/3.jpg', '/source/0.jpg', '/source/1.jpg', '/source/6.jpg', '/source/5.jpg', '/source/4.jpg'], ordered
+
+def test_order_files_by_extent_falls_back_to_inode():
+    filesystem = FileSystem()
+    entries = _fake_entries([1, 2, 3])
+    offsets = {'/source/0.jpg': 500, '/source/1.jpg': None, '/source/2.jpg': 100}
+
+    with mock.patch.object(compatability, '_get_physical_offset', offsets.get):
+        ordered = [entry.path for entry in filesystem.order_files(iter(entries), 'extent')]
+
+    assert ordered == ['/source/2.jpg', '/source/0.jpg', '/source/1.jpg'], ordered
+
+def test_get_exclude_patterns():
+    filesystem = FileSystem()
+    # Each keeps its own flags and group numbers.
+    patterns = filesystem.get_exclude_patterns(['(?i)london', re.compile(r'\.txt$'), r'/(\w+)/\1/'])
+
+    assert filesystem.get_exclude_patterns(set()) == []
+    assert filesystem.should_exclude('/some/LONDON/photo.jpg', patterns) is True
+    assert filesystem.should_exclude('/some/path/file.txt', patterns) is True
+    assert filesystem.should_exclude('/some/same/same/photo.jpg', patterns) is True
+    assert filesystem.should_exclude('/some/path/file.txt.jpg', patterns) is False
+
 def test_get_current_directory():
     filesystem = FileSystem()
     assert os.getcwd() == filesystem.get_current_directory()
@@ -429,6 +623,36 @@ full_path=%camera_make|"nomake"/%camera_model|"nomodel"
 
     assert path == os.path.join('nomake', 'nomodel'), path
 
+def test_get_metadata_keys_default():
+    if hasattr(load_config, 'config'):
+        del load_config.config
+    with mock.patch('elodie.config.config_file', '%s/config.ini-does-not-exist' % gettempdir()):
+        filesystem = FileSystem()
+        keys = filesystem.get_metadata_keys()
+
+    assert 'camera_make' not in keys, keys
+    assert 'camera_model' not in keys, keys
+    assert 'date_taken' in keys, keys
+    assert 'original_name' in keys, keys
+
+@mock.patch('elodie.config.config_file', '%s/config.ini-metadata-keys-with-camera-make' % gettempdir())
+def test_get_metadata_keys_with_camera_make_in_custom():
+    with open('%s/config.ini-metadata-keys-with-camera-make' % gettempdir(), 'w') as f:
+        f.write("""
+[Directory]
+custom=%camera_make %album
+full_path=%custom
+        """)
+    if hasattr(load_config, 'config'):
+        del load_config.config
+    filesystem = FileSystem()
+    keys = filesystem.get_metadata_keys()
+    if hasattr(load_config, 'config'):
+        del load_config.config
+
+    assert 'camera_make' in keys, keys
+    assert 'camera_model' not in keys, keys
+
 @mock.patch('elodie.config.config_file', '%s/config.ini-int-in-component-path' % gettempdir())
 def test_get_folder_path_with_int_in_config_component():
     # gh-239
@@ -730,6 +954,64 @@ def test_process_file_plain():
     assert origin_checksum_preprocess == origin_checksum
     assert helper.path_tz_fix(os.path.join('2015-12-Dec','Unknown Location','2015-12-05_00-59-26-photo.jpg')) in destination, destination
 
+def test_process_file_writes_tags_into_copy():
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = os.path.join(folder,'photo.jpg')
+    shutil.copyfile(helper.get_file('plain.jpg'), origin)
+
+    origin_checksum_preprocess = helper.checksum(origin)
+    origin_stat = os.stat(origin)
+    media = Photo(origin)
+    destination = filesystem.process_file(origin, temporary_folder, media, allowDuplicate=True)
+
+    origin_checksum = helper.checksum(origin)
+    origin_stat_after = os.stat(origin)
+    original_exists = os.path.exists('%s_original' % origin)
+    original_name = Photo(destination).get_original_name()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(os.path.dirname(os.path.dirname(destination)))
+
+    assert origin_checksum_preprocess == origin_checksum
+    assert origin_stat.st_mtime == origin_stat_after.st_mtime
+    assert original_exists is False
+    assert original_name == 'photo.jpg', original_name
+
+@mock.patch('elodie.config.config_file', '%s/config.ini-write-tags-source' % gettempdir())
+def test_process_file_with_write_tags_source():
+    with open('%s/config.ini-write-tags-source' % gettempdir(), 'w') as f:
+        f.write("""
+[Import]
+write_tags=source
+        """)
+    if hasattr(load_config, 'config'):
+        del load_config.config
+
+    filesystem = FileSystem()
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = os.path.join(folder,'text.txt')
+    shutil.copyfile(helper.get_file('valid.txt'), origin)
+
+    origin_checksum_preprocess = helper.checksum(origin)
+    media = Text(origin)
+    plan = filesystem.prepare_file(origin, temporary_folder, media, allowDuplicate=True)
+    destination = filesystem.commit_file(plan)
+
+    origin_checksum = helper.checksum(origin)
+    original_name = Text(destination).get_original_name()
+
+    if hasattr(load_config, 'config'):
+        del load_config.config
+    shutil.rmtree(folder)
+    shutil.rmtree(os.path.dirname(os.path.dirname(destination)))
+
+    assert plan['tags_in_copy'] is False, plan
+    assert origin_checksum_preprocess == origin_checksum
+    assert original_name == 'text.txt', original_name
+
 def test_process_file_with_title():
     filesystem = FileSystem()
     temporary_folder, folder = helper.create_working_folder()
@@ -0,0 +1,473 @@
+from __future__ import absolute_import
+# Project imports
+import mock
+import os
+import shutil
+import sys
+import threading
+from tempfile import gettempdir
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
+
+from . import helper
+from elodie.config import load_config
+from elodie.filesystem import FileSystem
+from elodie.importer import ImportJournal, Importer
+from elodie.localstorage import Db, get_session
+from elodie.media.text import Text
+
+os.environ['TZ'] = 'GMT'
+
+def _create_text_files(folder, count):
+    files = []
+    for i in range(count):
+        origin = os.path.join(folder, 'valid-%02d.txt' % i)
+        shutil.copyfile(helper.get_file('valid.txt'), origin)
+        # Make each file's checksum unique.
+        with open(origin, 'a') as f:
+            f.write('\n%s %s' % (folder, i))
+        files.append(origin)
+    return files
+
+def test_import_files_in_parallel_matches_serial():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 12)
+
+    helper.reset_dbs()
+    serial = list(Importer(FileSystem(), os.path.join(folder_destination, 'serial'), allow_duplicates=True).import_files(files))
+    helper.restore_dbs()
+
+    helper.reset_dbs()
+    parallel = list(Importer(FileSystem(), os.path.join(folder_destination, 'parallel'), allow_duplicates=True, jobs=4).import_files(files))
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert [_file for _file, dest_path in parallel] == files, parallel
+    assert len(serial) == len(parallel), (serial, parallel)
+    for (_, serial_path), (_, parallel_path) in zip(serial, parallel):
+        assert serial_path is not None
+        assert serial_path.replace('/serial/', '/parallel/') == parallel_path, (serial_path, parallel_path)
+
+def test_import_files_in_parallel_skips_duplicates_in_run():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    # Every file has the same contents but they aren't in the hash db yet.
+    files = []
+    for i in range(6):
+        origin = os.path.join(folder, 'valid-%02d.txt' % i)
+        shutil.copyfile(helper.get_file('valid.txt'), origin)
+        with open(origin, 'a') as f:
+            f.write('\n%s' % folder)
+        files.append(origin)
+
+    helper.reset_dbs()
+    importer = Importer(FileSystem(), folder_destination, jobs=3)
+    result = list(importer.import_files(files))
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert result[0][1] is not None, result
+    assert [dest_path for _, dest_path in result[1:]] == [None] * 5, result
+    # Nothing is kept about files once they're done with.
+    assert importer.skipped_files == {}, importer.skipped_files
+    assert importer.claimed_checksums == {}, importer.claimed_checksums
+
+def test_claim_finds_released_checksums_in_hash_db():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 1)
+
+    helper.reset_dbs()
+    importer = Importer(FileSystem(), folder_destination)
+    dest_path = importer.import_file(files[0])
+    claimed_checksums = dict(importer.claimed_checksums)
+    # A copy which was checked against the hash db before the file above
+    #  was added to it.
+    claimed = importer.claim({'file': os.path.join(folder, 'copy.txt'), 'checksum': Db().checksum(files[0])})
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert dest_path is not None
+    assert claimed_checksums == {}, claimed_checksums
+    assert claimed is False
+
+def test_import_files_trash_duplicates():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 2)
+    duplicate = os.path.join(folder, 'valid-duplicate.txt')
+    shutil.copyfile(files[0], duplicate)
+    unsupported = os.path.join(folder, 'unsupported.xyz')
+    with open(unsupported, 'w') as f:
+        f.write('not media')
+    missing = os.path.join(folder, 'missing.txt')
+
+    trashed = []
+    for jobs in (1, 3):
+        helper.reset_dbs()
+        importer = Importer(FileSystem(), os.path.join(folder_destination, str(jobs)), trash=True, jobs=jobs)
+        with mock.patch('elodie.importer.send2trash') as send2trash:
+            if jobs == 1:
+                for _file in files + [duplicate, unsupported, missing]:
+                    importer.import_file(_file)
+            else:
+                list(importer.import_files(files + [duplicate, unsupported, missing]))
+        helper.restore_dbs()
+        trashed.append(sorted(call[0][0] for call in send2trash.call_args_list))
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert trashed == [sorted(files + [duplicate])] * 2, trashed
+
+@mock.patch('elodie.localstorage.Db.sample_min_size', 100)
+@mock.patch('elodie.localstorage.Db.sample_block_size', 10)
+def test_import_files_trash_reads_sampled_duplicates():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 1)
+    duplicate = os.path.join(folder, 'valid-duplicate.txt')
+    shutil.copyfile(files[0], duplicate)
+
+    helper.reset_dbs()
+    list(Importer(FileSystem(), os.path.join(folder_destination, 'first')).import_files(files))
+    with mock.patch('elodie.importer.send2trash') as send2trash:
+        with mock.patch('elodie.localstorage.Db.checksum', wraps=Db().checksum) as checksum:
+            result = list(Importer(FileSystem(), os.path.join(folder_destination, 'second'), trash=True).import_files([duplicate]))
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert result == [(duplicate, None)], result
+    # The sample matched but the whole file was read before trashing it.
+    assert [call[0][0] for call in checksum.call_args_list] == [duplicate], checksum.call_args_list
+    assert [call[0][0] for call in send2trash.call_args_list] == [duplicate], send2trash.call_args_list
+
+def test_import_files_in_parallel_allow_duplicates():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = []
+    for i in range(6):
+        origin = os.path.join(folder, 'valid-%02d.txt' % i)
+        shutil.copyfile(helper.get_file('valid.txt'), origin)
+        files.append(origin)
+
+    helper.reset_dbs()
+    result = list(Importer(FileSystem(), folder_destination, allow_duplicates=True, jobs=3).import_files(files))
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert None not in [dest_path for _, dest_path in result], result
+
+def _write_hash_while_copy_config(name, verify=False):
+    config_file = '%s/%s' % (gettempdir(), name)
+    with open(config_file, 'w') as f:
+        f.write("""
+[Import]
+hash_while_copy=true
+verify_copy=%s
+        """ % ('true' if verify else 'false'))
+    if hasattr(load_config, 'config'):
+        del load_config.config
+    return config_file
+
+def _list_files(folder):
+    found = []
+    for root, dirs, files in os.walk(folder):
+        found.extend(files)
+    return found
+
+def test_import_files_hash_while_copy():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 6)
+    # A duplicate of the first file is only found once it's been copied.
+    duplicate = os.path.join(folder, 'valid-duplicate.txt')
+    shutil.copyfile(files[0], duplicate)
+    files.append(duplicate)
+
+    config_file = _write_hash_while_copy_config('config.ini-hash-while-copy', True)
+    helper.reset_dbs()
+    with mock.patch('elodie.config.config_file', config_file):
+        result = list(Importer(FileSystem(), folder_destination, jobs=3).import_files(files))
+    helper.restore_dbs()
+    if hasattr(load_config, 'config'):
+        del load_config.config
+
+    db = Db()
+    hashes = [db.get_hash(db.checksum(_file)) for _file in files[:6]]
+    copied = _list_files(folder_destination)
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert None not in [dest_path for _, dest_path in result[:6]], result
+    assert result[6][1] is None, result
+    assert len(copied) == 6, copied
+    assert [name for name in copied if name.startswith('.')] == [], copied
+    assert hashes == [dest_path for _, dest_path in result[:6]], hashes
+
+def test_import_files_hash_while_copy_keeps_source():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 3)
+    with open(files[0], 'r') as f:
+        contents = f.read()
+
+    config_file = _write_hash_while_copy_config('config.ini-hash-while-copy-source')
+    helper.reset_dbs()
+    with mock.patch('elodie.config.config_file', config_file):
+        result = list(Importer(FileSystem(), folder_destination, album_from_folder=True).import_files(files))
+    helper.restore_dbs()
+    if hasattr(load_config, 'config'):
+        del load_config.config
+
+    with open(files[0], 'r') as f:
+        contents_after = f.read()
+    metadata = Text(result[0][1]).get_metadata()
+    source_files = sorted(os.listdir(folder))
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert contents_after == contents, contents_after
+    assert source_files == sorted(os.path.basename(_file) for _file in files), source_files
+    assert metadata['album'] == os.path.basename(folder), metadata
+    assert metadata['original_name'] == 'valid-00.txt', metadata
+
+@mock.patch('elodie.localstorage.Db.sample_min_size', 100)
+@mock.patch('elodie.localstorage.Db.sample_block_size', 10)
+def test_import_files_skips_duplicates_by_sample():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 3)
+
+    helper.reset_dbs()
+    first = list(Importer(FileSystem(), os.path.join(folder_destination, 'first')).import_files(files))
+    with mock.patch('elodie.localstorage.Db.checksum') as checksum:
+        second = list(Importer(FileSystem(), os.path.join(folder_destination, 'second'), jobs=2).import_files(files))
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert None not in [dest_path for _, dest_path in first], first
+    assert [dest_path for _, dest_path in second] == [None] * 3, second
+    assert checksum.called is False
+
+@mock.patch('elodie.localstorage.Db.sample_min_size', 100)
+@mock.patch('elodie.localstorage.ChecksumCache.racy_seconds', -10)
+def test_plan_checksum_skips_sample_of_cached_files():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 2)
+
+    helper.reset_dbs()
+    db = get_session()
+    db.checksum(files[0])
+    with mock.patch('elodie.localstorage.Db.checksum_sample', return_value=None) as checksum_sample:
+        Importer(FileSystem(), folder_destination).prepare(files[0])
+        cached_calls = checksum_sample.call_count
+        Importer(FileSystem(), folder_destination).prepare(files[1])
+        Importer(FileSystem(), folder_destination, allow_duplicates=True).prepare(files[1])
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert cached_calls == 0, cached_calls
+    assert checksum_sample.call_count == 1, checksum_sample.call_args_list
+
+def test_check_file_with_trash_does_not_trust_sample():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 1)
+
+    plan = Importer(FileSystem(), folder_destination).check_file(files[0])
+    trash_plan = Importer(FileSystem(), folder_destination, trash=True).check_file(files[0])
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert plan['sample_duplicates'] is True, plan
+    assert trash_plan['sample_duplicates'] is False, trash_plan
+
+def _import_with_journal(folder, destination, files, resume=False, jobs=1):
+    with mock.patch('elodie.constants.import_journal_directory', os.path.join(folder, 'import-journals')):
+        journal = ImportJournal(destination, resume)
+        result = list(Importer(FileSystem(), destination, jobs=jobs, journal=journal).import_files(files))
+        journal.close()
+    return (journal, result)
+
+def _load_journal(folder, destination):
+    with mock.patch('elodie.constants.import_journal_directory', os.path.join(folder, 'import-journals')):
+        journal = ImportJournal(destination, True)
+        journal.close()
+    return journal
+
+def test_import_files_resume_skips_finished_files():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 6)
+    unsupported = os.path.join(folder, 'unsupported.xyz')
+    with open(unsupported, 'w') as f:
+        f.write('not media')
+    files.insert(2, unsupported)
+
+    # Copying one file fails and it should be retried.
+    commit_copy = FileSystem.commit_copy
+    def fail_one(filesystem, plan):
+        if plan['file'] == files[4]:
+            return None
+        return commit_copy(filesystem, plan)
+
+    helper.reset_dbs()
+    with mock.patch.object(FileSystem, 'commit_copy', fail_one):
+        journal, first = _import_with_journal(folder, folder_destination, files, jobs=3)
+    with mock.patch('elodie.localstorage.Db.checksum', wraps=Db().checksum) as checksum:
+        resumed_journal, second = _import_with_journal(folder, folder_destination, files, True, jobs=3)
+    loaded_journal = _load_journal(folder, folder_destination)
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    # Entries are only read back when resuming.
+    assert journal.entries == {}, journal.entries
+    statuses = [resumed_journal.entries[_file]['status'] for _file in files]
+    assert statuses == ['completed', 'completed', 'skipped', 'completed', 'failed', 'completed', 'completed'], statuses
+    assert resumed_journal.resumed is True
+    assert [_file for _file, _ in second] == files, second
+    assert second[4][1] is not None, second
+    assert [dest_path for _, dest_path in second[:4]] == [dest_path for _, dest_path in first[:4]], (first, second)
+    # Only the file which failed is read again.
+    assert [call[0][0] for call in checksum.call_args_list] == [files[4]], checksum.call_args_list
+    assert loaded_journal.entries[files[4]]['status'] == 'completed', loaded_journal.entries
+
+def test_import_files_resume_retries_changed_files():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 2)
+
+    helper.reset_dbs()
+    _import_with_journal(folder, folder_destination, files)
+    with open(files[1], 'a') as f:
+        f.write('changed')
+    journal, result = _import_with_journal(folder, folder_destination, files, True)
+    loaded_journal = _load_journal(folder, folder_destination)
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert None not in [dest_path for _, dest_path in result], result
+    assert len(loaded_journal.entries) == 2, loaded_journal.entries
+
+def test_import_files_resume_yields_finished_files_straight_away():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 4)
+
+    helper.reset_dbs()
+    _import_with_journal(folder, folder_destination, files[:3])
+    released = threading.Event()
+    streamed = []
+    def discover():
+        for _file in files[:3]:
+            yield _file
+        # Discovery is still going when the finished files should come out.
+        streamed.append(released.wait(5))
+        yield files[3]
+
+    with mock.patch('elodie.constants.import_journal_directory', os.path.join(folder, 'import-journals')):
+        journal = ImportJournal(folder_destination, True)
+        result = []
+        for _file, dest_path in Importer(FileSystem(), folder_destination, jobs=2, journal=journal).import_files(discover()):
+            result.append((_file, dest_path))
+            if len(result) == 3:
+                released.set()
+        journal.close()
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert streamed == [True], streamed
+    assert [_file for _file, _ in result] == files, result
+    assert None not in [dest_path for _, dest_path in result], result
+
+def test_import_file_resume_journals_each_destination():
+    temporary_folder, folder = helper.create_working_folder()
+    temporary_folder_destination, folder_destination = helper.create_working_folder()
+
+    files = _create_text_files(folder, 1)
+
+    helper.reset_dbs()
+    with mock.patch('elodie.constants.import_journal_directory', os.path.join(folder, 'import-journals')):
+        journal = ImportJournal(os.path.join(folder_destination, 'first'))
+        dest_path = Importer(FileSystem(), os.path.join(folder_destination, 'first'), journal=journal).import_file(files[0])
+        journal.close()
+        # Importing somewhere else keeps the journal of the first destination.
+        journal = ImportJournal(os.path.join(folder_destination, 'second'))
+        Importer(FileSystem(), os.path.join(folder_destination, 'second'), journal=journal).import_file(files[0])
+        journal.close()
+        journal = ImportJournal(os.path.join(folder_destination, 'first'), True)
+        with mock.patch('elodie.localstorage.Db.checksum') as checksum:
+            resumed_dest_path = Importer(FileSystem(), os.path.join(folder_destination, 'first'), journal=journal).import_file(files[0])
+        journal.close()
+        other_journal = ImportJournal(os.path.join(folder_destination, 'third'), True)
+        other_journal.close()
+    helper.restore_dbs()
+
+    shutil.rmtree(folder)
+    shutil.rmtree(folder_destination)
+
+    assert dest_path is not None
+    assert resumed_dest_path == dest_path, (dest_path, resumed_dest_path)
+    assert checksum.called is False
+    assert other_journal.resumed is False
+    assert other_journal.entries == {}, other_journal.entries
+
+def test_copy_batch_groups_files_by_directory():
+    importer = Importer(FileSystem(), '/destination')
+    plans = [
+        {'dest_directory': '/destination/b', 'dest_path': '/destination/b/1.jpg', 'copied': threading.Event()},
+        {'dest_directory': '/destination/a', 'dest_path': '/destination/a/2.jpg', 'copied': threading.Event()},
+        {'dest_directory': '/destination/b', 'dest_path': '/destination/b/0.jpg', 'copied': threading.Event()},
+    ]
+
+    copied = []
+    def commit_copy(plan):
+        copied.append(plan['dest_path'])
+        return plan
+
+    with mock.patch.object(importer.filesystem, 'commit_copy', commit_copy):
+        result = importer._copy_batch(plans)
+
+    assert result == plans, result
+    assert copied == ['/destination/a/2.jpg', '/destination/b/0.jpg', '/destination/b/1.jpg'], copied
+    assert [plan['copied'].is_set() for plan in plans] == [True] * 3
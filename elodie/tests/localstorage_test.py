@@ -1,13 +1,19 @@
 from __future__ import print_function
 from __future__ import absolute_import
 # Project imports
+import hashlib
+import mock
 import os
+import shutil
 import sys
 
+from nose.tools import assert_raises
+from tempfile import gettempdir
+
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
 
 from . import helper
-from elodie.localstorage import Db
+from elodie.localstorage import ChecksumCache, Db, LocationIndex, SqliteDb, close_session, format_checksum, get_checksum_algorithm, get_session, longitude_ranges_in_box
 from elodie import constants
 
 os.environ['TZ'] = 'GMT'
@@ -63,6 +69,114 @@ def test_add_hash_explicit_write():
     db2 = Db()
     assert db2.check_hash(random_key) == True
 
+def test_add_hash_explicit_write_appends_to_journal():
+    db = Db()
+    db.update_hash_db()
+    hash_db_size = os.path.getsize(constants.hash_db)
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+
+    assert os.path.getsize(constants.hash_db) == hash_db_size, 'hash.json should not be rewritten'
+    with open(db.hash_db_journal, 'r') as f:
+        assert random_key in f.read()
+
+def test_load_ignores_incomplete_journal_record():
+    db = Db()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+
+    # Simulate a crash in the middle of writing a record
+    with open(db.hash_db_journal, 'a') as f:
+        f.write('["%s", "%s' % (helper.random_string(10), helper.random_string(12)))
+
+    db2 = Db()
+    assert db2.check_hash(random_key) == True
+
+def test_journal_compacted_when_large():
+    db = Db()
+    db.journal_compact_min_bytes = 0
+    db.reset_hash_db()
+    db.update_hash_db()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+
+    assert os.path.getsize(db.hash_db_journal) == 0
+    with open(constants.hash_db, 'r') as f:
+        assert random_key in f.read()
+
+def test_update_hash_db_empties_journal():
+    db = Db()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+    db.update_hash_db()
+
+    assert os.path.getsize(db.hash_db_journal) == 0
+    assert not os.path.exists('%s.tmp-%s' % (constants.hash_db, os.getpid()))
+    assert Db().check_hash(random_key) == True
+
+def test_reloads_hash_db_changed_by_another_process():
+    db = Db()
+    db.hash_db
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+
+    # Write from a second instance as if it were another process
+    db2 = Db()
+    db2.add_hash(random_key, random_value, True)
+
+    assert db.check_hash(random_key) == True, 'Changed hash db was not reloaded'
+
+def test_update_hash_db_merges_changes_from_another_process():
+    db = Db()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value)
+
+    db2 = Db()
+    random_key2 = helper.random_string(10)
+    random_value2 = helper.random_string(12)
+    db2.add_hash(random_key2, random_value2, True)
+
+    db.update_hash_db()
+
+    db3 = Db()
+    assert db3.check_hash(random_key) == True
+    assert db3.check_hash(random_key2) == True
+
+def test_get_session_returns_same_instance():
+    close_session()
+
+    assert get_session() is get_session()
+
+    close_session()
+
+def test_close_session_flushes():
+    close_session()
+    db = get_session()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value)
+
+    assert Db().check_hash(random_key) == False
+
+    close_session()
+
+    assert Db().check_hash(random_key) == True
+    assert get_session() is not db
+
+    close_session()
+
 def test_backup_hash_db():
     db = Db()
     backup_file_name = db.backup_hash_db()
@@ -151,6 +265,33 @@ def test_reset_hash_db():
     assert random_key not in db.hash_db, random_key
 
 
+def test_remove_hash_journaled():
+    db = Db()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+    db.remove_hash(random_key, True)
+
+    assert db.check_hash(random_key) == False
+    # Replaying the journal removes it too.
+    assert Db().check_hash(random_key) == False
+
+def test_remove_hash_merges_with_other_process():
+    db = Db()
+    random_key = helper.random_string(10)
+    db.add_hash(random_key, helper.random_string(12), True)
+    db.update_hash_db()
+    db.hash_db
+
+    other_key = helper.random_string(10)
+    Db().add_hash(other_key, helper.random_string(12), True)
+    db.remove_hash(random_key)
+    db.update_hash_db()
+
+    assert Db().check_hash(random_key) == False
+    assert Db().check_hash(other_key) == True
+
 def test_update_hash_db():
     db = Db()
 
@@ -180,6 +321,256 @@ def test_checksum():
 
     assert checksum == 'd5eb755569ddbc8a664712d2d7d6e0fa1ddfcdb378475e4a6758dc38d5ea9a16', 'Checksum for plain.jpg did not match'
 
+def test_checksum_copy():
+    db = Db()
+    temporary_folder, folder = helper.create_working_folder()
+
+    src = helper.get_file('plain.jpg')
+    dest = os.path.join(folder, 'copy.jpg')
+    checksum = db.checksum_copy(src, dest, 1000)
+    dest_checksum = db.checksum(dest)
+
+    shutil.rmtree(folder)
+
+    assert checksum == db.checksum(src), checksum
+    assert dest_checksum == checksum, dest_checksum
+
+def test_checksum_blake2b():
+    db = Db()
+
+    src = helper.get_file('plain.jpg')
+    checksum = db.checksum(src, algorithm='blake2b')
+    with open(src, 'rb') as f:
+        expected = hashlib.blake2b(f.read()).hexdigest()
+
+    assert checksum == 'blake2b:%s' % expected, checksum
+
+def test_checksum_small_blocksize():
+    db = Db()
+
+    checksum = db.checksum(helper.get_file('plain.jpg'), 1000)
+
+    assert checksum == 'd5eb755569ddbc8a664712d2d7d6e0fa1ddfcdb378475e4a6758dc38d5ea9a16', checksum
+
+def test_checksum_unknown_algorithm():
+    db = Db()
+
+    with assert_raises(ValueError):
+        db.checksum(helper.get_file('plain.jpg'), algorithm='md4-or-so')
+
+def test_checksum_copy_blake2b():
+    db = Db()
+    db.checksum_algorithm = 'blake2b'
+    temporary_folder, folder = helper.create_working_folder()
+
+    src = helper.get_file('plain.jpg')
+    dest = os.path.join(folder, 'copy.jpg')
+    checksum = db.checksum_copy(src, dest, 1000)
+
+    shutil.rmtree(folder)
+
+    assert checksum == db.checksum(src), checksum
+    assert checksum.startswith('blake2b:'), checksum
+
+def test_get_checksum_algorithm():
+    assert format_checksum('sha256', 'abc') == 'abc'
+    assert format_checksum('blake2b', 'abc') == 'blake2b:abc'
+    assert get_checksum_algorithm('abc') == 'sha256'
+    assert get_checksum_algorithm('blake2b:abc') == 'blake2b'
+
+def test_checksum_sample_small_file():
+    db = Db()
+
+    assert db.checksum_sample(helper.get_file('plain.jpg')) is None
+
+@mock.patch('elodie.localstorage.Db.sample_min_size', 1000)
+@mock.patch('elodie.localstorage.Db.sample_block_size', 100)
+def test_checksum_sample():
+    db = Db()
+    temporary_folder, folder = helper.create_working_folder()
+
+    src = helper.get_file('plain.jpg')
+    dest = os.path.join(folder, 'copy.jpg')
+    shutil.copyfile(src, dest)
+    sample = db.checksum_sample(src)
+    copy_sample = db.checksum_sample(dest)
+    # Change a byte which isn't in any of the blocks.
+    with open(dest, 'r+b') as f:
+        f.seek(150)
+        byte = f.read(1)
+        f.seek(150)
+        f.write(b'\x00' if byte != b'\x00' else b'\x01')
+    changed_sample = db.checksum_sample(dest)
+    # Then one which is.
+    with open(dest, 'r+b') as f:
+        f.write(b'\x00\x01\x02\x03')
+    changed_block_sample = db.checksum_sample(dest)
+
+    shutil.rmtree(folder)
+
+    assert sample[0] == os.path.getsize(src), sample
+    assert copy_sample == sample, copy_sample
+    assert changed_sample == sample, changed_sample
+    assert changed_block_sample[0] == sample[0], changed_block_sample
+    assert changed_block_sample[1] != sample[1], changed_block_sample
+
+def test_add_sample():
+    db = Db()
+
+    sample = (1000, helper.random_string(10))
+    db.add_sample(sample, 'first')
+    db.add_sample(sample, 'second')
+    db.add_sample(sample, 'first', True)
+
+    assert db.get_sample(sample) == ['first', 'second'], db.get_sample(sample)
+    assert Db().get_sample(sample) == ['first', 'second']
+    assert db.get_sample((sample[0] + 1, sample[1])) == []
+
+def test_reset_hash_db_resets_samples():
+    db = Db()
+
+    sample = (1000, helper.random_string(10))
+    db.add_sample(sample, 'checksum', True)
+    db.reset_hash_db()
+    db.flush()
+
+    assert db.get_sample(sample) == []
+    assert Db().get_sample(sample) == []
+
+def test_add_stat():
+    db = Db()
+
+    checksum = helper.random_string(10)
+    db.add_stat(checksum, (1000, 1500000000000000000))
+    db.add_stat(checksum, (1001, 1500000000000000000), True)
+
+    assert db.get_stat(checksum) == (1001, 1500000000000000000), db.get_stat(checksum)
+    assert Db().get_stat(checksum) == (1001, 1500000000000000000)
+    assert db.get_stat(helper.random_string(10)) is None
+
+def test_remove_hash_removes_stat():
+    db = Db()
+
+    checksum = helper.random_string(10)
+    db.add_hash(checksum, helper.random_string(12), True)
+    db.add_stat(checksum, (1000, 1500000000000000000), True)
+    db.remove_hash(checksum, True)
+    db.flush()
+
+    assert db.get_stat(checksum) is None
+    assert Db().get_stat(checksum) is None
+
+def _create_checksum_cache_file():
+    temporary_folder, folder = helper.create_working_folder()
+    file_path = os.path.join(folder, 'file.txt')
+    with open(file_path, 'w') as f:
+        f.write(helper.random_string(20))
+    return (folder, file_path)
+
+def _get_checksum_cache(rehash=False):
+    checksum_cache = ChecksumCache(rehash)
+    # Files in the tests were all just written.
+    checksum_cache.racy_seconds = -10
+    return checksum_cache
+
+def test_checksum_cache():
+    folder, file_path = _create_checksum_cache_file()
+    db = Db()
+    db.checksum_cache = _get_checksum_cache()
+
+    checksum = db.checksum(file_path)
+    cached = db.checksum_cache.get(os.stat(file_path))
+    with mock.patch('elodie.localstorage.hashlib.sha256') as sha256:
+        second_checksum = db.checksum(file_path)
+
+    db.checksum_cache.close()
+    shutil.rmtree(folder)
+
+    assert cached == checksum, cached
+    assert second_checksum == checksum, second_checksum
+    assert sha256.called is False
+
+def test_checksum_cache_changed_file():
+    folder, file_path = _create_checksum_cache_file()
+    db = Db()
+    db.checksum_cache = _get_checksum_cache()
+
+    checksum = db.checksum(file_path)
+    stat = os.stat(file_path)
+    with open(file_path, 'a') as f:
+        f.write('changed')
+    # Put the modification time back like a tool which preserves it would.
+    os.utime(file_path, (stat.st_atime, stat.st_mtime))
+    cached = db.checksum_cache.get(os.stat(file_path))
+    changed_checksum = db.checksum(file_path)
+    expected_checksum = Db().checksum(file_path)
+
+    db.checksum_cache.close()
+    shutil.rmtree(folder)
+
+    assert cached is None, cached
+    assert changed_checksum != checksum, changed_checksum
+    assert changed_checksum == expected_checksum, changed_checksum
+
+def test_checksum_cache_other_algorithm():
+    folder, file_path = _create_checksum_cache_file()
+    db = Db()
+    db.checksum_cache = _get_checksum_cache()
+
+    checksum = db.checksum(file_path)
+    blake2b_checksum = db.checksum(file_path, algorithm='blake2b')
+    cached = db.checksum_cache.get(os.stat(file_path))
+
+    db.checksum_cache.close()
+    shutil.rmtree(folder)
+
+    assert get_checksum_algorithm(checksum) == 'sha256', checksum
+    assert get_checksum_algorithm(blake2b_checksum) == 'blake2b', blake2b_checksum
+    assert cached == blake2b_checksum, cached
+
+def test_checksum_cache_rehash():
+    folder, file_path = _create_checksum_cache_file()
+    checksum_cache = _get_checksum_cache()
+    checksum_cache.add(os.stat(file_path), 'not the checksum')
+    checksum_cache.flush()
+
+    rehash_cache = _get_checksum_cache(True)
+    db = Db()
+    db.checksum_cache = rehash_cache
+    checksum = db.checksum(file_path)
+    cached = checksum_cache.get(os.stat(file_path))
+
+    checksum_cache.close()
+    rehash_cache.close()
+    shutil.rmtree(folder)
+
+    assert checksum != 'not the checksum', checksum
+    assert cached == checksum, cached
+
+def test_checksum_cache_skips_recently_changed_files():
+    folder, file_path = _create_checksum_cache_file()
+    checksum_cache = ChecksumCache()
+    checksum_cache.add(os.stat(file_path), 'checksum')
+    cached = checksum_cache.get(os.stat(file_path))
+
+    checksum_cache.close()
+    shutil.rmtree(folder)
+
+    assert cached is None, cached
+
+def test_checksum_cache_evicts_unused_entries():
+    folder, file_path = _create_checksum_cache_file()
+    checksum_cache = _get_checksum_cache()
+    checksum_cache.add(os.stat(file_path), 'checksum')
+    checksum_cache.max_age_days = -1
+    checksum_cache.flush()
+    cached = checksum_cache.get(os.stat(file_path))
+
+    checksum_cache.close()
+    shutil.rmtree(folder)
+
+    assert cached is None, cached
+
 def test_add_location():
     db = Db()
 
@@ -232,6 +623,39 @@ def test_get_location_name_outside_threshold():
 
     assert retrieved_name is None
 
+def test_get_location_name_returns_nearest():
+    db = Db()
+
+    latitude, longitude, name = helper.get_test_location()
+    latitude = latitude + 5
+    db.add_location(latitude + 0.01, longitude, 'far')
+    db.add_location(latitude + 0.001, longitude, name)
+    db.add_location(latitude + 0.02, longitude, 'farther')
+
+    assert db.get_location_name(latitude, longitude, 3000) == name
+
+def test_get_location_name_after_add_location_updates_index():
+    db = Db()
+
+    latitude, longitude, name = helper.get_test_location()
+    latitude = latitude + 6
+    assert db.get_location_name(latitude, longitude, 1) is None
+
+    db.add_location(latitude, longitude, name)
+
+    assert db.get_location_name(latitude, longitude, 1) == name
+
+def test_location_index_across_antimeridian():
+    index = LocationIndex([{'lat': 10.0, 'long': 179.999, 'name': 'east'}])
+
+    assert index.nearest(10.0, -179.999, 1000)['name'] == 'east'
+    assert index.nearest(10.0, -179.9, 1000) is None
+
+def test_location_index_near_pole():
+    index = LocationIndex([{'lat': 89.999, 'long': 0.0, 'name': 'pole'}])
+
+    assert index.nearest(89.999, 180.0, 1000)['name'] == 'pole'
+
 def test_get_location_coordinates_exists():
     db = Db()
     
@@ -261,3 +685,138 @@ def test_get_location_coordinates_does_not_exists():
     location = db.get_location_coordinates(name)
 
     assert location is None
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_add_hash():
+    db = SqliteDb()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+
+    assert db.check_hash(random_key) == True
+    assert db.get_hash(random_key) == random_value
+    assert SqliteDb().get_hash(random_key) == random_value
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_reset_hash_db():
+    db = SqliteDb()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    db.add_hash(random_key, random_value, True)
+    db.reset_hash_db()
+    db.update_hash_db()
+
+    assert db.check_hash(random_key) == False
+    assert len(list(db.all())) == 0
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_add_sample():
+    db = SqliteDb()
+
+    sample = (1000, helper.random_string(10))
+    db.add_sample(sample, 'first')
+    db.add_sample(sample, 'first', True)
+    other_db = SqliteDb()
+    db.reset_hash_db()
+
+    assert other_db.get_sample(sample) == ['first'], other_db.get_sample(sample)
+    assert db.get_sample(sample) == []
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_add_stat():
+    db = SqliteDb()
+
+    checksum = helper.random_string(10)
+    db.add_hash(checksum, helper.random_string(12))
+    db.add_stat(checksum, (1000, 1500000000000000000), True)
+    other_db = SqliteDb()
+    db.remove_hash(checksum)
+
+    assert other_db.get_stat(checksum) == (1000, 1500000000000000000), other_db.get_stat(checksum)
+    assert db.get_stat(checksum) is None
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_remove_hash():
+    db = SqliteDb()
+
+    random_key = helper.random_string(10)
+    db.add_hash(random_key, helper.random_string(12), True)
+    db.remove_hash(random_key, True)
+
+    assert db.check_hash(random_key) == False
+    assert SqliteDb().check_hash(random_key) == False
+
+def test_sqlite_migrates_from_json():
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    latitude, longitude, name = helper.get_test_location()
+
+    json_db = Db()
+    json_db.add_hash(random_key, random_value, True)
+    json_db.add_location(latitude, longitude, name, True)
+
+    with mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10))):
+        db = SqliteDb()
+
+    assert db.get_hash(random_key) == random_value
+    assert db.get_location_name(latitude, longitude, 1) == name
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_export_to_json():
+    db = SqliteDb()
+
+    random_key = helper.random_string(10)
+    random_value = helper.random_string(12)
+    latitude, longitude, name = helper.get_test_location()
+    name = '%s-%s' % (name, helper.random_string(10))
+    db.add_hash(random_key, random_value)
+    db.add_location(latitude, longitude, name)
+    db.export_to_json()
+
+    json_db = Db()
+    assert json_db.get_hash(random_key) == random_value
+    assert json_db.get_location_coordinates(name) == (latitude, longitude)
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_get_location_name_nearest():
+    db = SqliteDb()
+
+    # Move away from locations migrated from location.json by other tests
+    latitude, longitude, name = helper.get_test_location()
+    latitude = latitude - 10
+    db.add_location(latitude + 0.01, longitude, 'far')
+    db.add_location(latitude + 0.001, longitude, name)
+    db.add_location(latitude + 0.02, longitude, 'farther')
+
+    assert db.get_location_name(latitude, longitude, 3000) == name
+    assert db.get_location_name(latitude, longitude, 50) is None
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_get_location_name_across_antimeridian():
+    db = SqliteDb()
+
+    db.add_location(-47.123, 179.999, 'east')
+    db.add_location(-47.321, -179.999, 'west')
+
+    # Like LocationIndex, places just across the antimeridian are found.
+    assert db.get_location_name(-47.123, -179.999, 1000) == 'east'
+    assert db.get_location_name(-47.321, 179.999, 1000) == 'west'
+    assert db.get_location_name(-47.123, -179.9, 1000) is None
+
+def test_longitude_ranges_in_box():
+    assert longitude_ranges_in_box(-10.0, 10.0) == [(-10.0, 10.0)]
+    assert longitude_ranges_in_box(-181.0, -179.0) == [(179.0, 180.0), (-180.0, -179.0)]
+    assert longitude_ranges_in_box(179.0, 181.0) == [(179.0, 180.0), (-180.0, -179.0)]
+    assert longitude_ranges_in_box(-180.0, 180.0) == [(-180.0, 180.0)]
+
+@mock.patch('elodie.constants.sqlite_db', '%s/%s.db' % (gettempdir(), helper.random_string(10)))
+def test_sqlite_get_location_coordinates():
+    db = SqliteDb()
+
+    latitude, longitude, name = helper.get_test_location()
+    db.add_location(latitude, longitude, {'city': name, 'default': name})
+
+    assert db.get_location_coordinates({'default': name, 'city': name}) == (latitude, longitude)
+    assert db.get_location_coordinates(helper.random_string(10)) is None
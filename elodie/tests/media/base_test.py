@@ -14,7 +14,7 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirna
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
 import helper
-from elodie.media.base import Base, get_all_subclasses
+from elodie.media.base import Base, get_all_subclasses, get_supported_extensions
 from elodie.media.media import Media
 from elodie.media.audio import Audio
 from elodie.media.text import Text
@@ -31,6 +31,20 @@ def test_get_all_subclasses():
     expected = {Media, Base, Text, Photo, Video, Audio}
     assert subclasses == expected, subclasses
 
+def test_get_supported_extensions():
+    extensions = get_supported_extensions()
+
+    assert 'jpg' in extensions, extensions
+    assert 'txt' in extensions, extensions
+    assert get_supported_extensions() is extensions
+
+def test_get_file_time_uses_stat():
+    text = Text(helper.get_file('valid.txt'))
+    stat = os.stat(helper.get_file('valid.txt'))
+    text.stat = os.stat_result((stat.st_mode, stat.st_ino, stat.st_dev, stat.st_nlink, stat.st_uid, stat.st_gid, stat.st_size, 1, 200, 100))
+
+    assert text.get_file_time() == 100, text.get_file_time()
+
 def test_get_class_by_file_without_extension():
     base_file = helper.get_file('withoutextension')
 
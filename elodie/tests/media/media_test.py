@@ -3,6 +3,7 @@ import os
 import sys
 
 import hashlib
+import mock
 import random
 import re
 import shutil
@@ -168,3 +169,78 @@ def is_valid():
     media = Media()
 
     assert not media.is_valid()
+
+def test_load_exiftool_attributes():
+    media_list = [
+        Photo(helper.get_file('with-title.jpg')),
+        Photo(helper.get_file('with-location.jpg')),
+        Video(helper.get_file('video.mov')),
+    ]
+
+    Media.load_exiftool_attributes(media_list)
+
+    for media in media_list:
+        # A batch asks for the tags of every class in it so it can have
+        #  more tags than reading the file on its own.
+        expected = media.__class__(media.source).get_exiftool_attributes()
+        loaded = dict((key, media.exif_metadata.get(key)) for key in expected)
+        assert loaded == expected, (media.exif_metadata, expected)
+
+def test_load_exiftool_attributes_keeps_cache():
+    media = Photo(helper.get_file('plain.jpg'))
+    media.exif_metadata = {'XMP:Title': 'Cached'}
+
+    Media.load_exiftool_attributes([media])
+
+    assert media.exif_metadata == {'XMP:Title': 'Cached'}, media.exif_metadata
+
+def test_get_exiftool_batches_by_count():
+    media_list = [Photo(helper.get_file('plain.jpg')) for _ in range(5)]
+
+    with mock.patch.object(Media, 'exiftool_batch_files', 2):
+        batches = list(Media.get_exiftool_batches(media_list))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1], batches
+
+def test_get_exiftool_batches_by_size():
+    media_list = [Photo(helper.get_file('plain.jpg')) for _ in range(5)]
+    size = os.path.getsize(helper.get_file('plain.jpg'))
+
+    with mock.patch.object(Media, 'exiftool_batch_bytes', size * 2):
+        batches = list(Media.get_exiftool_batches(media_list))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1], batches
+
+def test_get_exiftool_batches_file_larger_than_limit():
+    media_list = [Photo(helper.get_file('plain.jpg')) for _ in range(2)]
+
+    with mock.patch.object(Media, 'exiftool_batch_bytes', 1):
+        batches = list(Media.get_exiftool_batches(media_list))
+
+    assert [len(batch) for batch in batches] == [1, 1], batches
+
+def test_get_exiftool_tags():
+    media = Photo(helper.get_file('plain.jpg'))
+    tags = media.get_exiftool_tags()
+
+    assert 'EXIF:DateTimeOriginal' in tags, tags
+    assert 'EXIF:Make' in tags, tags
+    assert 'EXIF:GPSLatitudeRef' in tags, tags
+    assert 'XMP:OriginalFileName' in tags, tags
+    assert len(tags) == len(set(tags)), tags
+
+def test_get_exiftool_tags_for_metadata_keys():
+    media = Video(helper.get_file('video.mov'))
+    media.metadata_keys = ['date_taken', 'title']
+    tags = media.get_exiftool_tags()
+
+    assert tags == media.exif_map['date_taken'] + ['XMP:DisplayName'], tags
+
+def test_get_exiftool_attributes_reads_metadata_keys():
+    media = Photo(helper.get_file('plain.jpg'))
+    media.metadata_keys = ['title']
+
+    attributes = media.get_exiftool_attributes()
+
+    assert 'EXIF:Make' not in attributes, attributes
+    assert 'EXIF:DateTimeOriginal' not in attributes, attributes
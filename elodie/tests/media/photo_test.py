@@ -420,3 +420,53 @@ def _test_photo_type_set(type, date):
     assert metadata['date_taken'] == helper.time_convert(date), '{} date {}'.format(type, metadata['date_taken'])
     assert helper.isclose(metadata['latitude'], 11.1111111111), '{} lat {}'.format(type, metadata['latitude'])
     assert helper.isclose(metadata['longitude'], 99.9999999999), '{} lon {}'.format(type, metadata['latitude'])
+
+def test_write_transaction():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/photo.jpg' % folder
+    shutil.copyfile(helper.get_file('plain.jpg'), origin)
+
+    photo = Photo(origin)
+    photo.get_metadata()
+    photo.begin_write()
+    photo.set_title('Test Title')
+    photo.set_album('Test Album')
+    photo.set_location(-11.1111111111, -99.9999999999)
+
+    metadata = photo.get_metadata()
+    exists_before_commit = os.path.exists('%s_original' % origin)
+    metadata_before_commit = Photo(origin).get_metadata()
+
+    status = photo.commit_write()
+
+    metadata_new = Photo(origin).get_metadata()
+
+    shutil.rmtree(folder)
+
+    assert exists_before_commit is False
+    assert metadata_before_commit['title'] is None, metadata_before_commit['title']
+    assert status == True, status
+    for m in (metadata, metadata_new):
+        assert m['title'] == 'Test Title', m['title']
+        assert m['album'] == 'Test Album', m['album']
+        assert helper.isclose(m['latitude'], -11.1111111111), m['latitude']
+        assert helper.isclose(m['longitude'], -99.9999999999), m['longitude']
+
+def test_set_title_updates_metadata_in_memory():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/photo.jpg' % folder
+    shutil.copyfile(helper.get_file('plain.jpg'), origin)
+
+    photo = Photo(origin)
+    photo.get_metadata()
+    exif_metadata = photo.exif_metadata
+    status = photo.set_title('Test Title')
+    metadata = photo.get_metadata()
+
+    shutil.rmtree(folder)
+
+    assert status == True, status
+    assert photo.exif_metadata is exif_metadata
+    assert metadata['title'] == 'Test Title', metadata['title']
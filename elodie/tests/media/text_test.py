@@ -316,3 +316,135 @@ def test_set_original_name_with_arg():
 
     assert metadata['original_name'] is None, metadata['original_name']
     assert metadata_updated['original_name'] == new_name, metadata_updated['original_name']
+
+def test_write_transaction():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/text.txt' % folder
+    shutil.copyfile(helper.get_file('valid-without-header.txt'), origin)
+
+    with open(origin, 'r') as f:
+        contents = f.read()
+
+    text = Text(origin)
+    text.begin_write()
+    text.set_album('Test Album')
+    text.set_location(11.1111111111, 99.9999999999)
+
+    metadata = text.get_metadata()
+
+    with open(origin, 'r') as f:
+        contents_before_commit = f.read()
+
+    status = text.commit_write()
+
+    with open(origin, 'r') as f:
+        first_line = f.readline()
+        contents_after_commit = f.read()
+
+    metadata_new = Text(origin).get_metadata()
+
+    shutil.rmtree(folder)
+
+    assert contents_before_commit == contents, contents_before_commit
+    assert status == True, status
+    assert contents_after_commit == contents, contents_after_commit
+    assert 'Test Album' in first_line, first_line
+    assert metadata['album'] == 'Test Album', metadata['album']
+    assert helper.isclose(metadata['latitude'], 11.1111111111), metadata['latitude']
+    assert metadata_new['album'] == 'Test Album', metadata_new['album']
+    assert helper.isclose(metadata_new['longitude'], 99.9999999999), metadata_new['longitude']
+
+def test_write_transaction_keeps_existing_header():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/text.txt' % folder
+    shutil.copyfile(helper.get_file('valid.txt'), origin)
+
+    text = Text(origin)
+    title = text.get_title()
+    text.begin_write()
+    text.set_album('Test Album')
+    text.set_original_name()
+    status = text.commit_write()
+
+    metadata = Text(origin).get_metadata()
+
+    shutil.rmtree(folder)
+
+    assert status == True, status
+    assert metadata['title'] == title, metadata['title']
+    assert metadata['album'] == 'Test Album', metadata['album']
+    assert metadata['original_name'] == 'text.txt', metadata['original_name']
+
+def test_commit_write_without_changes():
+    text = Text(helper.get_file('valid.txt'))
+    text.begin_write()
+
+    assert text.commit_write() is None
+
+def test_commit_write_to_output():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/text.txt' % folder
+    output = '%s/copy.txt' % folder
+    shutil.copyfile(helper.get_file('valid.txt'), origin)
+
+    with open(origin, 'r') as f:
+        contents = f.read()
+        f.seek(0)
+        f.readline()
+        body = f.read()
+
+    text = Text(origin)
+    text.begin_write()
+    text.set_album('Test Album')
+    status = text.commit_write(output)
+
+    with open(origin, 'r') as f:
+        contents_after_commit = f.read()
+
+    with open(output, 'r') as f:
+        f.readline()
+        body_output = f.read()
+
+    metadata = text.get_metadata()
+    metadata_output = Text(output).get_metadata()
+    original_exists = os.path.exists('%s_original' % origin)
+
+    shutil.rmtree(folder)
+
+    assert status == True, status
+    assert contents_after_commit == contents, contents_after_commit
+    assert body_output == body, body_output
+    assert original_exists is False
+    assert metadata['album'] == 'Test Album', metadata['album']
+    assert metadata_output['album'] == 'Test Album', metadata_output['album']
+    assert metadata_output['title'] == metadata['title'], metadata_output['title']
+
+def test_commit_write_to_output_without_header():
+    temporary_folder, folder = helper.create_working_folder()
+
+    origin = '%s/text.txt' % folder
+    output = '%s/copy.txt' % folder
+    shutil.copyfile(helper.get_file('valid-without-header.txt'), origin)
+
+    with open(origin, 'r') as f:
+        contents = f.read()
+
+    text = Text(origin)
+    text.begin_write()
+    text.set_original_name()
+    status = text.commit_write(output)
+
+    with open(output, 'r') as f:
+        f.readline()
+        contents_output = f.read()
+
+    original_name = Text(output).get_original_name()
+
+    shutil.rmtree(folder)
+
+    assert status == True, status
+    assert contents_output == contents, contents_output
+    assert original_name == 'text.txt', original_name
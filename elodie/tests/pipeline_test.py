@@ -0,0 +1,146 @@
+from __future__ import absolute_import
+# Project imports
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
+
+from nose.tools import assert_raises
+
+from elodie.pipeline import Pipeline, Stage
+
+def test_run_returns_items_in_order():
+    def slow_for_even(value):
+        if value % 2 == 0:
+            time.sleep(0.01)
+        return value * 10
+
+    pipeline = Pipeline([
+        Stage('multiply', slow_for_even, workers=4),
+        Stage('add', lambda value: value + 1, workers=2),
+    ], queue_size=2)
+
+    result = list(pipeline.run(range(20)))
+
+    assert result == [(i, i * 10 + 1) for i in range(20)], result
+
+def test_run_drops_items():
+    called = []
+    def record(value):
+        called.append(value)
+        return value
+
+    pipeline = Pipeline([
+        Stage('odd', lambda value: value if value % 2 else None, workers=3),
+        Stage('record', record),
+    ])
+
+    result = list(pipeline.run(range(6)))
+
+    assert result == [(0, None), (1, 1), (2, None), (3, 3), (4, None), (5, 5)], result
+    assert sorted(called) == [1, 3, 5], called
+
+def test_run_ordered_stage():
+    called = []
+    def reverse_delay(value):
+        time.sleep((10 - value) * 0.002)
+        return value
+
+    pipeline = Pipeline([
+        Stage('delay', reverse_delay, workers=10),
+        Stage('ordered', lambda value: called.append(value) or value, ordered=True),
+    ])
+
+    list(pipeline.run(range(10)))
+
+    assert called == list(range(10)), called
+
+def test_run_raises_exception_from_stage():
+    def fail_on_three(value):
+        if value == 3:
+            raise ValueError('three')
+        return value
+
+    pipeline = Pipeline([Stage('fail', fail_on_three, workers=2)])
+
+    result = []
+    with assert_raises(ValueError):
+        for item in pipeline.run(range(100)):
+            result.append(item)
+
+    assert result == [(0, 0), (1, 1), (2, 2)], result
+
+def test_run_limits_items_in_flight():
+    lock = threading.Lock()
+    counts = {'current': 0, 'max': 0}
+    def enter(value):
+        with lock:
+            counts['current'] += 1
+            counts['max'] = max(counts['max'], counts['current'])
+        return value
+
+    pipeline = Pipeline([
+        Stage('enter', enter, workers=4),
+        Stage('slow', lambda value: time.sleep(0.001) or value),
+    ], queue_size=1, max_in_flight=3)
+
+    for value, result in pipeline.run(range(30)):
+        with lock:
+            counts['current'] -= 1
+
+    assert counts['max'] <= 3, counts
+
+def test_stats():
+    pipeline = Pipeline([
+        Stage('first', lambda value: value, workers=2),
+        Stage('second', lambda value: value if value < 5 else None),
+    ])
+
+    list(pipeline.run(range(10)))
+    stats = [stats.as_dict() for stats in pipeline.stats]
+
+    assert [s['stage'] for s in stats] == ['first', 'second'], stats
+    assert [s['workers'] for s in stats] == [2, 1], stats
+    assert [s['items'] for s in stats] == [10, 10], stats
+
+def test_stage_ordered_has_one_worker():
+    stage = Stage('ordered', lambda value: value, workers=8, ordered=True)
+
+    assert stage.workers == 1, stage.workers
+
+def test_run_stops_when_consumer_stops():
+    pipeline = Pipeline([Stage('same', lambda value: value)], max_in_flight=1)
+
+    for value, result in pipeline.run(range(100)):
+        break
+
+    assert pipeline.cancelled.is_set()
+
+def test_run_batch_stage():
+    batches = []
+    def record_batch(values):
+        time.sleep(0.001)
+        batches.append(len(values))
+        return [value * 2 for value in values]
+
+    pipeline = Pipeline([
+        Stage('first', lambda value: value if value != 3 else None, workers=4),
+        Stage('batch', record_batch, batch_size=5),
+    ], queue_size=10)
+
+    result = list(pipeline.run(range(40)))
+
+    assert result == [(i, None if i == 3 else i * 2) for i in range(40)], result
+    assert max(batches) <= 5, batches
+    assert sum(batches) == 39, batches
+
+def test_run_batch_stage_raises_exception():
+    def fail(values):
+        raise ValueError('batch')
+
+    pipeline = Pipeline([Stage('batch', fail, batch_size=5)])
+
+    with assert_raises(ValueError):
+        list(pipeline.run(range(10)))
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+# Project imports
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
+
+from . import helper
+from elodie import constants
+from elodie.dependencies import get_exiftool
+from elodie.external.pyexiftool import ExifTool, ExifToolProcess, JsonObjectReader
+
+setup_module = helper.setup_module
+teardown_module = helper.teardown_module
+
+def test_exiftool_is_shared():
+    assert ExifTool() is ExifTool()
+
+def test_get_metadata_from_several_threads():
+    source = helper.get_file('plain.jpg')
+    expected = ExifTool().get_metadata(source)
+    results = []
+    def read():
+        for _ in range(5):
+            results.append(ExifTool().get_metadata(source))
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 20, len(results)
+    assert all(result == expected for result in results)
+    assert len(ExifTool()._load) <= ExifTool().processes, ExifTool()._load
+
+def test_replaces_process_which_exited():
+    exiftool = ExifTool()
+    exiftool.get_metadata(helper.get_file('plain.jpg'))
+    process = list(exiftool._load)[0]
+    process._process.kill()
+    process._process.wait()
+
+    metadata = exiftool.get_metadata(helper.get_file('plain.jpg'))
+
+    assert process not in exiftool._load
+    assert 'SourceFile' in metadata, metadata
+
+def test_submit_several_commands():
+    plain = helper.get_file('plain.jpg')
+    title = helper.get_file('with-title.jpg')
+    process = ExifToolProcess(get_exiftool(), ['-config', constants.exiftool_config])
+    process.start()
+    try:
+        commands = [
+            process.submit_json_objects(plain),
+            process.submit_json_objects(title),
+            process.submit_json_objects(plain, title),
+        ]
+        results = [command.result() for command in commands]
+    finally:
+        process.terminate()
+
+    assert [r['SourceFile'] for r in results[0]] == [plain], results[0]
+    assert [r['SourceFile'] for r in results[1]] == [title], results[1]
+    assert results[2] == results[0] + results[1], results[2]
+
+def test_small_block_size():
+    files = [helper.get_file('plain.jpg'), helper.get_file('with-title.jpg')]
+    expected = ExifTool().get_metadata_batch(files)
+    process = ExifToolProcess(get_exiftool(), ['-config', constants.exiftool_config], 7)
+    process.start()
+    try:
+        result = process.get_metadata_batch(files)
+    finally:
+        process.terminate()
+
+    assert result == expected, (result, expected)
+
+def test_get_metadata_batches():
+    plain = helper.get_file('plain.jpg')
+    title = helper.get_file('with-title.jpg')
+
+    results = list(ExifTool().get_metadata_batches([[plain], [title], [plain]] * 3))
+
+    assert len(results) == 9, results
+    assert [r[0]['SourceFile'] for r in results] == [plain, title, plain] * 3, results
+
+def test_json_object_reader():
+    reader = JsonObjectReader()
+    for data in (b'[{\n  "SourceFile": "a",\n  "XMP:Title": "}\\n{ready}",\n',
+                 b'  "Struct": {\n    "a": 1\n  }\n', b'},\n{\n  "SourceFile"',
+                 b': "b"\n}]\n'):
+        reader.feed(data)
+
+    assert reader.finish() == [
+        {'SourceFile': 'a', 'XMP:Title': '}\n{ready}', 'Struct': {'a': 1}},
+        {'SourceFile': 'b'},
+    ]
+
+def test_get_tags_batches():
+    plain = helper.get_file('plain.jpg')
+    title = helper.get_file('with-title.jpg')
+
+    results = list(ExifTool().get_tags_batches(['XMP:Title'], [[plain], [title]]))
+
+    assert [r[0]['SourceFile'] for r in results] == [plain, title], results
+    assert 'EXIF:Make' not in results[0][0], results
+    assert results[1][0]['XMP:Title'] == ExifTool().get_tag('XMP:Title', title), results
+
+def test_fast_read_params():
+    assert ExifToolProcess()._read_params() == []
+    assert ExifToolProcess(fast=1)._read_params() == ['-fast1']
+    assert ExifToolProcess(fast=2)._read_params() == ['-fast2']
+
+def test_fast_must_be_a_level():
+    try:
+        ExifToolProcess(fast=3)
+    except ValueError:
+        return
+
+    assert False, 'ValueError not raised'
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+# Project imports
+import mock
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))))
+
+from . import helper
+from elodie.localstorage import Db
+from elodie.scrub import Scrub
+
+os.environ['TZ'] = 'GMT'
+
+def _create_library(folder, count):
+    db = Db()
+    db.hash_db = {}
+    for i in range(count):
+        file_path = os.path.join(folder, 'file-%02d.txt' % i)
+        with open(file_path, 'w') as f:
+            f.write('%s %s\n' % (folder, i))
+        db.hash_db[db.checksum(file_path)] = file_path
+    return db
+
+def _scrub(folder, db, **kwargs):
+    with mock.patch('elodie.constants.scrub_state', os.path.join(folder, 'scrub.json')):
+        return list(Scrub(db, **kwargs).run())
+
+def test_run_rotates_through_library():
+    temporary_folder, folder = helper.create_working_folder()
+    db = _create_library(folder, 10)
+
+    now = time.time()
+    runs = []
+    for day in range(4):
+        with mock.patch('time.time', return_value=now + day * 86400):
+            runs.append(_scrub(folder, db, cycle_days=3))
+
+    shutil.rmtree(folder)
+
+    scrubbed = [[os.path.basename(path) for path, checksum, status in run] for run in runs]
+    # Each day reads its share of what's left in the cycle and the fourth
+    #  day starts the next cycle.
+    assert [len(run) for run in scrubbed] == [4, 3, 3, 4], scrubbed
+    assert sorted(sum(scrubbed[:3], [])) == ['file-%02d.txt' % i for i in range(10)], scrubbed
+    assert scrubbed[3] == scrubbed[0], scrubbed
+    assert set(status for run in runs for _, _, status in run) == set(['ok']), runs
+
+def test_run_catches_up_after_missed_days():
+    temporary_folder, folder = helper.create_working_folder()
+    db = _create_library(folder, 10)
+
+    first = _scrub(folder, db, cycle_days=5)
+    with mock.patch('time.time', return_value=time.time() + 3 * 86400):
+        second = _scrub(folder, db, cycle_days=5)
+
+    shutil.rmtree(folder)
+
+    assert len(first) == 2, first
+    assert len(second) == 4, second
+
+def test_run_reports_corrupt_and_missing_files():
+    temporary_folder, folder = helper.create_working_folder()
+    db = _create_library(folder, 3)
+
+    with open(os.path.join(folder, 'file-00.txt'), 'a') as f:
+        f.write('bit rot')
+    os.remove(os.path.join(folder, 'file-01.txt'))
+
+    result = _scrub(folder, db, cycle_days=1)
+
+    shutil.rmtree(folder)
+
+    statuses = [(os.path.basename(path), status) for path, checksum, status in result]
+    assert statuses == [
+        ('file-00.txt', 'corrupt'),
+        ('file-01.txt', 'missing'),
+        ('file-02.txt', 'ok'),
+    ], statuses
+
+def test_run_stops_at_time_budget():
+    temporary_folder, folder = helper.create_working_folder()
+    db = _create_library(folder, 4)
+
+    with mock.patch('elodie.constants.scrub_state', os.path.join(folder, 'scrub.json')):
+        scrub = Scrub(db, cycle_days=1, time_budget=-1)
+        result = list(scrub.run())
+        # The next run starts with the files which were skipped.
+        next_result = list(Scrub(db, cycle_days=1).run())
+
+    shutil.rmtree(folder)
+
+    assert result == [], result
+    assert scrub.skipped == 4, scrub.skipped
+    assert len(next_result) == 4, next_result
+
+def test_throttle_sleeps_to_limit_bandwidth():
+    scrub = Scrub(None, bandwidth=1000)
+    scrub._read_started = time.time()
+
+    with mock.patch('time.sleep') as sleep:
+        scrub.throttle(500)
+        scrub.throttle(500)
+
+    assert sleep.call_count == 2, sleep.call_args_list
+    assert 0.9 < sleep.call_args[0][0] <= 1, sleep.call_args
+
+def test_throttle_without_bandwidth_does_not_sleep():
+    scrub = Scrub(None)
+
+    with mock.patch('time.sleep') as sleep:
+        scrub.throttle(10 ** 9)
+
+    assert sleep.called is False
@@ -0,0 +1,361 @@
+"""
+Micro benchmarks for the parts of Elodie which run once per imported file.
+
+Usage: python -m elodie.tools.benchmark <name> [args...]
+
+Each benchmark works on temporary files or only reads the files it's
+given and never touches ~/.elodie.
+"""
+from __future__ import print_function
+from __future__ import division
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from elodie import constants
+from elodie.dependencies import get_exiftool
+from elodie.external.pyexiftool import ExifTool, ExifToolProcess, fsencode
+from elodie.filesystem import FileSystem
+from elodie.localstorage import (Db, LocationIndex, checksum_algorithms,
+                                 distance_m, new_hasher)
+from elodie.media.base import get_all_subclasses
+from elodie.media.media import Media
+# Imported so get_all_subclasses() finds them.
+from elodie.media.audio import Audio  # noqa
+from elodie.media.photo import Photo  # noqa
+from elodie.media.video import Video  # noqa
+
+
+def random_checksum(i):
+    return '%064x' % (i * 2654435761)
+
+
+def benchmark_hash_db(argv):
+    """Time adding hashes to hash dbs of increasing size.
+
+    Compares appending to the journal (what an import does now) against
+    rewriting hash.json after every file (what an import used to do).
+
+    Usage: hash-db [sizes...]
+    """
+    sizes = [int(size) for size in argv] or [10000, 100000, 1000000]
+    journal_iterations = 2000
+    rewrite_iterations = 10
+
+    working_directory = tempfile.mkdtemp('-elodie-benchmark')
+    hash_db = constants.hash_db
+    constants.hash_db = os.path.join(working_directory, 'hash.json')
+    try:
+        print('%10s %18s %18s' % ('entries', 'journal ms/file', 'rewrite ms/file'))
+        for size in sizes:
+            with open(constants.hash_db, 'w') as f:
+                json.dump(dict(
+                    (random_checksum(i), '/library/%s.jpg' % i)
+                    for i in range(size)
+                ), f)
+
+            db = Db()
+            db.hash_db
+            start = time.time()
+            for i in range(size, size + journal_iterations):
+                db.add_hash(random_checksum(i), '/library/%s.jpg' % i, True)
+            journal_ms = (time.time() - start) * 1000 / journal_iterations
+            db.update_hash_db()
+
+            start = time.time()
+            for i in range(size, size + rewrite_iterations):
+                db.add_hash(random_checksum(i), '/library/%s.jpg' % i)
+                db.update_hash_db()
+            rewrite_ms = (time.time() - start) * 1000 / rewrite_iterations
+
+            print('%10d %18.3f %18.3f' % (size, journal_ms, rewrite_ms))
+    finally:
+        constants.hash_db = hash_db
+        shutil.rmtree(working_directory)
+
+
+def benchmark_location_index(argv):
+    """Time finding the nearest cached location.
+
+    Compares the grid index against scanning every cached location.
+
+    Usage: location-index [sizes...]
+    """
+    sizes = [int(size) for size in argv] or [1000, 100000, 1000000]
+    lookups = 1000
+    scan_seconds = 2
+
+    generator = random.Random(0)
+    print('%10s %12s %18s %18s' % ('locations', 'build ms', 'index us/lookup', 'scan us/lookup'))
+    for size in sizes:
+        locations = [
+            {
+                'lat': generator.uniform(-80, 80),
+                'long': generator.uniform(-180, 180),
+                'name': {'default': str(i)}
+            }
+            for i in range(size)
+        ]
+        points = [
+            (generator.uniform(-80, 80), generator.uniform(-180, 180))
+            for _ in range(lookups)
+        ]
+
+        start = time.time()
+        index = LocationIndex(locations)
+        build_ms = (time.time() - start) * 1000
+
+        start = time.time()
+        for latitude, longitude in points:
+            index.nearest(latitude, longitude, 3000)
+        index_us = (time.time() - start) * 1000000 / lookups
+
+        # Scanning every location is slow so we stop after a few seconds.
+        scanned = 0
+        start = time.time()
+        for latitude, longitude in points:
+            for data in locations:
+                distance_m(latitude, longitude, data['lat'], data['long'])
+            scanned += 1
+            if time.time() - start > scan_seconds:
+                break
+        scan_us = (time.time() - start) * 1000000 / scanned
+
+        print('%10d %12.1f %18.1f %18.1f' % (size, build_ms, index_us, scan_us))
+
+
+def checksum_legacy(file_path, algorithm, blocksize=65536):
+    # This is how Db.checksum used to read: 64 KiB read() calls which each
+    #  allocate a new bytes object.
+    hasher = new_hasher(algorithm)
+    with open(file_path, 'rb') as f:
+        buf = f.read(blocksize)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = f.read(blocksize)
+    return hasher.hexdigest()
+
+
+def benchmark_checksum(argv):
+    """Time hashing a file with each checksum algorithm.
+
+    Compares the old 64 KiB read() loop against Db.checksum. The file is
+    read once before timing so the numbers are for hashing from the page
+    cache, which is what's left once the disk is fast enough.
+
+    Usage: checksum [file] [megabytes]
+    """
+    megabytes = int(argv[1]) if len(argv) > 1 else 512
+    working_directory = None
+    if argv:
+        file_path = argv[0]
+    else:
+        working_directory = tempfile.mkdtemp('-elodie-benchmark')
+        file_path = os.path.join(working_directory, 'random.bin')
+        with open(file_path, 'wb') as f:
+            for _ in range(megabytes):
+                f.write(os.urandom(1048576))
+    try:
+        size = os.path.getsize(file_path)
+        checksum_legacy(file_path, 'sha256')
+
+        db = Db()
+        print('%d MB' % (size // 1048576))
+        print('%-10s %16s %16s' % ('algorithm', 'read() GB/s', 'Db GB/s'))
+        for algorithm in sorted(checksum_algorithms):
+            start = time.time()
+            checksum_legacy(file_path, algorithm)
+            legacy_seconds = time.time() - start
+
+            start = time.time()
+            db.checksum(file_path, algorithm=algorithm)
+            seconds = time.time() - start
+
+            print('%-10s %16.2f %16.2f' % (
+                algorithm, size / legacy_seconds / 1e9, size / seconds / 1e9))
+    finally:
+        if working_directory is not None:
+            shutil.rmtree(working_directory)
+
+
+def read_metadata_legacy(exiftool, files):
+    # This is how ExifTool.execute used to read: one file per command and
+    #  4 KiB reads appended to a bytes object until the sentinel shows up.
+    process = subprocess.Popen(
+        [exiftool, '-stay_open', 'True', '-@', '-', '-common_args', '-G',
+         '-n', '-config', constants.exiftool_config],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        fd = process.stdout.fileno()
+        for _file in files:
+            process.stdin.write(b'\n'.join([b'-j', fsencode(_file), b'-execute\n']))
+            process.stdin.flush()
+            output = b''
+            while not output[-32:].strip().endswith(b'{ready}'):
+                output += os.read(fd, 4096)
+            json.loads(output.strip()[:-len(b'{ready}')].decode('utf-8'))
+    finally:
+        process.stdin.write(b'-stay_open\nFalse\n')
+        process.stdin.flush()
+        process.communicate()
+
+
+def benchmark_exiftool(argv):
+    """Time reading metadata with exiftool.
+
+    Compares reading one file per command with the old reader, one file
+    per command with the current reader and batches of files sent to the
+    pool of exiftool processes without waiting between batches.
+
+    Usage: exiftool <directory> [repeat] [processes]
+    """
+    if not argv:
+        print('Usage: exiftool <directory> [repeat] [processes]')
+        return
+
+    repeat = int(argv[1]) if len(argv) > 1 else 1
+    processes = int(argv[2]) if len(argv) > 2 else None
+    files = []
+    for root, dirs, names in os.walk(argv[0]):
+        for name in sorted(names):
+            _file = os.path.join(root, name)
+            if Media.get_class_by_file(_file, get_all_subclasses(Media)):
+                files.append(_file)
+    files = files * repeat
+
+    exiftool = get_exiftool()
+    addedargs = ['-config', constants.exiftool_config]
+    print('%d files' % len(files))
+    print('%-28s %12s' % ('reader', 'files/s'))
+
+    start = time.time()
+    read_metadata_legacy(exiftool, files)
+    print('%-28s %12.1f' % ('one per command (old)', len(files) / (time.time() - start)))
+
+    with ExifToolProcess(exiftool, addedargs) as process:
+        start = time.time()
+        for _file in files:
+            process.get_metadata(_file)
+        print('%-28s %12.1f' % ('one per command', len(files) / (time.time() - start)))
+
+    with ExifTool(exiftool, addedargs, processes) as pool:
+        batches = [
+            files[i:i + Media.exiftool_batch_files]
+            for i in range(0, len(files), Media.exiftool_batch_files)
+        ]
+        # Start the pool's processes before timing it.
+        list(pool.get_metadata_batches(batches[:pool.in_flight]))
+
+        start = time.time()
+        for results in pool.get_metadata_batches(batches):
+            pass
+        print('%-28s %12.1f' % ('batched and pipelined', len(files) / (time.time() - start)))
+
+
+def create_order_tree(directory, count, kilobytes):
+    # Files are written in one order and named in another so their order on
+    #  disk has nothing to do with their paths, like a library which was
+    #  copied in over the years.
+    generator = random.Random(0)
+    names = list(range(count))
+    generator.shuffle(names)
+    for name in names:
+        folder = os.path.join(directory, '%02d' % (name % 20))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, '%06d.jpg' % name), 'wb') as f:
+            f.write(os.urandom(kilobytes * 1024))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_files_cold(files, blocksize=1048576):
+    # Drop each file from the page cache so it's read from the disk.
+    for _file in files:
+        fd = os.open(_file, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+    size = 0
+    start = time.time()
+    buf = bytearray(blocksize)
+    for _file in files:
+        with open(_file, 'rb', buffering=0) as f:
+            read = f.readinto(buf)
+            while read > 0:
+                size += read
+                read = f.readinto(buf)
+    return (size, time.time() - start)
+
+
+def benchmark_order(argv):
+    """Time reading a tree of files in each order an import can use.
+
+    random is how files were read when the import went through a set of
+    paths. The files are dropped from the page cache before each run so
+    run it on the kind of disk you import from, e.g. a directory on a USB
+    hard drive or on a loop device throttled with cgroups or dm-delay. On
+    an SSD or in memory the orders are about the same.
+
+    Usage: order [directory] [files] [kilobytes]
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        print('This benchmark needs os.posix_fadvise to empty the page cache')
+        return
+
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    kilobytes = int(argv[2]) if len(argv) > 2 else 256
+    working_directory = tempfile.mkdtemp('-elodie-benchmark',
+                                         dir=argv[0] if argv else None)
+    try:
+        create_order_tree(working_directory, count, kilobytes)
+
+        filesystem = FileSystem()
+        entries = list(filesystem.scan_files(working_directory))
+        shuffled = list(entries)
+        random.Random(1).shuffle(shuffled)
+
+        print('%d files of %d KB' % (count, kilobytes))
+        print('%-8s %12s %12s' % ('order', 'MB/s', 'files/s'))
+        for order in ('random', 'path', 'inode', 'extent'):
+            if order == 'random':
+                files = [entry.path for entry in shuffled]
+            else:
+                files = [
+                    entry.path for entry in
+                    filesystem.order_files(entries, order, len(entries))
+                ]
+            size, seconds = read_files_cold(files)
+            print('%-8s %12.1f %12.1f' % (
+                order, size / seconds / 1e6, len(files) / seconds))
+    finally:
+        shutil.rmtree(working_directory)
+
+
+benchmarks = {
+    'checksum': benchmark_checksum,
+    'exiftool': benchmark_exiftool,
+    'hash-db': benchmark_hash_db,
+    'location-index': benchmark_location_index,
+    'order': benchmark_order,
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in benchmarks:
+        print('Usage: %s <%s> [args...]' % (argv[0], '|'.join(sorted(benchmarks))))
+        return 1
+
+    benchmarks[argv[1]](argv[2:])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))